@@ -1,13 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app.db import get_db
+from app.db import async_engine, async_pool_metrics, engine, get_db, pool_metrics
 from app.models.user import User
-from app.models.guide import StudyGuide
+from app.models.guide import GuideSource, StudyGuide
 from app.models.course import Course, Professor
 from app.models.verification import EmailVerification, PasswordResetToken
-from app.schemas.admin import AdminUserListItem
+from app.models.telemetry import LLMCall
+from app.schemas.admin import (
+    AdminUserListItem,
+    DBPoolResponse,
+    LLMUsageGroup,
+    LLMUsageResponse,
+    PromptCompressionGroup,
+    PromptCompressionResponse,
+)
 from app.schemas.guides import StudyGuideListItem
 from app.api.deps import get_current_admin_user
+from app.services.telemetry import usage_summary
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -69,6 +81,90 @@ def delete_user(
     db.query(Professor).filter(Professor.user_id == user_id).delete()
     db.query(EmailVerification).filter(EmailVerification.user_id == user_id).delete()
     db.query(PasswordResetToken).filter(PasswordResetToken.user_id == user_id).delete()
+    # Keep the user's LLM calls in the usage totals, detached from the account
+    db.query(LLMCall).filter(LLMCall.user_id == user_id).update({LLMCall.user_id: None})
     db.delete(user)
     db.commit()
     return {"message": "User deleted"}
+
+
+@router.get("/llm-usage", response_model=LLMUsageResponse)
+def llm_usage(
+    days: int = Query(7, ge=1, le=90),
+    group_by: Literal["day", "user", "call_site"] = "day",
+    limit: int | None = Query(None, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """
+    LLM calls over the last `days` days grouped by day, user or call site: call, error and
+    retry counts, token totals with estimated cost, and p50/p95/p99 latency (admin only).
+    """
+    groups = usage_summary(db, days, group_by, limit=limit)
+    return LLMUsageResponse(
+        days=days,
+        group_by=group_by,
+        groups=[LLMUsageGroup(**g) for g in groups],
+    )
+
+
+@router.get("/db-pool", response_model=DBPoolResponse)
+def db_pool(
+    kind: Literal["sync", "async"] = "sync",
+    current_user: User = Depends(get_current_admin_user),
+):
+    """
+    Connection pool state of this worker for the sync or async engine: size, connections in
+    use, checkout counts and wait times (admin only).
+    """
+    if kind == "async":
+        return DBPoolResponse(backend=async_engine.dialect.name, **async_pool_metrics.snapshot(async_engine.pool))
+    return DBPoolResponse(backend=engine.dialect.name, **pool_metrics.snapshot(engine.pool))
+
+
+@router.get("/prompt-compression", response_model=PromptCompressionResponse)
+def prompt_compression(
+    days: int = Query(30, ge=1, le=365),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Characters saved by boilerplate stripping in guides created over the last `days` days (admin only)."""
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    rows = (
+        db.query(
+            GuideSource.material_type,
+            func.count(GuideSource.id),
+            func.sum(GuideSource.prompt_chars_before),
+            func.sum(GuideSource.prompt_chars_after),
+        )
+        .join(StudyGuide, StudyGuide.id == GuideSource.guide_id)
+        .filter(StudyGuide.created_at >= since, GuideSource.prompt_chars_before.isnot(None))
+        .group_by(GuideSource.material_type)
+        .all()
+    )
+
+    def saved_pct(before: int, after: int) -> float:
+        return round(100 * (before - after) / before, 1) if before else 0.0
+
+    groups = [
+        PromptCompressionGroup(
+            material_type=mtype or "other",
+            sources=n,
+            chars_before=before or 0,
+            chars_after=after or 0,
+            saved_pct=saved_pct(before or 0, after or 0),
+        )
+        for mtype, n, before, after in rows
+    ]
+    before = sum(g.chars_before for g in groups)
+    after = sum(g.chars_after for g in groups)
+    return PromptCompressionResponse(
+        days=days,
+        sources=sum(g.sources for g in groups),
+        chars_before=before,
+        chars_after=after,
+        saved_chars=before - after,
+        saved_pct=saved_pct(before, after),
+        estimated_tokens_saved=(before - after) // 4,
+        by_material_type=sorted(groups, key=lambda g: g.chars_before - g.chars_after, reverse=True),
+    )
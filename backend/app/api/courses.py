@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import re
 import shutil
@@ -6,11 +7,13 @@ from pathlib import Path
 
 logger = logging.getLogger(__name__)
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse, Response
-from sqlalchemy import or_
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.config import get_settings, get_upload_base
-from app.db import get_db
+from app.db import SessionLocal, get_async_db, get_db
 from app.models.user import User
 from app.models.course import Professor, Course, CourseTest, CourseAttachment, CourseAttachmentTest, CourseAttachmentType, CourseTestAnalysis
 from app.models.guide import StudyGuide
@@ -31,9 +34,24 @@ from app.schemas.courses import (
     BlockGuideInfo,
     AttachmentUpdate,
     CourseTestAnalysisResponse,
+    CourseAnalysisResponse,
+    PastTestQuestionResponse,
 )
-from app.api.deps import get_current_user
-from app.services.file_parser import _resolve_file_path
+from app.api.deps import get_current_user, get_current_user_async
+from app.services.analysis_service import (
+    aggregate_professor_profile,
+    analyze_course_blocks,
+    analyze_test_block,
+    reassign_course_professor,
+    refresh_analysis_staleness,
+)
+from app.services.file_parser import _resolve_file_path, extract_text_from_bytes, extract_text_from_file
+from app.services.llm_client import LLMUnavailableError, StructuredOutputError
+from app.services.llm_providers import llm_configured
+from app.services.near_duplicates import find_attachment_duplicates
+from app.services.question_segmenter import store_questions
+from app.services.retrieval_index import sync_course_index
+from app.services import telemetry
 
 router = APIRouter(prefix="/courses", tags=["courses"])
 settings = get_settings()
@@ -130,6 +148,7 @@ def generate_professor_quiz(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    telemetry.bind_user(current_user.id)
     professor = db.query(Professor).filter(
         Professor.id == professor_id,
         Professor.user_id == current_user.id,
@@ -137,7 +156,7 @@ def generate_professor_quiz(
     if not professor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Professor not found")
     api_key = getattr(settings, "gemini_api_key", None) or ""
-    if not api_key:
+    if not llm_configured():
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Study guide quiz generation is not configured (missing API key).",
@@ -152,6 +171,10 @@ def generate_professor_quiz(
         )
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except StructuredOutputError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Could not generate quiz questions: {e}",
+        )
     quiz = {"questions": questions, "answers": {}}
     professor.study_guide_quiz = quiz
     db.commit()
@@ -261,7 +284,7 @@ def get_course_materials(
             course_id=t.course_id,
             name=t.name,
             sort_order=t.sort_order,
-            is_analyzed=analysis is not None,
+            is_analyzed=analysis is not None and not analysis.is_stale,
             analysis_summary=analysis.summary if analysis else None,
         ))
 
@@ -343,13 +366,14 @@ def delete_test(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    _get_course_or_404(course_id, current_user.id, db)
+    course = _get_course_or_404(course_id, current_user.id, db)
     test = db.query(CourseTest).filter(
         CourseTest.id == test_id,
         CourseTest.course_id == course_id,
     ).first()
     if not test:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Test section not found")
+    had_analysis = test.analysis is not None
     # Legacy single-assignment: move attachments to Uncategorized.
     for att in test.attachments:
         att.test_id = None
@@ -358,6 +382,29 @@ def delete_test(
     db.query(CourseAttachmentTest).filter(CourseAttachmentTest.test_id == test_id).delete(synchronize_session=False)
     db.delete(test)
     db.commit()
+    if had_analysis and course.professor_id:
+        aggregate_professor_profile(course.professor_id, db)
+
+
+@router.post("/{course_id}/analyze", response_model=CourseAnalysisResponse)
+def analyze_course(
+    course_id: int,
+    reanalyze: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Analyze every block that has both a past test and a handout/note in one job."""
+    telemetry.bind_user(current_user.id)
+    _get_course_or_404(course_id, current_user.id, db)
+    try:
+        return analyze_course_blocks(course_id, db, settings.gemini_api_key, reanalyze=reanalyze)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except LLMUnavailableError:
+        raise  # 503 with Retry-After (see main.py)
+    except Exception as e:
+        logger.exception("Course analysis failed for course_id=%s: %s", course_id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
 @router.post("/{course_id}/tests/{test_id}/analyze", response_model=CourseTestAnalysisResponse)
@@ -367,6 +414,7 @@ def analyze_test(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    telemetry.bind_user(current_user.id)
     _get_course_or_404(course_id, current_user.id, db)
     test = db.query(CourseTest).filter(
         CourseTest.id == test_id,
@@ -374,11 +422,14 @@ def analyze_test(
     ).first()
     if not test:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Test section not found")
-    from app.services.analysis_service import analyze_test_block
     try:
         analysis = analyze_test_block(test_id, db, settings.gemini_api_key)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    except LLMUnavailableError:
+        raise  # 503 with Retry-After (see main.py)
     except Exception as e:
         logger.exception("Analyze block failed for test_id=%s: %s", test_id, e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -433,7 +484,7 @@ def update_attachment(
     if body.allow_multiple_blocks is not None:
         att.allow_multiple_blocks = 1 if body.allow_multiple_blocks else 0
 
-    # When assignment to blocks changes, clear analysis for affected blocks so they are reanalyzed.
+    # When assignment to blocks changes, re-check analysis staleness for affected blocks.
     old_link_rows = db.query(CourseAttachmentTest).filter(CourseAttachmentTest.attachment_id == att.id).all()
     old_test_ids = {r.test_id for r in old_link_rows}
 
@@ -461,11 +512,9 @@ def update_attachment(
         # Keep legacy column aligned for now (first assigned test).
         att.test_id = unique[0] if unique else None
 
-        # Clear analysis for any block that gained or lost this file so the block is reanalyzed.
+        # Any block that gained or lost this file is reanalyzed only if its inputs actually changed.
         new_test_ids = set(unique)
-        affected_test_ids = old_test_ids | new_test_ids
-        if affected_test_ids:
-            db.query(CourseTestAnalysis).filter(CourseTestAnalysis.test_id.in_(affected_test_ids)).delete(synchronize_session=False)
+        refresh_analysis_staleness(old_test_ids | new_test_ids, db)
 
     if body.test_ids is not None:
         set_attachment_test_ids(body.test_ids or [])
@@ -519,6 +568,7 @@ def duplicate_attachment(
             file_path=att.file_path or copy_name,
             file_content=att.file_content,
             attachment_kind=att.attachment_kind,
+            content_hash=att.content_hash,
             allow_multiple_blocks=0,
         )
     else:
@@ -536,12 +586,14 @@ def duplicate_attachment(
             file_type=att.file_type,
             file_path=str(new_path),
             attachment_kind=att.attachment_kind,
+            content_hash=att.content_hash,
             allow_multiple_blocks=0,
         )
     db.add(new_att)
     db.flush()
     for tid in test_ids:
         db.add(CourseAttachmentTest(attachment_id=new_att.id, test_id=tid))
+    refresh_analysis_staleness(test_ids, db)
     db.commit()
     db.refresh(new_att)
     link_rows_new = db.query(CourseAttachmentTest).filter(CourseAttachmentTest.attachment_id == new_att.id).all()
@@ -565,16 +617,15 @@ def delete_attachment(
     ).first()
     if not att:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
-    # Clear analysis for every block that contained this file so those blocks are reanalyzed.
     link_rows = db.query(CourseAttachmentTest).filter(CourseAttachmentTest.attachment_id == att.id).all()
     affected_test_ids = [r.test_id for r in link_rows]
-    if affected_test_ids:
-        db.query(CourseTestAnalysis).filter(CourseTestAnalysis.test_id.in_(affected_test_ids)).delete(synchronize_session=False)
     path = _resolve_file_path(att.file_path)
     if path.is_file():
         path.unlink()
     # file_content is in DB only, no disk file to delete
     db.delete(att)
+    # Blocks that contained this file are marked stale unless an identical copy remains.
+    refresh_analysis_staleness(affected_test_ids, db)
     db.commit()
 
 
@@ -625,6 +676,35 @@ def get_attachment_file(
     return FileResponse(path, filename=att.file_name, media_type="application/octet-stream")
 
 
+@router.get("/{course_id}/attachments/{attachment_id}/questions", response_model=list[PastTestQuestionResponse])
+def get_attachment_questions(
+    course_id: int,
+    attachment_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Questions parsed from a past-test attachment (parsed on first request and after the file changes)."""
+    _get_course_or_404(course_id, current_user.id, db)
+    att = db.query(CourseAttachment).filter(
+        CourseAttachment.id == attachment_id,
+        CourseAttachment.course_id == course_id,
+    ).first()
+    if not att:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    if att.attachment_kind != CourseAttachmentType.PAST_TEST:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only past tests are parsed into questions")
+    content = getattr(att, "file_content", None)
+    if content is not None:
+        text = extract_text_from_bytes(content, att.file_type) or ""
+    elif _resolve_file_path(att.file_path).is_file():
+        text = extract_text_from_file(att.file_path, att.file_type) or ""
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    questions = store_questions(att, text, db)
+    db.commit()
+    return questions
+
+
 @router.get("/{course_id}/syllabus/file")
 def get_syllabus_file(
     course_id: int,
@@ -661,16 +741,32 @@ def _sanitize_filename(filename: str) -> str:
     return filename.strip() or "file"
 
 
+def _index_added_files(course_id: int, added_ids: list[int]) -> list[dict]:
+    """Index newly added files and find near-duplicates of existing attachments (runs in a worker thread)."""
+    db = SessionLocal()
+    try:
+        sync_course_index(course_id, db)
+        return find_attachment_duplicates(course_id, added_ids, db)
+    except Exception as e:
+        logger.warning("Near-duplicate check failed for course_id=%s: %s", course_id, e)
+        db.rollback()
+        return []
+    finally:
+        db.close()
+
+
 @router.post("/{course_id}/files")
 async def add_course_files(
     course_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async),
     handouts: list[UploadFile] = File(default=[]),
     past_tests: list[UploadFile] = File(default=[]),
     notes: list[UploadFile] = File(default=[]),
 ):
-    course = _get_course_or_404(course_id, current_user.id, db)
+    course = await db.scalar(select(Course).where(Course.id == course_id, Course.user_id == current_user.id))
+    if not course:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
     all_extra = [
         (h, CourseAttachmentType.HANDOUT) for h in (handouts or []) if h and h.filename
     ] + [
@@ -683,15 +779,17 @@ async def add_course_files(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No files provided. Add at least one file (handout, past test, or note).",
         )
-    existing_count = db.query(CourseAttachment).filter(CourseAttachment.course_id == course_id).count()
+    existing_count = await db.scalar(
+        select(func.count(CourseAttachment.id)).where(CourseAttachment.course_id == course_id)
+    )
     if existing_count + len(all_extra) > MAX_COURSE_FILES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Maximum {MAX_COURSE_FILES} total files per course. You have {existing_count}, adding {len(all_extra)} would exceed the limit.",
         )
-    max_order = db.query(CourseTest).filter(CourseTest.course_id == course_id).count()
+    max_order = await db.scalar(select(func.count(CourseTest.id)).where(CourseTest.course_id == course_id))
     sort_order = max_order
-    added = 0
+    added_ids: list[int] = []
     skipped_ext: list[str] = []
     skipped_size: list[str] = []
     for upload_file, kind in all_extra:
@@ -713,7 +811,7 @@ async def add_course_files(
                 sort_order=sort_order,
             )
             db.add(course_test)
-            db.flush()
+            await db.flush()
             test_id = course_test.id
             sort_order += 1
         att = CourseAttachment(
@@ -724,27 +822,34 @@ async def add_course_files(
             file_path=clean_name,
             file_content=content,
             attachment_kind=kind,
+            content_hash=hashlib.sha256(content).hexdigest(),
             allow_multiple_blocks=0,
         )
         db.add(att)
-        db.flush()
+        await db.flush()
         if test_id is not None:
             db.add(CourseAttachmentTest(attachment_id=att.id, test_id=test_id))
-        added += 1
+        added_ids.append(att.id)
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to save files: {e!s}",
         )
-    result: dict = {"ok": True, "added": added}
+    result: dict = {"ok": True, "added": len(added_ids)}
     if skipped_ext:
         result["skipped_unsupported"] = skipped_ext
     if skipped_size:
         result["skipped_too_large"] = skipped_size
-    if added == 0:
+    if added_ids:
+        # Index the new files now and warn about near-duplicates of existing attachments.
+        # Text extraction and indexing are CPU-bound, so they run off the event loop.
+        near_duplicates = await run_in_threadpool(_index_added_files, course.id, added_ids)
+        if near_duplicates:
+            result["near_duplicates"] = near_duplicates
+    if not added_ids:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=(
@@ -823,6 +928,7 @@ def update_course(
         if not nick:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nickname is required")
         course.nickname = nick
+    old_professor_id = course.professor_id
     if "professor_id" in body.model_dump(exclude_unset=True):
         if body.professor_id is None or body.professor_id == 0:
             course.professor_id = None
@@ -837,6 +943,8 @@ def update_course(
     if body.personal_description is not None:
         course.personal_description = (body.personal_description or "").strip() or None
     db.commit()
+    if course.professor_id != old_professor_id:
+        reassign_course_professor(course.id, old_professor_id, db)
     db.refresh(course)
     if course.professor:
         db.refresh(course.professor)
@@ -854,8 +962,8 @@ def update_course(
 
 @router.post("", response_model=CourseCreateResponse)
 async def create_course(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async),
     official_name: str = Form(...),
     nickname: str = Form(...),
     professor_id: int | None = Form(None),
@@ -874,10 +982,10 @@ async def create_course(
 
     professor = None
     if professor_id is not None:
-        professor = db.query(Professor).filter(
+        professor = await db.scalar(select(Professor).where(
             Professor.id == professor_id,
             Professor.user_id == current_user.id,
-        ).first()
+        ))
         if not professor:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Professor not found")
 
@@ -923,10 +1031,9 @@ async def create_course(
     )
     db.add(course)
     try:
-        db.commit()
-        db.refresh(course)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create course: {e!s}",
@@ -950,7 +1057,7 @@ async def create_course(
                 sort_order=sort_order,
             )
             db.add(course_test)
-            db.flush()
+            await db.flush()
             test_id = course_test.id
             sort_order += 1
         att = CourseAttachment(
@@ -961,25 +1068,24 @@ async def create_course(
             file_path=clean_name,
             file_content=content,
             attachment_kind=kind,
+            content_hash=hashlib.sha256(content).hexdigest(),
             allow_multiple_blocks=0,
         )
         db.add(att)
-        db.flush()
+        await db.flush()
         if test_id is not None:
             db.add(CourseAttachmentTest(attachment_id=att.id, test_id=test_id))
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to save course files: {e!s}",
         )
-    if course.professor:
-        db.refresh(course.professor)
     return CourseCreateResponse(
         id=course.id,
         official_name=course.official_name,
         nickname=course.nickname,
-        professor_name=course.professor.name if course.professor else None,
+        professor_name=professor.name if professor else None,
     )
@@ -1,8 +1,9 @@
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.config import get_settings
-from app.db import get_db
+from app.db import get_async_db, get_db
 from app.models.user import User
 from app.services.auth_service import decode_access_token
 
@@ -49,6 +50,20 @@ def get_current_user(
     return user
 
 
+async def get_current_user_async(
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+) -> User:
+    """get_current_user for async endpoints (loads the user through the async session)."""
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+        )
+    return user
+
+
 def get_current_admin_user(
     current_user: User = Depends(get_current_user),
 ) -> User:
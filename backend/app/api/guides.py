@@ -1,11 +1,16 @@
+import difflib
+import logging
 from pathlib import Path
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.config import get_settings
-from app.db import get_db
+from app.db import SessionLocal, get_async_db, get_db
 from app.models.user import User
-from app.models.guide import StudyGuide, GuideSource, StudyGuideOutput, GuideStatus
-from app.models.course import Course, Professor, CourseAttachment, CourseTest, CourseAttachmentTest, CourseTestAnalysis, CourseAttachmentType
+from app.models.guide import StudyGuide, GuideSource, StudyGuideOutput, GuideStatus, GuideSection, GuideSectionKind
+from app.models.course import Course, Professor, CourseAttachment, CourseAttachmentTest, CourseTestAnalysis, CourseAttachmentType
 from app.schemas.guides import (
     StudyGuideResponse,
     StudyGuideListItem,
@@ -15,11 +20,37 @@ from app.schemas.guides import (
     GuideOutputResponse,
     GuideSourceResponse,
     GuideOptionsResponse,
+    GuideRefreshResponse,
+    GuideSectionListResponse,
+    GuideSectionResponse,
+    GuideVersionDiffResponse,
+    GuideVersionListResponse,
+    GuideVersionResponse,
 )
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_current_user_async
 from app.services.file_parser import extract_text_from_file, extract_text_from_bytes
-from app.services.llm_service import generate_study_guide
+from app.services.analysis_service import analyze_course_blocks, eligible_test_ids
+from app.services.digest_service import DigestCache
+from app.services.near_duplicates import SignatureCache
+from app.services.prompt_compressor import CompressionStats
+from app.services.text_sanitizer import TEXT_NORMALIZATION_VERSION, ensure_normalized
+from app.services.llm_client import LLMUnavailableError
+from app.services.llm_service import GEMINI_MODEL, generate_study_guide, refresh_study_guide_sections
+from app.services.guide_sections import (
+    affected_topics,
+    load_guide_sections,
+    parse_guide_sections,
+    render_sections,
+    splice_sections,
+    store_guide_sections,
+    topic_key,
+)
+from app.services.guide_versions import list_versions, reconstruct_version, record_output_version
+from app.services.practice_bank import store_practice_questions
+from app.services.retrieval_index import BM25Index, build_relevance_query, sync_course_index, text_hash
+from app.services import telemetry
 
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/guides", tags=["guides"])
 settings = get_settings()
 MAX_SIZE = settings.max_file_size_mb * 1024 * 1024
@@ -33,6 +64,123 @@ def _ensure_upload_dir():
     return path
 
 
+def _build_professor_profile(user_id: int, professor_name: str, db: Session) -> dict | None:
+    """The professor's profile (and the student's quiz answers) for the system prompt, if the professor exists."""
+    if not professor_name:
+        return None
+    prof = (
+        db.query(Professor)
+        .filter(Professor.user_id == user_id, Professor.name == professor_name)
+        .first()
+    )
+    if not prof:
+        return None
+    professor_profile = {
+        "name": prof.name,
+        "specialties": prof.specialties,
+        "description": prof.description,
+    }
+    quiz_data = getattr(prof, "study_guide_quiz", None) or {}
+    qs = quiz_data.get("questions") or []
+    ans = quiz_data.get("answers") or {}
+    if qs and ans:
+        quiz_qa = [
+            {"question": next((q.get("text") or "" for q in qs if q.get("id") == qid), ""), "answer": ans.get(qid) or ""}
+            for qid in [q.get("id") for q in qs if q.get("id")]
+        ]
+        quiz_qa = [p for p in quiz_qa if (p.get("answer") or "").strip()]
+        if quiz_qa:
+            professor_profile["quiz_qa"] = quiz_qa
+    return professor_profile
+
+
+def _block_attachments(course_id: int, test_id: int | None, db: Session) -> list[CourseAttachment]:
+    """
+    Attachments of a course block (test_id None = uncategorized), in prompt order
+    (past_test, handout, note). Raises 400 when the block has no materials.
+    """
+    # Get attachment IDs for this block: either linked to test_id, or uncategorized (no links)
+    attachments = db.query(CourseAttachment).filter(
+        CourseAttachment.course_id == course_id,
+    ).all()
+    att_ids = [a.id for a in attachments]
+    if not att_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Course has no materials. Add handouts or notes to the block first.",
+        )
+
+    links = (
+        db.query(CourseAttachmentTest)
+        .filter(CourseAttachmentTest.attachment_id.in_(att_ids))
+        .all()
+    )
+    attachment_ids_by_test: dict[int | None, list[int]] = {}
+    for link in links:
+        attachment_ids_by_test.setdefault(link.test_id, []).append(link.attachment_id)
+    # Uncategorized = attachments not in any link (or we treat test_id=None as "in uncategorized")
+    uncategorized_att_ids = set(att_ids) - {aid for link in links for aid in [link.attachment_id]}
+
+    if test_id is not None:
+        block_att_ids = set(attachment_ids_by_test.get(test_id, []))
+    else:
+        block_att_ids = uncategorized_att_ids
+
+    block_attachments = [a for a in attachments if a.id in block_att_ids]
+    if not block_attachments:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This block has no materials. Add handouts or notes first.",
+        )
+    kind_order = {CourseAttachmentType.PAST_TEST: 0, CourseAttachmentType.HANDOUT: 1, CourseAttachmentType.NOTE: 2}
+    block_attachments.sort(key=lambda a: (kind_order.get(a.attachment_kind, 99), a.id))
+    return block_attachments
+
+
+def _store_compression_stats(sources: list[GuideSource], stats: list[CompressionStats]) -> None:
+    """Record each source's prompt size before / after boilerplate stripping (matched by file name)."""
+    by_label = {st.label: st for st in stats}
+    for src in sources:
+        st = by_label.get(src.file_name)
+        if st is not None:
+            src.prompt_chars_before = st.chars_before
+            src.prompt_chars_after = st.chars_after
+
+
+def _collect_block_analyses(course_obj: Course, db: Session, api_key: str) -> tuple[list[dict], dict | None]:
+    """
+    Analyses of the course's eligible blocks (analyzing missing ones in one batch) and the
+    professor's aggregated profile. Analysis failures never block guide generation.
+    """
+    try:
+        analyses = analyze_course_blocks(course_obj.id, db, api_key).analyses
+    except Exception as e:
+        logger.warning("Block analysis failed for course_id=%s: %s", course_obj.id, e)
+        test_ids = eligible_test_ids(course_obj.id, db)
+        analyses = (
+            db.query(CourseTestAnalysis).filter(
+                CourseTestAnalysis.test_id.in_(test_ids),
+                CourseTestAnalysis.is_stale == 0,
+            ).all()
+            if test_ids else []
+        )
+    block_analyses = [
+        {
+            "summary": a.summary,
+            "high_signal_handouts": a.high_signal_handouts,
+            "topic_frequency": a.topic_frequency,
+            "question_formats": a.question_formats,
+        }
+        for a in analyses
+    ]
+    professor_analysis = None
+    if course_obj.professor_id:
+        prof_obj = db.query(Professor).filter(Professor.id == course_obj.professor_id).first()
+        if prof_obj and prof_obj.analysis_profile:
+            professor_analysis = prof_obj.analysis_profile
+    return block_analyses, professor_analysis
+
+
 @router.get("", response_model=list[StudyGuideListItem])
 def list_my_guides(
     db: Session = Depends(get_db),
@@ -94,6 +242,7 @@ def create_guide_from_block(
     current_user: User = Depends(get_current_user),
 ):
     """Create a study guide from a course block's materials (no new file uploads)."""
+    telemetry.bind_user(current_user.id)
     if not getattr(current_user, "email_verified", False):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -114,44 +263,11 @@ def create_guide_from_block(
         if prof:
             professor_name = prof.name or ""
 
-    # Get attachment IDs for this block: either linked to test_id, or uncategorized (no links)
-    attachments = db.query(CourseAttachment).filter(
-        CourseAttachment.course_id == body.course_id,
-    ).all()
-    att_ids = [a.id for a in attachments]
-    if not att_ids:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Course has no materials. Add handouts or notes to the block first.",
-        )
-
-    links = (
-        db.query(CourseAttachmentTest)
-        .filter(CourseAttachmentTest.attachment_id.in_(att_ids))
-        .all()
-    )
-    attachment_ids_by_test: dict[int | None, list[int]] = {}
-    for link in links:
-        attachment_ids_by_test.setdefault(link.test_id, []).append(link.attachment_id)
-    # Uncategorized = attachments not in any link (or we treat test_id=None as "in uncategorized")
-    uncategorized_att_ids = set(att_ids) - {aid for link in links for aid in [link.attachment_id]}
-
-    if body.test_id is not None:
-        block_att_ids = set(attachment_ids_by_test.get(body.test_id, []))
-    else:
-        block_att_ids = uncategorized_att_ids
-
-    block_attachments = [a for a in attachments if a.id in block_att_ids]
-    if not block_attachments:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This block has no materials. Add handouts or notes first.",
-        )
+    block_attachments = _block_attachments(body.course_id, body.test_id, db)
 
     # Build typed_sources from existing files (past_test, handout, note order)
-    kind_order = {CourseAttachmentType.PAST_TEST: 0, CourseAttachmentType.HANDOUT: 1, CourseAttachmentType.NOTE: 2}
-    block_attachments.sort(key=lambda a: (kind_order.get(a.attachment_kind, 99), a.id))
     typed_sources: list[tuple[str, str, str]] = []
+    texts_by_attachment: dict[int, str] = {}
     guide = StudyGuide(
         user_id=current_user.id,
         title=(body.title or "").strip() or "Untitled Guide",
@@ -170,27 +286,33 @@ def create_guide_from_block(
         for att in block_attachments:
             content = getattr(att, "file_content", None)
             if content is not None:
-                text = extract_text_from_bytes(content, att.file_type or "") or "(no text extracted)"
+                texts_by_attachment[att.id] = extract_text_from_bytes(content, att.file_type or "") or ""
+                text = texts_by_attachment[att.id] or "(no text extracted)"
                 source = GuideSource(
                     guide_id=guide.id,
+                    attachment_id=att.id,
                     file_name=att.file_name,
                     file_type=att.file_type,
                     file_path=att.file_name,
                     file_content=content,
                     extracted_text=text,
+                    text_version=TEXT_NORMALIZATION_VERSION,
                     material_type=att.attachment_kind,
                 )
             else:
                 path = Path(att.file_path)
                 if not path.exists():
                     continue
-                text = extract_text_from_file(path, att.file_type or "") or "(no text extracted)"
+                texts_by_attachment[att.id] = extract_text_from_file(path, att.file_type or "") or ""
+                text = texts_by_attachment[att.id] or "(no text extracted)"
                 source = GuideSource(
                     guide_id=guide.id,
+                    attachment_id=att.id,
                     file_name=att.file_name,
                     file_type=att.file_type,
                     file_path=str(path),
                     extracted_text=text,
+                    text_version=TEXT_NORMALIZATION_VERSION,
                     material_type=att.attachment_kind,
                 )
             db.add(source)
@@ -204,30 +326,7 @@ def create_guide_from_block(
                 detail="Could not read any files from the block.",
             )
 
-        professor_profile = None
-        if professor_name:
-            prof = (
-                db.query(Professor)
-                .filter(Professor.user_id == current_user.id, Professor.name == professor_name)
-                .first()
-            )
-            if prof:
-                professor_profile = {
-                    "name": prof.name,
-                    "specialties": prof.specialties,
-                    "description": prof.description,
-                }
-                quiz_data = getattr(prof, "study_guide_quiz", None) or {}
-                qs = quiz_data.get("questions") or []
-                ans = quiz_data.get("answers") or {}
-                if qs and ans:
-                    quiz_qa = [
-                        {"question": next((q.get("text") or "" for q in qs if q.get("id") == qid), ""), "answer": ans.get(qid) or ""}
-                        for qid in [q.get("id") for q in qs if q.get("id")]
-                    ]
-                    quiz_qa = [p for p in quiz_qa if (p.get("answer") or "").strip()]
-                    if quiz_qa:
-                        professor_profile["quiz_qa"] = quiz_qa
+        professor_profile = _build_professor_profile(current_user.id, professor_name, db)
 
         api_key = settings.gemini_api_key
         block_analyses = []
@@ -240,47 +339,21 @@ def create_guide_from_block(
                 .first()
             )
             if course_obj:
-                from app.services.analysis_service import analyze_test_block
-                tests = db.query(CourseTest).filter(CourseTest.course_id == course_obj.id).all()
-                for test in tests:
-                    link_rows = db.query(CourseAttachmentTest).filter(
-                        CourseAttachmentTest.test_id == test.id,
-                    ).all()
-                    att_ids_t = [r.attachment_id for r in link_rows]
-                    if not att_ids_t:
-                        continue
-                    atts = db.query(CourseAttachment).filter(
-                        CourseAttachment.id.in_(att_ids_t),
-                    ).all()
-                    has_past_test = any(a.attachment_kind == CourseAttachmentType.PAST_TEST for a in atts)
-                    has_handout = any(
-                        a.attachment_kind in (CourseAttachmentType.HANDOUT, CourseAttachmentType.NOTE)
-                        for a in atts
-                    )
-                    if not (has_past_test and has_handout):
-                        continue
-                    existing = db.query(CourseTestAnalysis).filter(
-                        CourseTestAnalysis.test_id == test.id,
-                    ).first()
-                    if not existing:
-                        try:
-                            existing = analyze_test_block(test.id, db, api_key)
-                        except Exception:
-                            pass
-                    if existing:
-                        block_analyses.append({
-                            "summary": existing.summary,
-                            "high_signal_handouts": existing.high_signal_handouts,
-                            "topic_frequency": existing.topic_frequency,
-                            "question_formats": existing.question_formats,
-                        })
-                if course_obj.professor_id:
-                    prof_obj = db.query(Professor).filter(
-                        Professor.id == course_obj.professor_id,
-                    ).first()
-                    if prof_obj and prof_obj.analysis_profile:
-                        professor_analysis = prof_obj.analysis_profile
+                block_analyses, professor_analysis = _collect_block_analyses(course_obj, db, api_key)
 
+        relevance_query = build_relevance_query(
+            [t for kind, _, t in typed_sources if kind == CourseAttachmentType.PAST_TEST],
+            guide.user_specs,
+        )
+        db.commit()  # persist sources first so an index failure cannot roll them back
+        try:
+            relevance_index = sync_course_index(course.id, db, texts_by_attachment)
+        except Exception as e:
+            logger.warning("Course index sync failed for course_id=%s: %s", course.id, e)
+            db.rollback()
+            relevance_index = None
+
+        compression_stats: list[CompressionStats] = []
         content, model_used = generate_study_guide(
             course=guide_course_str,
             professor_name=guide.professor_name,
@@ -290,13 +363,23 @@ def create_guide_from_block(
             api_key=api_key,
             block_analyses=block_analyses or None,
             professor_analysis=professor_analysis,
+            relevance_query=relevance_query,
+            relevance_index=relevance_index,
+            digest_cache=DigestCache(db, model_used=GEMINI_MODEL),
+            signature_cache=SignatureCache(db),
+            compression_stats=compression_stats,
         )
+        _store_compression_stats(guide.sources, compression_stats)
         output = StudyGuideOutput(
             guide_id=guide.id,
             content=content,
             model_used=model_used,
         )
-        db.add(output)
+        guide.output = output
+        record_output_version(guide, content, model_used, db)
+        sections = parse_guide_sections(content, [label for _, label, _ in typed_sources])
+        store_guide_sections(guide.id, sections, db)
+        store_practice_questions(guide, sections, db)
         guide.status = GuideStatus.completed.value
         db.commit()
         db.refresh(guide)
@@ -314,6 +397,10 @@ def create_guide_from_block(
         )
     except HTTPException:
         raise
+    except LLMUnavailableError:
+        guide.status = GuideStatus.failed.value
+        db.commit()
+        raise  # 503 with Retry-After (see main.py)
     except Exception as e:
         guide.status = GuideStatus.failed.value
         db.commit()
@@ -326,9 +413,11 @@ def create_guide_from_block(
 @router.get("/{guide_id}", response_model=StudyGuideResponse)
 def get_guide(
     guide_id: int,
+    include_content: bool = True,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    """The guide with its full Markdown; include_content=false leaves it out (fetch sections instead)."""
     guide = db.query(StudyGuide).filter(StudyGuide.id == guide_id, StudyGuide.user_id == current_user.id).first()
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
@@ -336,7 +425,7 @@ def get_guide(
     if guide.output:
         out = GuideOutputResponse(
             id=guide.output.id,
-            content=guide.output.content,
+            content=guide.output.content if include_content else None,
             model_used=guide.output.model_used,
             created_at=guide.output.created_at,
         )
@@ -354,6 +443,147 @@ def get_guide(
     )
 
 
+def _section_query(guide_id: int, include_content: bool, db: Session):
+    columns = [
+        GuideSection.position, GuideSection.kind, GuideSection.title, GuideSection.priority,
+        GuideSection.sources, func.length(GuideSection.content).label("chars"),
+    ]
+    if include_content:
+        columns.append(GuideSection.content)
+    return db.query(*columns).filter(GuideSection.guide_id == guide_id).order_by(GuideSection.position)
+
+
+def _section_response(row) -> GuideSectionResponse:
+    return GuideSectionResponse(
+        position=row.position,
+        kind=row.kind,
+        title=row.title or "",
+        priority=row.priority,
+        sources=row.sources,
+        chars=row.chars or 0,
+        content=getattr(row, "content", None),
+    )
+
+
+@router.get("/{guide_id}/sections", response_model=GuideSectionListResponse)
+def list_guide_sections(
+    guide_id: int,
+    kind: str | None = None,
+    include_content: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    The guide's sections in document order (overview, topics, at-a-glance checklist, practice
+    questions, coverage gaps), without their Markdown unless include_content is set.
+    kind filters to one section kind, e.g. kind=at_a_glance&include_content=true.
+    """
+    guide = db.query(StudyGuide).filter(StudyGuide.id == guide_id, StudyGuide.user_id == current_user.id).first()
+    if not guide:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
+    query = _section_query(guide.id, include_content, db)
+    if kind:
+        query = query.filter(GuideSection.kind == kind)
+    return GuideSectionListResponse(
+        guide_id=guide.id,
+        status=guide.status,
+        sections=[_section_response(r) for r in query.all()],
+    )
+
+
+@router.get("/{guide_id}/sections/{position}", response_model=GuideSectionResponse)
+def get_guide_section(
+    guide_id: int,
+    position: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """One section of the guide, with its Markdown. Positions come from the section list."""
+    guide = db.query(StudyGuide).filter(StudyGuide.id == guide_id, StudyGuide.user_id == current_user.id).first()
+    if not guide:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
+    row = _section_query(guide.id, True, db).filter(GuideSection.position == position).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Section not found")
+    return _section_response(row)
+
+
+def _guide_with_output(guide_id: int, user: User, db: Session) -> StudyGuide:
+    guide = db.query(StudyGuide).filter(StudyGuide.id == guide_id, StudyGuide.user_id == user.id).first()
+    if not guide:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
+    if not guide.output:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide has no output yet")
+    return guide
+
+
+def _version_text(guide: StudyGuide, version: int, db: Session):
+    try:
+        return reconstruct_version(guide, version, db)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        logger.error("Guide version rebuild failed: %s", e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.get("/{guide_id}/versions", response_model=GuideVersionListResponse)
+def list_guide_versions(
+    guide_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Every version of the guide's output, newest first, with the bytes each one costs to keep."""
+    guide = _guide_with_output(guide_id, current_user, db)
+    versions = [GuideVersionResponse(**v) for v in list_versions(guide, db)]
+    if not versions:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide has no versions")
+    return GuideVersionListResponse(guide_id=guide.id, latest_version=versions[0].version, versions=versions)
+
+
+@router.get("/{guide_id}/versions/{version}", response_model=GuideVersionResponse)
+def get_guide_version(
+    guide_id: int,
+    version: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """One version of the guide's output, rebuilt from the stored deltas."""
+    guide = _guide_with_output(guide_id, current_user, db)
+    row, content = _version_text(guide, version, db)
+    return GuideVersionResponse(
+        version=row.version,
+        storage=row.storage,
+        chars=row.chars,
+        stored_bytes=len(row.data or b""),
+        model_used=row.model_used,
+        created_at=row.created_at,
+        content=content,
+    )
+
+
+@router.get("/{guide_id}/versions/{version}/diff", response_model=GuideVersionDiffResponse)
+def diff_guide_versions(
+    guide_id: int,
+    version: int,
+    against: int | None = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Unified diff of a version against another (default: the version before it)."""
+    guide = _guide_with_output(guide_id, current_user, db)
+    against = version - 1 if against is None else against
+    _, new_text = _version_text(guide, version, db)
+    _, old_text = _version_text(guide, against, db)
+    diff = difflib.unified_diff(
+        old_text.splitlines(keepends=True),
+        new_text.splitlines(keepends=True),
+        fromfile=f"v{against}",
+        tofile=f"v{version}",
+    )
+    return GuideVersionDiffResponse(guide_id=guide.id, version=version, against=against, diff="".join(diff))
+
+
 @router.patch("/{guide_id}", response_model=StudyGuideResponse)
 def update_guide(
     guide_id: int,
@@ -392,10 +622,279 @@ def update_guide(
     )
 
 
-@router.post("", response_model=CreateGuideResponse)
-async def create_guide(
+@router.post("/{guide_id}/refresh", response_model=GuideRefreshResponse)
+def refresh_guide(
+    guide_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
+):
+    """
+    Bring a block guide up to date with the block's current materials. Only the topics whose
+    sources were added, changed or removed are regenerated, along with the Overview and the
+    at-a-glance list; everything else in the guide is kept as is.
+    """
+    telemetry.bind_user(current_user.id)
+    guide = db.query(StudyGuide).filter(StudyGuide.id == guide_id, StudyGuide.user_id == current_user.id).first()
+    if not guide:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
+    if guide.course_id is None or not guide.output or guide.status != GuideStatus.completed.value:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only completed guides created from a course block can be refreshed.",
+        )
+    course = db.query(Course).filter(Course.id == guide.course_id, Course.user_id == current_user.id).first()
+    if not course:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
+
+    # Current block materials and the guide's copies of them, keyed by attachment id: two
+    # attachments may share a file name. File names stay the labels of prompts and topics.
+    current: dict[int, tuple[CourseAttachment, str, bytes | None]] = {}
+    texts_by_attachment: dict[int, str] = {}
+    for att in _block_attachments(course.id, guide.test_id, db):
+        content = getattr(att, "file_content", None)
+        if content is not None:
+            text = extract_text_from_bytes(content, att.file_type or "") or ""
+        else:
+            path = Path(att.file_path)
+            if not path.exists():
+                continue
+            text = extract_text_from_file(path, att.file_type or "") or ""
+        texts_by_attachment[att.id] = text
+        current[att.id] = (att, text or "(no text extracted)", content)
+
+    old_sources = {src.attachment_id: src for src in guide.sources if src.attachment_id is not None}
+    # Copies whose attachment is unknown (deleted before attachment ids were recorded) are dropped
+    orphaned = [src for src in guide.sources if src.attachment_id is None]
+    added_ids = [aid for aid in current if aid not in old_sources]
+    removed_ids = [aid for aid in old_sources if aid not in current]
+    changed_ids = [
+        aid for aid in current
+        if aid in old_sources
+        and text_hash(current[aid][1]) != text_hash(
+            ensure_normalized(old_sources[aid].extracted_text, old_sources[aid].text_version)
+        )
+    ]
+    added = [current[aid][0].file_name for aid in added_ids]
+    removed = [old_sources[aid].file_name for aid in removed_ids] + [src.file_name for src in orphaned]
+    changed = [current[aid][0].file_name for aid in changed_ids]
+
+    def output_response() -> GuideOutputResponse:
+        return GuideOutputResponse(
+            id=guide.output.id,
+            content=guide.output.content,
+            model_used=guide.output.model_used,
+            created_at=guide.output.created_at,
+        )
+
+    if not (added or removed or changed):
+        return GuideRefreshResponse(id=guide.id, status=guide.status, mode="unchanged", output=output_response())
+
+    labels = [att.file_name for att, _, _ in current.values()]
+    sections = load_guide_sections(guide.id, db) or parse_guide_sections(
+        guide.output.content, [src.file_name for src in guide.sources]
+    )
+    topics = [s for s in sections if s["kind"] == GuideSectionKind.TOPIC]
+    affected = affected_topics(sections, set(changed) | set(removed))
+    affected_keys = {id(s) for s in affected}
+    # Unattributed topics could draw on any source, so they need every source; otherwise only
+    # the past tests (they set priorities) and the sources behind the rewritten topics.
+    if not topics or any(not s.get("sources") for s in affected):
+        prompt_labels = set(labels)
+    else:
+        prompt_labels = set(added) | set(changed) | {
+            name for s in affected for name in s["sources"] if name in labels
+        } | {att.file_name for att, _, _ in current.values() if att.attachment_kind == CourseAttachmentType.PAST_TEST}
+    typed_sources = [
+        (att.attachment_kind, att.file_name, text) for att, text, _ in current.values() if att.file_name in prompt_labels
+    ]
+
+    try:
+        api_key = settings.gemini_api_key
+        professor_profile = _build_professor_profile(current_user.id, guide.professor_name, db)
+        block_analyses, professor_analysis = _collect_block_analyses(course, db, api_key)
+        relevance_query = build_relevance_query(
+            [t for kind, _, t in typed_sources if kind == CourseAttachmentType.PAST_TEST],
+            guide.user_specs,
+        )
+        try:
+            relevance_index = sync_course_index(course.id, db, texts_by_attachment)
+        except Exception as e:
+            logger.warning("Course index sync failed for course_id=%s: %s", course.id, e)
+            db.rollback()
+            relevance_index = None
+
+        compression_stats: list[CompressionStats] = []
+        if topics:
+            mode = "partial"
+            regenerated = [s["title"] for s in affected]
+            markdown, model_used = refresh_study_guide_sections(
+                course=guide.course,
+                professor_name=guide.professor_name,
+                user_specs=guide.user_specs,
+                typed_sources=typed_sources,
+                professor_profile=professor_profile,
+                api_key=api_key,
+                topics_to_rewrite=regenerated,
+                kept_topics=[(s["title"], s.get("priority")) for s in topics if id(s) not in affected_keys],
+                changed_sources=added + changed + removed,
+                block_analyses=block_analyses or None,
+                professor_analysis=professor_analysis,
+                relevance_query=relevance_query,
+                relevance_index=relevance_index,
+                signature_cache=SignatureCache(db),
+                compression_stats=compression_stats,
+            )
+            new_sections = parse_guide_sections(markdown, labels)
+            kept_keys = {topic_key(s["title"]) for s in topics if id(s) not in affected_keys}
+            sections = splice_sections(sections, new_sections, regenerated)
+            regenerated = [
+                s["title"] for s in new_sections
+                if s["kind"] == GuideSectionKind.TOPIC and topic_key(s["title"]) not in kept_keys
+            ]
+            content = render_sections(sections)
+        else:
+            # The guide has no parsed topics (not in the standard format): regenerate it fully
+            mode = "full"
+            content, model_used = generate_study_guide(
+                course=guide.course,
+                professor_name=guide.professor_name,
+                user_specs=guide.user_specs,
+                typed_sources=typed_sources,
+                professor_profile=professor_profile,
+                api_key=api_key,
+                block_analyses=block_analyses or None,
+                professor_analysis=professor_analysis,
+                relevance_query=relevance_query,
+                relevance_index=relevance_index,
+                digest_cache=DigestCache(db, model_used=GEMINI_MODEL),
+                signature_cache=SignatureCache(db),
+                compression_stats=compression_stats,
+            )
+            sections = parse_guide_sections(content, labels)
+            regenerated = [s["title"] for s in sections if s["kind"] == GuideSectionKind.TOPIC]
+    except HTTPException:
+        raise
+    except LLMUnavailableError:
+        raise  # 503 with Retry-After (see main.py)
+    except Exception as e:
+        logger.exception("Guide refresh failed for guide_id=%s: %s", guide.id, e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    # Bring the guide's source rows in line with the block
+    source_rows = {aid: src for aid, src in old_sources.items() if aid not in removed_ids}
+    for src in [old_sources[aid] for aid in removed_ids] + orphaned:
+        db.delete(src)
+    for aid in changed_ids + added_ids:
+        att, text, file_bytes = current[aid]
+        src = source_rows.setdefault(aid, GuideSource(guide_id=guide.id, attachment_id=aid))
+        src.file_name = att.file_name
+        src.file_type = att.file_type
+        src.file_path = att.file_name if file_bytes is not None else att.file_path
+        src.file_content = file_bytes
+        src.extracted_text = text
+        src.text_version = TEXT_NORMALIZATION_VERSION
+        src.material_type = att.attachment_kind
+        db.add(src)
+    _store_compression_stats(list(source_rows.values()), compression_stats)
+
+    record_output_version(guide, content, model_used, db)
+    guide.output.content = content
+    guide.output.model_used = model_used
+    store_guide_sections(guide.id, sections, db)
+    store_practice_questions(guide, sections, db)
+    db.commit()
+    db.refresh(guide)
+    return GuideRefreshResponse(
+        id=guide.id,
+        status=guide.status,
+        mode=mode,
+        added_sources=added,
+        removed_sources=removed,
+        changed_sources=changed,
+        regenerated_topics=regenerated,
+        output=output_response(),
+    )
+
+
+def _generate_uploaded_guide(guide_id: int, typed_sources: list[tuple[str, str, str]], professor_profile: dict | None) -> CreateGuideResponse:
+    """
+    Generation half of create_guide, run in a worker thread with its own session: block
+    analyses, the LLM call and storing the output. LLM errors propagate to the caller.
+    """
+    db = SessionLocal()
+    try:
+        guide = db.query(StudyGuide).filter(StudyGuide.id == guide_id).first()
+        api_key = settings.gemini_api_key
+
+        # Collect test-handout analyses for this course (auto-analyzing missing ones)
+        block_analyses: list[dict] = []
+        professor_analysis: dict | None = None
+        guide_course_str = getattr(guide, "course", "") or ""
+        if guide_course_str:
+            course_obj = db.query(Course).filter(
+                Course.user_id == guide.user_id,
+                Course.nickname == guide_course_str,
+            ).first()
+            if course_obj:
+                block_analyses, professor_analysis = _collect_block_analyses(course_obj, db, api_key)
+
+        # Uploaded files are not course attachments: index them ad hoc for this prompt only
+        relevance_query = build_relevance_query(
+            [t for kind, _, t in typed_sources if kind == "past_test"],
+            guide.user_specs,
+        )
+        relevance_index = BM25Index.from_texts([t for _, _, t in typed_sources])
+
+        compression_stats: list[CompressionStats] = []
+        content, model_used = generate_study_guide(
+            course=guide_course_str,
+            professor_name=guide.professor_name,
+            user_specs=guide.user_specs,
+            typed_sources=typed_sources,
+            professor_profile=professor_profile,
+            api_key=api_key,
+            block_analyses=block_analyses or None,
+            professor_analysis=professor_analysis,
+            relevance_query=relevance_query,
+            relevance_index=relevance_index,
+            digest_cache=DigestCache(db, model_used=GEMINI_MODEL),
+            signature_cache=SignatureCache(db),
+            compression_stats=compression_stats,
+        )
+        _store_compression_stats(guide.sources, compression_stats)
+        output = StudyGuideOutput(
+            guide_id=guide.id,
+            content=content,
+            model_used=model_used,
+        )
+        guide.output = output
+        record_output_version(guide, content, model_used, db)
+        sections = parse_guide_sections(content, [label for _, label, _ in typed_sources])
+        store_guide_sections(guide.id, sections, db)
+        store_practice_questions(guide, sections, db)
+        guide.status = GuideStatus.completed.value
+        db.commit()
+        db.refresh(guide)
+        db.refresh(output)
+        return CreateGuideResponse(
+            id=guide.id,
+            title=guide.title,
+            status=guide.status,
+            output=GuideOutputResponse(
+                id=output.id,
+                content=output.content,
+                model_used=output.model_used,
+                created_at=output.created_at,
+            ),
+        )
+    finally:
+        db.close()
+
+
+@router.post("", response_model=CreateGuideResponse)
+async def create_guide(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_async),
     title: str = Form("Untitled Guide"),
     course: str = Form(""),
     professor_name: str = Form(""),
@@ -405,6 +904,12 @@ async def create_guide(
     study_guides: list[UploadFile] = File(default=[]),
     notes: list[UploadFile] = File(default=[]),
 ):
+    """
+    Create a guide from uploaded files. Database work goes through the async session; text
+    extraction and generation (CPU and a long LLM call) run in worker threads, so the event
+    loop keeps serving other requests meanwhile.
+    """
+    telemetry.bind_user(current_user.id)
     if not getattr(current_user, "email_verified", False):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -425,30 +930,9 @@ async def create_guide(
         )
 
     # Look up the professor's full profile so it can be injected into the system prompt
-    professor_profile: dict | None = None
-    if professor_name:
-        prof = (
-            db.query(Professor)
-            .filter(Professor.user_id == current_user.id, Professor.name == professor_name)
-            .first()
-        )
-        if prof:
-            professor_profile = {
-                "name": prof.name,
-                "specialties": prof.specialties,
-                "description": prof.description,
-            }
-            quiz_data = getattr(prof, "study_guide_quiz", None) or {}
-            qs = quiz_data.get("questions") or []
-            ans = quiz_data.get("answers") or {}
-            if qs and ans:
-                quiz_qa = [
-                    {"question": next((q.get("text") or "" for q in qs if q.get("id") == qid), ""), "answer": ans.get(qid) or ""}
-                    for qid in [q.get("id") for q in qs if q.get("id")]
-                ]
-                quiz_qa = [p for p in quiz_qa if (p.get("answer") or "").strip()]
-                if quiz_qa:
-                    professor_profile["quiz_qa"] = quiz_qa
+    professor_profile = await db.run_sync(
+        lambda session: _build_professor_profile(current_user.id, professor_name, session)
+    )
 
     guide = StudyGuide(
         user_id=current_user.id,
@@ -459,8 +943,7 @@ async def create_guide(
         status=GuideStatus.processing.value,
     )
     db.add(guide)
-    db.commit()
-    db.refresh(guide)
+    await db.commit()
 
     # (material_type, label, text) — order matters: past_tests feed first into the prompt
     typed_sources: list[tuple[str, str, str]] = []
@@ -478,7 +961,7 @@ async def create_guide(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"File {f.filename} exceeds {settings.max_file_size_mb} MB",
                 )
-            text = extract_text_from_bytes(content, ext)
+            text = await run_in_threadpool(extract_text_from_bytes, content, ext)
             source = GuideSource(
                 guide_id=guide.id,
                 file_name=f.filename,
@@ -486,103 +969,25 @@ async def create_guide(
                 file_path=f.filename,
                 file_content=content,
                 extracted_text=text,
+                text_version=TEXT_NORMALIZATION_VERSION,
                 material_type=material_type,
             )
             db.add(source)
-            db.commit()
+            await db.commit()
             typed_sources.append((material_type, f.filename, text or "(no text extracted)"))
 
-        api_key = settings.gemini_api_key
-
-        # Collect test-handout analyses for this course (auto-analyzing missing ones)
-        block_analyses: list[dict] = []
-        professor_analysis: dict | None = None
-        guide_course_str = getattr(guide, "course", "") or ""
-        if guide_course_str:
-            course_obj = db.query(Course).filter(
-                Course.user_id == current_user.id,
-                Course.nickname == guide_course_str,
-            ).first()
-            if course_obj:
-                from app.services.analysis_service import analyze_test_block
-                tests = db.query(CourseTest).filter(CourseTest.course_id == course_obj.id).all()
-                for test in tests:
-                    link_rows = db.query(CourseAttachmentTest).filter(
-                        CourseAttachmentTest.test_id == test.id
-                    ).all()
-                    att_ids = [r.attachment_id for r in link_rows]
-                    if not att_ids:
-                        continue
-                    atts = db.query(CourseAttachment).filter(
-                        CourseAttachment.id.in_(att_ids)
-                    ).all()
-                    has_past_test = any(a.attachment_kind == CourseAttachmentType.PAST_TEST for a in atts)
-                    has_handout = any(
-                        a.attachment_kind in (CourseAttachmentType.HANDOUT, CourseAttachmentType.NOTE)
-                        for a in atts
-                    )
-                    if not (has_past_test and has_handout):
-                        continue
-                    existing = db.query(CourseTestAnalysis).filter(
-                        CourseTestAnalysis.test_id == test.id
-                    ).first()
-                    if not existing:
-                        try:
-                            existing = analyze_test_block(test.id, db, api_key)
-                        except Exception:
-                            pass
-                    if existing:
-                        block_analyses.append({
-                            "summary": existing.summary,
-                            "high_signal_handouts": existing.high_signal_handouts,
-                            "topic_frequency": existing.topic_frequency,
-                            "question_formats": existing.question_formats,
-                        })
-                if course_obj.professor_id:
-                    prof_obj = db.query(Professor).filter(
-                        Professor.id == course_obj.professor_id
-                    ).first()
-                    if prof_obj and prof_obj.analysis_profile:
-                        professor_analysis = prof_obj.analysis_profile
-
-        content, model_used = generate_study_guide(
-            course=guide_course_str,
-            professor_name=guide.professor_name,
-            user_specs=guide.user_specs,
-            typed_sources=typed_sources,
-            professor_profile=professor_profile,
-            api_key=api_key,
-            block_analyses=block_analyses or None,
-            professor_analysis=professor_analysis,
-        )
-        output = StudyGuideOutput(
-            guide_id=guide.id,
-            content=content,
-            model_used=model_used,
-        )
-        db.add(output)
-        guide.status = GuideStatus.completed.value
-        db.commit()
-        db.refresh(guide)
-        db.refresh(output)
-        return CreateGuideResponse(
-            id=guide.id,
-            title=guide.title,
-            status=guide.status,
-            output=GuideOutputResponse(
-                id=output.id,
-                content=output.content,
-                model_used=output.model_used,
-                created_at=output.created_at,
-            ),
-        )
+        return await run_in_threadpool(_generate_uploaded_guide, guide.id, typed_sources, professor_profile)
     except HTTPException:
         guide.status = GuideStatus.failed.value
-        db.commit()
+        await db.commit()
         raise
+    except LLMUnavailableError:
+        guide.status = GuideStatus.failed.value
+        await db.commit()
+        raise  # 503 with Retry-After (see main.py)
     except Exception as e:
         guide.status = GuideStatus.failed.value
-        db.commit()
+        await db.commit()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e),
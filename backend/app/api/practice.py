@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.db import get_db
+from app.models.guide import PracticeQuestion
+from app.models.user import User
+from app.schemas.practice import PracticeQuestionList, PracticeQuizResponse
+from app.api.deps import get_current_user
+from app.services.practice_bank import query_practice_questions
+
+router = APIRouter(prefix="/practice", tags=["practice"])
+
+
+@router.get("/questions", response_model=PracticeQuestionList)
+def list_practice_questions(
+    course_id: int | None = None,
+    test_id: int | None = None,
+    guide_id: int | None = None,
+    q: str | None = Query(None, max_length=200, description="text the question must contain"),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Practice questions from the user's guides, newest first."""
+    query = query_practice_questions(db, current_user.id, course_id, test_id, guide_id, (q or "").strip() or None)
+    total = query.count()
+    rows = (
+        query.order_by(PracticeQuestion.guide_id.desc(), PracticeQuestion.position)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return PracticeQuestionList(total=total, questions=rows)
+
+
+@router.get("/quiz", response_model=PracticeQuizResponse)
+def get_practice_quiz(
+    course_id: int | None = None,
+    test_id: int | None = None,
+    count: int = Query(10, ge=1, le=50),
+    exclude: list[int] = Query([], description="question ids already seen in this session"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """A random set of distinct practice questions for a course or block (no LLM call)."""
+    query = query_practice_questions(db, current_user.id, course_id, test_id)
+    if exclude:
+        query = query.filter(PracticeQuestion.id.notin_(exclude))
+    available = query.count()
+    rows = query.order_by(func.random()).limit(count).all()
+    return PracticeQuizResponse(available=available, questions=rows)
@@ -22,9 +22,39 @@ class Settings(BaseSettings):
 
     # Database (set DATABASE_URL in production e.g. Railway Postgres)
     database_url: str = "sqlite:///./study_guider.db"
+    # Apply pending migrations at startup instead of only checking the schema version. Handy for
+    # local dev and single-instance deploys; with several replicas run scripts/migrate.py once instead.
+    auto_migrate: bool = False
+    # Engine tuning (see app/db.py). Pool settings apply to Postgres and file SQLite.
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout_s: float = 30.0
+    db_pool_recycle_s: int = 1800  # Postgres: replace connections older than this
+    db_pool_pre_ping: bool = True  # Postgres: test connections on checkout
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size_mb: int = 256
 
     # LLM (Gemini)
     gemini_api_key: str = ""
+    # Call layer (see services/llm_client.py): concurrent calls across the process, per-attempt
+    # timeout, overall deadline per call incl. retries, attempts, and circuit breaker tuning.
+    llm_max_concurrency: int = 4
+    llm_call_timeout_s: float = 120.0
+    llm_deadline_s: float = 300.0
+    llm_max_attempts: int = 4
+    llm_breaker_failure_threshold: int = 5
+    llm_breaker_reset_s: float = 30.0
+    # Provider: "gemini" (default) or "fake" — deterministic offline backend for load tests and CI
+    llm_provider: str = "gemini"
+    fake_llm_latency_s: float = 0.0
+    fake_llm_tokens_per_s: float = 0.0  # 0 = instant output
+    fake_llm_failure_rate: float = 0.0  # probability of an injected 503 per call
+    fake_llm_seed: int = 0
+    # Telemetry (see services/telemetry.py): record every LLM call in llm_calls. Prices are USD
+    # per million tokens, used for the cost estimates in /api/admin/llm-usage.
+    llm_telemetry_enabled: bool = True
+    llm_price_input_per_mtok: float = 0.30
+    llm_price_output_per_mtok: float = 2.50
 
     # File upload
     upload_dir: str = "uploads"
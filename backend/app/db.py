@@ -1,15 +1,200 @@
-from sqlalchemy import create_engine
+"""
+Engine and sessions, tuned per backend.
+
+SQLite connections run in WAL mode with synchronous=NORMAL (readers do not block the
+writer) and wait up to sqlite_busy_timeout_ms for a lock instead of failing with "database
+is locked". Postgres gets a bounded pool with pre-ping and recycling (db_pool_* settings).
+Checkouts and the time spent waiting for a free connection are counted in pool_metrics
+(GET /api/admin/db-pool); sustained waits mean the pool is smaller than a worker's concurrency.
+
+Async endpoints use async_engine / get_async_db: the same database through aiosqlite or
+asyncpg, with the same tuning and its own pool and metrics.
+"""
+
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.config import get_settings
 
 settings = get_settings()
-engine = create_engine(
+
+# Recent checkout waits kept for percentiles
+_WAIT_SAMPLES = 2048
+
+
+class PoolMetrics:
+    """Counters for connection checkouts and the time spent waiting for one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.wait_total_s = 0.0
+            self.wait_max_s = 0.0
+            self._waits: deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total_s += seconds
+            self.wait_max_s = max(self.wait_max_s, seconds)
+            self._waits.append(seconds)
+
+    def record_checkin(self) -> None:
+        with self._lock:
+            self.checkins += 1
+
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            checkouts, checkins, timeouts = self.checkouts, self.checkins, self.timeouts
+            wait_total, wait_max = self.wait_total_s, self.wait_max_s
+
+        def pct_ms(pct: float) -> float | None:
+            if not waits:
+                return None
+            return round(1000 * waits[min(len(waits) - 1, int(len(waits) * pct / 100))], 3)
+
+        size = getattr(pool, "size", None)
+        return {
+            "pool_class": type(pool).__name__,
+            "pool_size": size() if callable(size) else None,
+            "max_overflow": getattr(pool, "_max_overflow", None),
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "checkouts": checkouts,
+            "checkins": checkins,
+            "timeouts": timeouts,
+            "wait_ms_avg": round(1000 * wait_total / checkouts, 3) if checkouts else None,
+            "wait_ms_p50": pct_ms(50),
+            "wait_ms_p95": pct_ms(95),
+            "wait_ms_p99": pct_ms(99),
+            "wait_ms_max": round(1000 * wait_max, 3),
+        }
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _TimedCheckout:
+    """Pool mixin that reports how long each checkout waited for a free connection."""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return conn
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    metrics = pool_metrics
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.partition("://")[2] in ("", "/"))
+
+
+def async_database_url(url: str) -> str:
+    """database_url with its async driver: aiosqlite for SQLite, asyncpg for Postgres."""
+    scheme, _, rest = url.partition("://")
+    if scheme in ("sqlite", "sqlite+pysqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme in ("postgres", "postgresql", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
+def sqlite_pragmas() -> list[str]:
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_mb) * 1024 * 1024}",
+    ]
+
+
+def _apply_sqlite_pragmas(dbapi_conn, _record) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """create_engine / create_async_engine keyword arguments for the backend of `url`."""
+    if _is_memory_sqlite(url):
+        # SQLAlchemy's per-thread connection; nothing to pool or journal
+        return {"connect_args": {"check_same_thread": False}}
+    options = {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_s,
+    }
+    if _is_sqlite(url):
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.sqlite_busy_timeout_ms / 1000,
+        }
+    else:
+        options["pool_pre_ping"] = settings.db_pool_pre_ping
+        options["pool_recycle"] = settings.db_pool_recycle_s
+    return options
+
+
+def _instrument(engine: Engine, url: str, metrics: PoolMetrics) -> Engine:
+    if _is_sqlite(url):
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(engine, "checkin", lambda *_: metrics.record_checkin())
+    return engine
+
+
+engine = _instrument(
+    create_engine(settings.database_url, **engine_options(settings.database_url)),
     settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {},
+    pool_metrics,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+_async_url = async_database_url(settings.database_url)
+async_engine = create_async_engine(_async_url, **engine_options(_async_url, is_async=True))
+_instrument(async_engine.sync_engine, _async_url, async_pool_metrics)
+# expire_on_commit=False: attributes read after a commit must not trigger lazy I/O
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def get_db():
     db = SessionLocal()
@@ -17,3 +202,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,75 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import inspect, text
-from app.db import engine, Base, SessionLocal
-from app import models  # noqa: F401 - ensure all models registered for create_all
+from fastapi.responses import JSONResponse
+from app.db import engine, SessionLocal
+from app.migrations import check_schema_version, migrate
 from app.api.auth import router as auth_router
 from app.api.guides import router as guides_router
 from app.api.courses import router as courses_router
 from app.api.admin import router as admin_router
+from app.api.practice import router as practice_router
 from app.config import get_settings
 from app.models.user import User
+from app.services.llm_client import LLMUnavailableError
 
 settings = get_settings()
-Base.metadata.create_all(bind=engine)
-
-
-def _ensure_allow_multiple_blocks_column():
-    """Add course_attachments.allow_multiple_blocks if missing (e.g. after deploy)."""
-    try:
-        with engine.connect() as conn:
-            inspector = inspect(engine)
-            if "course_attachments" not in inspector.get_table_names():
-                return
-            columns = [c["name"] for c in inspector.get_columns("course_attachments")]
-            if "allow_multiple_blocks" in columns:
-                return
-            conn.execute(text(
-                "ALTER TABLE course_attachments ADD COLUMN allow_multiple_blocks INTEGER NOT NULL DEFAULT 0"
-            ))
-            conn.commit()
-    except Exception:
-        pass
-
-
-def _ensure_analysis_columns():
-    """Add professors.analysis_profile and professors.study_guide_quiz if missing."""
-    try:
-        with engine.connect() as conn:
-            inspector = inspect(engine)
-            if "professors" not in inspector.get_table_names():
-                return
-            columns = [c["name"] for c in inspector.get_columns("professors")]
-            if "analysis_profile" not in columns:
-                conn.execute(text("ALTER TABLE professors ADD COLUMN analysis_profile JSON"))
-                conn.commit()
-            if "study_guide_quiz" not in columns:
-                conn.execute(text("ALTER TABLE professors ADD COLUMN study_guide_quiz JSON"))
-                conn.commit()
-    except Exception:
-        pass
-
-
-def _ensure_guide_block_columns():
-    """Add study_guides.course_id and study_guides.test_id if missing (block–guide link)."""
-    try:
-        with engine.connect() as conn:
-            inspector = inspect(engine)
-            if "study_guides" not in inspector.get_table_names():
-                return
-            columns = [c["name"] for c in inspector.get_columns("study_guides")]
-            if "course_id" not in columns:
-                conn.execute(text(
-                    "ALTER TABLE study_guides ADD COLUMN course_id INTEGER REFERENCES courses(id)"
-                ))
-                conn.commit()
-            if "test_id" not in columns:
-                conn.execute(text(
-                    "ALTER TABLE study_guides ADD COLUMN test_id INTEGER REFERENCES course_tests(id)"
-                ))
-                conn.commit()
-    except Exception:
-        pass
 
 
 def _sync_admin_users():
@@ -99,10 +42,22 @@ app = FastAPI(title="CourseMind API", version="1.0.0")
 
 @app.on_event("startup")
 def on_startup():
-    _ensure_allow_multiple_blocks_column()
-    _ensure_analysis_columns()
-    _ensure_guide_block_columns()
+    if settings.auto_migrate:
+        migrate(engine)
+    check_schema_version(engine)
     _sync_admin_users()
+
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    """The LLM provider is down or overloaded (retries exhausted, breaker open): 503 with a retry hint."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after_s or 30))},
+    )
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -121,6 +76,7 @@ app.include_router(auth_router, prefix="/api")
 app.include_router(guides_router, prefix="/api")
 app.include_router(courses_router, prefix="/api")
 app.include_router(admin_router, prefix="/api")
+app.include_router(practice_router, prefix="/api")
 
 
 @app.get("/api/health")
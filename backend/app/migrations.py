@@ -0,0 +1,248 @@
+"""
+Versioned schema migrations.
+
+The schema version of a database is the highest version in its schema_migrations table.
+Migrations run once, in order, from the migrate CLI (scripts/migrate.py) before the app
+starts; the app itself only checks the version at startup (check_schema_version), so
+booting does not reflect tables and concurrent replicas never race to ALTER them.
+
+  - A database with none of the app's tables is created from the models (create_all) and
+    stamped with the latest version: there is nothing to migrate or backfill.
+  - Any other database runs the migrations it has not applied yet, each in its own
+    transaction together with its schema_migrations row.
+
+Adding a migration: append a function to MIGRATIONS with the next version. Tables new to
+the models are created by create_missing_tables; new columns on existing tables need an
+add_column_if_missing step (a database that was behind may already have the column if a
+later model change created its table). Never edit or renumber a released migration.
+"""
+
+import logging
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app.db import Base
+from app import models  # noqa: F401 - registers every model on Base.metadata
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for the Postgres advisory lock that serializes concurrent migrate runs
+_PG_LOCK_KEY = 7_146_021
+
+_version_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+class SchemaVersionError(RuntimeError):
+    """The database schema is behind (or ahead of) the code."""
+
+
+# ---------------------------------------------------------------------------
+# Helpers for migration steps
+# ---------------------------------------------------------------------------
+
+def create_missing_tables(conn: Connection) -> None:
+    Base.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl: str) -> None:
+    inspector = inspect(conn)
+    if table not in inspector.get_table_names():
+        return
+    if column not in {c["name"] for c in inspector.get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def create_missing_indexes(conn: Connection) -> None:
+    """Create the indexes declared on the models that existing tables lack (create_all skips existing tables)."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+# ---------------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------------
+
+def _m001_baseline(conn: Connection) -> None:
+    """Tables and columns that startup used to add with create_all and the _ensure_* helpers."""
+    create_missing_tables(conn)
+    add_column_if_missing(conn, "users", "email_verified", "BOOLEAN NOT NULL DEFAULT FALSE")
+    add_column_if_missing(conn, "course_attachments", "allow_multiple_blocks", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "course_attachments", "content_hash", "VARCHAR(64)")
+    add_column_if_missing(conn, "professors", "analysis_profile", "JSON")
+    add_column_if_missing(conn, "professors", "study_guide_quiz", "JSON")
+    add_column_if_missing(conn, "study_guides", "course_id", "INTEGER REFERENCES courses(id)")
+    add_column_if_missing(conn, "study_guides", "test_id", "INTEGER REFERENCES course_tests(id)")
+    add_column_if_missing(conn, "course_test_analyses", "input_fingerprint", "VARCHAR(64)")
+    add_column_if_missing(conn, "course_test_analyses", "is_stale", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "guide_sources", "prompt_chars_before", "INTEGER")
+    add_column_if_missing(conn, "guide_sources", "prompt_chars_after", "INTEGER")
+    add_column_if_missing(conn, "guide_sources", "text_version", "VARCHAR(16)")
+
+
+def _m002_model_indexes(conn: Connection) -> None:
+    create_missing_indexes(conn)
+
+
+def _m003_backfill_analysis_counts(conn: Connection) -> None:
+    from app.services.analysis_service import backfill_analysis_counts
+
+    backfill_analysis_counts(Session(bind=conn))
+
+
+def _m004_backfill_practice_questions(conn: Connection) -> None:
+    from app.services.practice_bank import backfill_practice_questions
+
+    backfill_practice_questions(Session(bind=conn))
+
+
+def _m005_guide_source_attachment_ids(conn: Connection) -> None:
+    """Record which course attachment each block guide source was copied from (matched by file name)."""
+    add_column_if_missing(conn, "guide_sources", "attachment_id", "INTEGER")
+    guides = conn.execute(text(
+        "SELECT DISTINCT g.id, g.course_id FROM study_guides g "
+        "JOIN guide_sources s ON s.guide_id = g.id "
+        "WHERE g.course_id IS NOT NULL AND s.attachment_id IS NULL"
+    )).all()
+    for guide_id, course_id in guides:
+        attachments: dict[str, list[int]] = {}
+        for att_id, file_name in conn.execute(
+            text("SELECT id, file_name FROM course_attachments WHERE course_id = :course_id ORDER BY id"),
+            {"course_id": course_id},
+        ):
+            attachments.setdefault(file_name, []).append(att_id)
+        sources = conn.execute(
+            text("SELECT id, file_name FROM guide_sources WHERE guide_id = :guide_id AND attachment_id IS NULL ORDER BY id"),
+            {"guide_id": guide_id},
+        ).all()
+        # Same-named attachments pair up with the guide's same-named sources in creation order
+        for source_id, file_name in sources:
+            candidates = attachments.get(file_name)
+            if candidates:
+                conn.execute(
+                    text("UPDATE guide_sources SET attachment_id = :att_id WHERE id = :id"),
+                    {"att_id": candidates.pop(0), "id": source_id},
+                )
+
+
+def _m006_rebuild_topic_aliases(conn: Connection) -> None:
+    from app.services.analysis_service import rebuild_topic_aliases
+
+    add_column_if_missing(conn, "topic_aliases", "clustering_version", "VARCHAR(16)")
+    rebuild_topic_aliases(Session(bind=conn))
+
+
+def _m007_guide_sections_unique(conn: Connection) -> None:
+    """Drop duplicate section rows (concurrent lazy backfills), make positions unique, store missing sections."""
+    from app.services.guide_sections import backfill_guide_sections
+
+    conn.execute(text(
+        "DELETE FROM guide_sections WHERE id NOT IN "
+        "(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM guide_sections GROUP BY guide_id, position) AS keep)"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_guide_sections_guide_id_position ON guide_sections (guide_id, position)"
+    ))
+    backfill_guide_sections(Session(bind=conn))
+
+
+def _m008_backfill_guide_versions(conn: Connection) -> None:
+    from app.services.guide_versions import backfill_initial_versions
+
+    backfill_initial_versions(Session(bind=conn))
+
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", _m001_baseline),
+    (2, "model_indexes", _m002_model_indexes),
+    (3, "backfill_analysis_counts", _m003_backfill_analysis_counts),
+    (4, "backfill_practice_questions", _m004_backfill_practice_questions),
+    (5, "guide_source_attachment_ids", _m005_guide_source_attachment_ids),
+    (6, "rebuild_topic_aliases", _m006_rebuild_topic_aliases),
+    (7, "guide_sections_unique", _m007_guide_sections_unique),
+    (8, "backfill_guide_versions", _m008_backfill_guide_versions),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def current_version(conn: Connection) -> int | None:
+    """The applied schema version; None when the database has no schema_migrations table."""
+    if not inspect(conn).has_table("schema_migrations"):
+        return None
+    return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def _is_empty(conn: Connection) -> bool:
+    existing = set(inspect(conn).get_table_names())
+    return not existing.intersection(Base.metadata.tables)
+
+
+def migrate(engine: Engine, target: int | None = None) -> list[int]:
+    """Apply pending migrations up to target (default: latest). Returns the versions applied."""
+    target = LATEST_VERSION if target is None else target
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == "postgresql":
+            lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _PG_LOCK_KEY})
+        try:
+            return _migrate(engine, target)
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _PG_LOCK_KEY})
+
+
+def _migrate(engine: Engine, target: int) -> list[int]:
+    with engine.begin() as conn:
+        fresh = _is_empty(conn)
+        _version_metadata.create_all(bind=conn, checkfirst=True)
+        if fresh:
+            create_missing_tables(conn)
+            conn.execute(schema_migrations.insert(), [
+                {"version": version, "name": name} for version, name, _ in MIGRATIONS if version <= target
+            ])
+            logger.info("Created schema at version %s", target)
+            return []
+        version = current_version(conn)
+
+    applied = []
+    for number, name, step in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(schema_migrations.insert().values(version=number, name=name))
+        logger.info("Applied migration %s_%s", number, name)
+        applied.append(number)
+    return applied
+
+
+def check_schema_version(engine: Engine) -> int:
+    """One query: raise SchemaVersionError unless the database is at LATEST_VERSION."""
+    with engine.connect() as conn:
+        try:
+            version = conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+        except Exception:
+            version = None
+    if version is None or version < LATEST_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version or 0}, code expects {LATEST_VERSION}; "
+            "run `python scripts/migrate.py` first"
+        )
+    if version > LATEST_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, newer than this code ({LATEST_VERSION})"
+        )
+    return version
@@ -1,13 +1,19 @@
 from app.models.user import User
-from app.models.guide import StudyGuide, GuideSource, StudyGuideOutput
-from app.models.course import Professor, Course, CourseTest, CourseAttachment, CourseAttachmentTest, CourseAttachmentType, CourseTestAnalysis
+from app.models.guide import StudyGuide, GuideSource, StudyGuideOutput, GuideSection, GuideSectionKind, PracticeQuestion, GuideOutputVersion, GuideVersionStorage
+from app.models.course import Professor, Course, CourseTest, CourseAttachment, CourseAttachmentTest, CourseAttachmentType, CourseTestAnalysis, AnalysisTopicCount, AnalysisFormatCount, TopicAlias, CourseTextChunk, PastTestQuestion, AttachmentDigest, TextSignature
 from app.models.verification import EmailVerification, PasswordResetToken
+from app.models.telemetry import LLMCall, LLMCallSite, LLMCallOutcome
 
 __all__ = [
     "User",
     "StudyGuide",
     "GuideSource",
     "StudyGuideOutput",
+    "GuideSection",
+    "GuideSectionKind",
+    "PracticeQuestion",
+    "GuideOutputVersion",
+    "GuideVersionStorage",
     "Professor",
     "Course",
     "CourseTest",
@@ -15,6 +21,16 @@ __all__ = [
     "CourseAttachmentTest",
     "CourseAttachmentType",
     "CourseTestAnalysis",
+    "AnalysisTopicCount",
+    "AnalysisFormatCount",
+    "TopicAlias",
+    "CourseTextChunk",
+    "PastTestQuestion",
+    "AttachmentDigest",
+    "TextSignature",
     "EmailVerification",
     "PasswordResetToken",
+    "LLMCall",
+    "LLMCallSite",
+    "LLMCallOutcome",
 ]
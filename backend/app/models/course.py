@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text, DateTime, ForeignKey, JSON, LargeBinary
+from sqlalchemy import Boolean, Column, Float, Integer, String, Text, DateTime, ForeignKey, JSON, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from app.db import Base
@@ -80,10 +80,13 @@ class CourseAttachment(Base):
     file_content = deferred(Column(LargeBinary, nullable=True))  # file bytes when stored in DB (e.g. Railway)
     attachment_kind = Column(String(32), nullable=False)  # handout, past_test, note
     allow_multiple_blocks = Column(Integer, nullable=False, default=0)  # 0=false, 1=true (DB is integer)
+    content_hash = Column(String(64), nullable=True)  # sha256 of file bytes; backfilled on first analysis
 
     course = relationship("Course", back_populates="attachments")
     test = relationship("CourseTest", back_populates="attachments")
     test_links = relationship("CourseAttachmentTest", back_populates="attachment", cascade="all, delete-orphan")
+    text_chunks = relationship("CourseTextChunk", back_populates="attachment", cascade="all, delete-orphan")
+    questions = relationship("PastTestQuestion", back_populates="attachment", cascade="all, delete-orphan")
 
 
 class CourseTestAnalysis(Base):
@@ -96,6 +99,120 @@ class CourseTestAnalysis(Base):
     question_formats = Column(JSON, nullable=True)
     high_signal_handouts = Column(JSON, nullable=True)
     summary = Column(Text, nullable=True)
+    input_fingerprint = Column(String(64), nullable=True)  # hash of the block's attachment contents, kinds and prompt version
+    is_stale = Column(Integer, nullable=False, default=0)  # 1 when the block's inputs no longer match input_fingerprint
     analyzed_at = Column(DateTime(timezone=True), server_default=func.now())
 
     test = relationship("CourseTest", back_populates="analysis")
+    topic_counts = relationship("AnalysisTopicCount", back_populates="analysis", cascade="all, delete-orphan")
+    format_counts = relationship("AnalysisFormatCount", back_populates="analysis", cascade="all, delete-orphan")
+
+
+class AnalysisTopicCount(Base):
+    """
+    One topic of a CourseTestAnalysis (its topic_frequency JSON, one row per topic). professor_id
+    is copied from the block's course so a professor's profile is a single grouped query.
+    """
+    __tablename__ = "analysis_topic_counts"
+
+    id = Column(Integer, primary_key=True)
+    analysis_id = Column(Integer, ForeignKey("course_test_analyses.id", ondelete="CASCADE"), nullable=False, index=True)
+    professor_id = Column(Integer, ForeignKey("professors.id"), nullable=True, index=True)
+    topic = Column(String(255), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    analysis = relationship("CourseTestAnalysis", back_populates="topic_counts")
+
+
+class AnalysisFormatCount(Base):
+    """One question format of a CourseTestAnalysis (its question_formats JSON), like AnalysisTopicCount."""
+    __tablename__ = "analysis_format_counts"
+
+    id = Column(Integer, primary_key=True)
+    analysis_id = Column(Integer, ForeignKey("course_test_analyses.id", ondelete="CASCADE"), nullable=False, index=True)
+    professor_id = Column(Integer, ForeignKey("professors.id"), nullable=True, index=True)
+    format = Column(String(64), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    analysis = relationship("CourseTestAnalysis", back_populates="format_counts")
+
+
+class TopicAlias(Base):
+    """Canonical topic a professor's analyses mean by a topic name (see topic_clusters)."""
+    __tablename__ = "topic_aliases"
+    __table_args__ = (UniqueConstraint("professor_id", "topic"),)
+
+    id = Column(Integer, primary_key=True)
+    professor_id = Column(Integer, ForeignKey("professors.id", ondelete="CASCADE"), nullable=False, index=True)
+    topic = Column(String(255), nullable=False)
+    canonical = Column(String(255), nullable=False)
+    clustering_version = Column(String(16), nullable=True)  # topic_clusters.CLUSTERING_VERSION of the mapping
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CourseTextChunk(Base):
+    """Paragraph chunk of an attachment's extracted text, with term counts for BM25 retrieval."""
+    __tablename__ = "course_text_chunks"
+
+    id = Column(Integer, primary_key=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False, index=True)
+    attachment_id = Column(Integer, ForeignKey("course_attachments.id"), nullable=False, index=True)
+    text_hash = Column(String(64), nullable=False)  # sha256 of the full extracted text
+    chunk_index = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    term_counts = Column(JSON, nullable=True)  # { "term": count }
+    token_count = Column(Integer, nullable=False, default=0)
+
+    attachment = relationship("CourseAttachment", back_populates="text_chunks")
+
+
+class PastTestQuestion(Base):
+    """One question parsed from a past-test attachment's extracted text (see question_segmenter)."""
+    __tablename__ = "past_test_questions"
+
+    id = Column(Integer, primary_key=True)
+    attachment_id = Column(Integer, ForeignKey("course_attachments.id"), nullable=False, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    number = Column(String(16), nullable=False)  # as numbered on the test
+    text = Column(Text, nullable=False)
+    options = Column(JSON, nullable=True)  # multiple-choice options, in order
+    points = Column(Float, nullable=True)
+    format = Column(String(32), nullable=False)  # multiple_choice, free_response, problem_solving, short_answer
+    content_hash = Column(String(64), nullable=False, index=True)  # normalized wording; equal across copies of a question
+    source_hash = Column(String(64), nullable=False)  # text_hash of the extracted text it was parsed from
+    parser_version = Column(String(16), nullable=False)
+
+    attachment = relationship("CourseAttachment", back_populates="questions")
+
+
+class AttachmentDigest(Base):
+    """
+    Cached topic-note digest of a piece of source text, shared by every guide that includes it.
+    Keyed by content hash + material type + prompt version, so it is generated once per file.
+    """
+    __tablename__ = "attachment_digests"
+    __table_args__ = (UniqueConstraint("content_hash", "material_type", "prompt_version"),)
+
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    material_type = Column(String(32), nullable=False)
+    prompt_version = Column(String(32), nullable=False)
+    digest = Column(Text, nullable=False)
+    model_used = Column(String(128), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TextSignature(Base):
+    """
+    MinHash signature of a piece of extracted text (see near_duplicates), keyed by the text's
+    hash so it is computed once no matter how many attachments or guides contain the text.
+    """
+    __tablename__ = "text_signatures"
+    __table_args__ = (UniqueConstraint("text_hash", "version"),)
+
+    id = Column(Integer, primary_key=True)
+    text_hash = Column(String(64), nullable=False, index=True)
+    version = Column(String(32), nullable=False)
+    signature = Column(JSON, nullable=False)  # ascending list of the smallest shingle hashes
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
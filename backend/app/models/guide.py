@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, LargeBinary
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, LargeBinary, JSON, UniqueConstraint
 from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from app.db import Base
@@ -28,6 +28,13 @@ class StudyGuide(Base):
     user = relationship("User", backref="study_guides")
     sources = relationship("GuideSource", back_populates="guide", cascade="all, delete-orphan")
     output = relationship("StudyGuideOutput", back_populates="guide", uselist=False, cascade="all, delete-orphan")
+    sections = relationship(
+        "GuideSection", back_populates="guide", cascade="all, delete-orphan", order_by="GuideSection.position",
+    )
+    practice_questions = relationship("PracticeQuestion", back_populates="guide", cascade="all, delete-orphan")
+    output_versions = relationship(
+        "GuideOutputVersion", back_populates="guide", cascade="all, delete-orphan", order_by="GuideOutputVersion.version",
+    )
 
 
 class GuideSource(Base):
@@ -35,12 +42,19 @@ class GuideSource(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     guide_id = Column(Integer, ForeignKey("study_guides.id"), nullable=False)
+    # CourseAttachment the source was copied from (block guides); no foreign key, the
+    # attachment may be deleted while the guide keeps its copy
+    attachment_id = Column(Integer, nullable=True)
     file_name = Column(String(255), nullable=False)
     file_type = Column(String(64), nullable=False)
     file_path = Column(String(512), nullable=True)  # legacy path or stub when stored in DB
     file_content = deferred(Column(LargeBinary, nullable=True))  # file bytes when stored in DB (e.g. Railway)
     extracted_text = Column(Text, nullable=True)
+    text_version = Column(String(16), nullable=True)  # text_sanitizer.TEXT_NORMALIZATION_VERSION of extracted_text
     material_type = Column(String(32), nullable=True)  # past_test | handout | note | study_guide | other
+    # Characters of the source before / after boilerplate stripping in the last prompt that used it
+    prompt_chars_before = Column(Integer, nullable=True)
+    prompt_chars_after = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     guide = relationship("StudyGuide", back_populates="sources")
@@ -56,3 +70,79 @@ class StudyGuideOutput(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     guide = relationship("StudyGuide", back_populates="output")
+
+
+class GuideSectionKind:
+    OVERVIEW = "overview"
+    TOPICS = "topics"  # the "## Topics" heading and any text before the first topic
+    TOPIC = "topic"
+    AT_A_GLANCE = "at_a_glance"
+    PRACTICE = "practice"
+    GAPS = "gaps"
+    OTHER = "other"
+
+
+class GuideSection(Base):
+    """One parsed section of a guide's output, in document order (see services.guide_sections)."""
+    __tablename__ = "guide_sections"
+    __table_args__ = (UniqueConstraint("guide_id", "position"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    guide_id = Column(Integer, ForeignKey("study_guides.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    kind = Column(String(32), nullable=False)  # GuideSectionKind
+    title = Column(String(255), nullable=False, default="")
+    priority = Column(String(16), nullable=True)  # HIGH | MEDIUM | LOW (topics only)
+    sources = Column(JSON, nullable=True)  # file names of the guide sources this topic cites
+    content = Column(Text, nullable=False)  # Markdown of the section, heading included
+
+    guide = relationship("StudyGuide", back_populates="sections")
+
+
+class PracticeQuestion(Base):
+    """
+    One **Q:**/**A:** pair from a guide's "## Practice Questions" section (see
+    services.practice_bank), indexed by user, course and block so quizzes need no LLM call.
+    """
+    __tablename__ = "practice_questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    guide_id = Column(Integer, ForeignKey("study_guides.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=True, index=True)
+    test_id = Column(Integer, ForeignKey("course_tests.id"), nullable=True, index=True)
+    position = Column(Integer, nullable=False)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False, default="")
+    content_hash = Column(String(64), nullable=False, index=True)  # normalized question text; equal across regenerations
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    guide = relationship("StudyGuide", back_populates="practice_questions")
+
+
+class GuideVersionStorage:
+    LATEST = "latest"  # text is StudyGuideOutput.content
+    DELTA = "delta"
+    SNAPSHOT = "snapshot"
+
+
+class GuideOutputVersion(Base):
+    """
+    One version of a guide's output (see services.guide_versions). The latest version's text
+    is StudyGuideOutput.content; older versions store a compressed delta against the next
+    version, or every few versions a compressed full snapshot.
+    """
+    __tablename__ = "guide_output_versions"
+    __table_args__ = (UniqueConstraint("guide_id", "version"),)
+
+    id = Column(Integer, primary_key=True)
+    guide_id = Column(Integer, ForeignKey("study_guides.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)
+    storage = Column(String(16), nullable=False)  # GuideVersionStorage
+    data = deferred(Column(LargeBinary, nullable=True))  # zlib: delta ops (JSON) or snapshot text; NULL for latest
+    chars = Column(Integer, nullable=False, default=0)
+    content_sha256 = Column(String(64), nullable=False)
+    model_used = Column(String(128), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    guide = relationship("StudyGuide", back_populates="output_versions")
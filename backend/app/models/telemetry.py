@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class LLMCallSite:
+    GUIDE = "guide"
+    GUIDE_REFRESH = "guide_refresh"
+    DIGEST = "digest"
+    ANALYSIS = "analysis"
+    QUIZ = "quiz"
+    OTHER = "other"
+
+
+class LLMCallOutcome:
+    OK = "ok"
+    ERROR = "error"  # non-retryable provider error (bad request, auth, ...)
+    UNAVAILABLE = "unavailable"  # retries exhausted, deadline exceeded or breaker open
+    CACHE_HIT = "cache_hit"  # served from a cache; no provider call was made
+
+
+class LLMCall(Base):
+    """One LLM call (or cache hit standing in for one), recorded by services/telemetry.py."""
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    call_site = Column(String(32), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+    model = Column(String(128), nullable=False)
+    prompt_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Float, nullable=False, default=0.0)  # wall time incl. queueing, retries and backoff
+    attempts = Column(Integer, nullable=False, default=1)
+    cache_hit = Column(Integer, nullable=False, default=0)  # 0/1
+    outcome = Column(String(16), nullable=False)
+    error = Column(String(255), nullable=True)
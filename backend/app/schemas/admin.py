@@ -13,3 +13,63 @@ class AdminUserListItem(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class LLMUsageGroup(BaseModel):
+    key: str
+    label: str
+    calls: int
+    provider_calls: int
+    cache_hits: int
+    errors: int
+    unavailable: int
+    retries: int
+    prompt_tokens: int
+    output_tokens: int
+    estimated_cost_usd: float
+    latency_ms_p50: float | None = None
+    latency_ms_p95: float | None = None
+    latency_ms_p99: float | None = None
+    latency_ms_max: float | None = None
+
+
+class LLMUsageResponse(BaseModel):
+    days: int
+    group_by: str
+    groups: list[LLMUsageGroup]
+
+
+class PromptCompressionGroup(BaseModel):
+    material_type: str
+    sources: int
+    chars_before: int
+    chars_after: int
+    saved_pct: float
+
+
+class PromptCompressionResponse(BaseModel):
+    days: int
+    sources: int
+    chars_before: int
+    chars_after: int
+    saved_chars: int
+    saved_pct: float
+    estimated_tokens_saved: int  # at ~4 characters per token
+    by_material_type: list[PromptCompressionGroup]
+
+
+class DBPoolResponse(BaseModel):
+    backend: str
+    pool_class: str
+    pool_size: int | None = None
+    max_overflow: int | None = None
+    checked_out: int | None = None  # connections in use now
+    overflow: int | None = None  # connections open beyond pool_size (negative: pool not yet filled)
+    checkouts: int  # since process start
+    checkins: int
+    timeouts: int  # checkouts that gave up after db_pool_timeout_s
+    wait_ms_avg: float | None = None
+    wait_ms_p50: float | None = None  # over the most recent checkouts
+    wait_ms_p95: float | None = None
+    wait_ms_p99: float | None = None
+    wait_ms_max: float | None = None
@@ -135,6 +135,34 @@ class CourseTestAnalysisResponse(BaseModel):
     question_formats: dict | None = None
     high_signal_handouts: list | None = None
     summary: str | None = None
+    is_stale: bool = False  # block's files changed since this analysis was made
     analyzed_at: datetime
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class PastTestQuestionResponse(BaseModel):
+    id: int
+    position: int
+    number: str
+    text: str
+    options: list[str] | None = None
+    points: float | None = None
+    format: str  # multiple_choice, free_response, problem_solving, short_answer
+    content_hash: str  # equal for the same question on different past tests
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BlockAnalysisFailure(BaseModel):
+    test_id: int
+    error: str
+
+
+class CourseAnalysisResponse(BaseModel):
+    analyses: list[CourseTestAnalysisResponse]  # current analysis of every eligible block
+    analyzed_test_ids: list[int]
+    reused_test_ids: list[int]
+    failed: list[BlockAnalysisFailure]
+
+    model_config = ConfigDict(from_attributes=True)
@@ -13,7 +13,7 @@ class GuideSourceResponse(BaseModel):
 
 class GuideOutputResponse(BaseModel):
     id: int
-    content: str
+    content: str | None  # None when the guide was fetched without content (see /guides/{id}/sections)
     model_used: str | None
     created_at: datetime
 
@@ -59,6 +59,17 @@ class CreateGuideResponse(BaseModel):
         from_attributes = True
 
 
+class GuideRefreshResponse(BaseModel):
+    id: int
+    status: str
+    mode: str  # unchanged | partial | full
+    added_sources: list[str] = []
+    removed_sources: list[str] = []
+    changed_sources: list[str] = []
+    regenerated_topics: list[str] = []
+    output: GuideOutputResponse | None = None
+
+
 class GuideOptionsResponse(BaseModel):
     courses: list[str]
     professors: list[str]
@@ -72,3 +83,42 @@ class CreateGuideFromBlockRequest(BaseModel):
 
 class GuideUpdate(BaseModel):
     title: str | None = None
+
+
+class GuideSectionResponse(BaseModel):
+    position: int
+    kind: str  # overview, topics, topic, at_a_glance, practice, gaps, other
+    title: str
+    priority: str | None = None  # HIGH | MEDIUM | LOW (topics only)
+    sources: list[str] | None = None  # guide source file names the topic cites
+    chars: int  # length of the section's Markdown
+    content: str | None = None  # omitted in section lists unless requested
+
+
+class GuideSectionListResponse(BaseModel):
+    guide_id: int
+    status: str
+    sections: list[GuideSectionResponse]
+
+
+class GuideVersionResponse(BaseModel):
+    version: int
+    storage: str  # latest | delta | snapshot
+    chars: int  # length of the version's Markdown
+    stored_bytes: int  # compressed bytes kept for this version (0 for latest: it is the guide's output)
+    model_used: str | None = None
+    created_at: datetime | None = None
+    content: str | None = None  # set when fetching a single version
+
+
+class GuideVersionListResponse(BaseModel):
+    guide_id: int
+    latest_version: int
+    versions: list[GuideVersionResponse]
+
+
+class GuideVersionDiffResponse(BaseModel):
+    guide_id: int
+    version: int
+    against: int
+    diff: str  # unified diff from `against` to `version`
@@ -0,0 +1,24 @@
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict
+
+
+class PracticeQuestionResponse(BaseModel):
+    id: int
+    guide_id: int
+    course_id: int | None = None
+    test_id: int | None = None
+    question: str
+    answer: str
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class PracticeQuestionList(BaseModel):
+    total: int  # distinct questions matching the filters
+    questions: list[PracticeQuestionResponse]
+
+
+class PracticeQuizResponse(BaseModel):
+    available: int  # distinct questions the quiz was drawn from
+    questions: list[PracticeQuestionResponse]
@@ -4,9 +4,18 @@ to identify which topics the professor consistently tests and how they convert
 content into exam questions.
 """
 
-import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session
+
+from app.config import get_settings
 from app.models.course import (
+    AnalysisFormatCount,
+    AnalysisTopicCount,
     CourseTest,
     CourseTestAnalysis,
     CourseAttachment,
@@ -14,132 +23,121 @@ from app.models.course import (
     Course,
     Professor,
     CourseAttachmentType,
+    PastTestQuestion,
+    TopicAlias,
 )
+from app.models.telemetry import LLMCallSite
+from app.services import llm_client, telemetry
+from app.services.llm_client import LLMUnavailableError
 from app.services.file_parser import extract_text_from_file, extract_text_from_bytes, _resolve_file_path
+from app.services.llm_schemas import BlockAnalysisResult
+from app.services.question_alignment import HandoutChunk, align_questions
+from app.services.question_segmenter import format_counts, store_questions
 from app.services.text_sanitizer import sanitize_text_for_gemini
+from app.services.topic_clusters import CLUSTERING_VERSION, assign_topic_aliases
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
 
 ANALYSIS_MODEL = "gemini-2.5-flash"
+# Bump when the analysis prompt changes so existing analyses are treated as stale
+ANALYSIS_PROMPT_VERSION = "v3"
 _MAX_CHARS_PER_FILE = 10_000
 
 
-def _repair_json_strings(s: str) -> str:
-    """Replace unescaped newlines inside double-quoted strings with \\n so JSON can parse."""
-    parts = s.split('"')
-    for i in range(1, len(parts), 2):
-        # Odd-indexed parts are inside double-quoted strings
-        parts[i] = parts[i].replace("\n", "\\n").replace("\r", "\\r")
-    return '"'.join(parts)
+def analyze_test_block(test_id: int, db: Session, api_key: str) -> CourseTestAnalysis:
+    """
+    Run LLM analysis correlating handouts/notes with a past test.
+    Creates or replaces the CourseTestAnalysis record and updates the
+    professor's aggregated analysis_profile.
+    """
+    test = db.query(CourseTest).filter(CourseTest.id == test_id).first()
+    if not test:
+        raise ValueError(f"Test block {test_id} not found")
 
+    fingerprint = block_fingerprint(test_id, db)
+    prompt = _build_analysis_prompt(test_id, db)
+    data = _request_analysis(prompt, api_key)
+    analysis = _store_analysis(test_id, data, db, fingerprint)
 
-def _remove_trailing_commas(s: str) -> str:
-    """Remove trailing commas before } or ] so JSON can parse (Gemini often adds them)."""
-    result = []
-    i = 0
-    in_string = False
-    escape = False
-    while i < len(s):
-        c = s[i]
-        if escape:
-            result.append(c)
-            escape = False
-            i += 1
-            continue
-        if c == "\\" and in_string:
-            escape = True
-            result.append(c)
-            i += 1
-            continue
-        if c == '"' and not escape:
-            in_string = not in_string
-            result.append(c)
-            i += 1
-            continue
-        if not in_string and c == ",":
-            j = i + 1
-            while j < len(s) and s[j] in " \t\n\r":
-                j += 1
-            if j < len(s) and s[j] in "}]":
-                i += 1  # skip trailing comma
-                continue
-        result.append(c)
-        i += 1
-    return "".join(result)
+    # Update the professor's aggregated profile
+    if test.course and test.course.professor_id:
+        aggregate_professor_profile(test.course.professor_id, db)
 
+    return analysis
 
-def _parse_gemini_json(raw: str) -> dict:
-    """
-    Parse JSON from Gemini, repairing common issues: markdown fences,
-    unescaped newlines in strings, truncated output (unterminated string).
-    """
-    s = raw.strip()
-    # Strip markdown code block if present
-    if s.startswith("```"):
-        first = s.find("\n")
-        if first != -1:
-            s = s[first + 1 :]
-        if s.endswith("```"):
-            s = s[: s.rindex("```")].strip()
-
-    try:
-        return json.loads(s)
-    except json.JSONDecodeError:
-        pass
-
-    # Try removing trailing commas before } or ] (Gemini often adds them)
-    s_no_trailing = _remove_trailing_commas(s)
-    try:
-        return json.loads(s_no_trailing)
-    except json.JSONDecodeError:
-        pass
-
-    # Try repairing unescaped newlines inside strings (Gemini often outputs these)
-    s_repaired = _repair_json_strings(s_no_trailing)
-    last_error = None
-    try:
-        return json.loads(s_repaired)
-    except json.JSONDecodeError as e:
-        last_error = e
-    s = s_repaired
-
-    # Repair: often the response is truncated mid-string (e.g. "summary" cut off)
-    pos = getattr(last_error, "pos", len(s)) if last_error else len(s)
-    if pos > len(s):
-        pos = len(s)
-
-    # Try closing an unterminated string and the root object
-    for suffix in ('"}\n}', '"}', '}\n}'):
-        try:
-            return json.loads(s[:pos] + suffix)
-        except json.JSONDecodeError:
-            continue
 
-    # Trim backward from error position: close string and object (salvage truncated output)
-    for i in range(pos, max(0, pos - 1000), -1):
-        tail = s[i:]
-        # If we're clearly inside a string (no unescaped " in tail), close it and the object
-        if '"' not in tail or tail.strip().startswith('"'):
-            try:
-                return json.loads(s[:i].rstrip().rstrip(",") + '"}\n}')
-            except json.JSONDecodeError:
-                pass
-        try:
-            return json.loads(s[:i] + '"}\n}')
-        except json.JSONDecodeError:
-            continue
+def attachment_content_hash(att: CourseAttachment) -> str | None:
+    """sha256 of the attachment's file bytes, computed and stored on first use. None if the file is missing."""
+    if att.content_hash:
+        return att.content_hash
+    content = getattr(att, "file_content", None)
+    if content is None:
+        resolved = _resolve_file_path(att.file_path)
+        if not resolved.is_file():
+            return None
+        content = resolved.read_bytes()
+    att.content_hash = hashlib.sha256(content).hexdigest()
+    return att.content_hash
 
-    raise RuntimeError(f"Failed to parse Gemini JSON response: {last_error}")
 
+def block_fingerprint(test_id: int, db: Session) -> str:
+    """
+    Hash of everything the block's analysis depends on: the content and kind of each linked
+    attachment plus the prompt version. Link order, file names and duplicate copies of the
+    same file do not change it. May backfill attachment content hashes; the caller commits.
+    """
+    atts = (
+        db.query(CourseAttachment)
+        .join(CourseAttachmentTest, CourseAttachmentTest.attachment_id == CourseAttachment.id)
+        .filter(CourseAttachmentTest.test_id == test_id)
+        .all()
+    )
+    parts = sorted({
+        f"{a.attachment_kind}:{attachment_content_hash(a) or f'missing-{a.id}'}"
+        for a in atts
+    })
+    payload = "\n".join([ANALYSIS_PROMPT_VERSION] + parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-def analyze_test_block(test_id: int, db: Session, api_key: str) -> CourseTestAnalysis:
+
+def refresh_analysis_staleness(test_ids, db: Session) -> None:
     """
-    Run LLM analysis correlating handouts/notes with a past test.
-    Creates or replaces the CourseTestAnalysis record and updates the
-    professor's aggregated analysis_profile.
+    Re-check the analyses of the given blocks after their attachments changed: an analysis is
+    stale when the block's fingerprint differs from the one it was made from, and fresh again
+    when it matches (e.g. a file moved out and back). Flushes pending changes; the caller commits.
     """
-    test = db.query(CourseTest).filter(CourseTest.id == test_id).first()
-    if not test:
-        raise ValueError(f"Test block {test_id} not found")
+    test_ids = list(test_ids)
+    if not test_ids:
+        return
+    db.flush()
+    analyses = db.query(CourseTestAnalysis).filter(CourseTestAnalysis.test_id.in_(test_ids)).all()
+    professor_ids: set[int] = set()
+    for analysis in analyses:
+        current = block_fingerprint(analysis.test_id, db)
+        is_stale = 0 if analysis.input_fingerprint == current else 1
+        if is_stale != analysis.is_stale:
+            analysis.is_stale = is_stale
+            if analysis.test and analysis.test.course and analysis.test.course.professor_id:
+                professor_ids.add(analysis.test.course.professor_id)
+    # The professor profile only counts fresh analyses
+    if professor_ids:
+        db.flush()
+        for professor_id in professor_ids:
+            aggregate_professor_profile(professor_id, db)
+
+
+@dataclass
+class AnalysisPrompt:
+    text: str
+    # Set when the local question alignment produced high_signal_handouts (see question_alignment)
+    high_signal_handouts: list[dict] | None = None
+    # Set when every past test parsed into questions (see question_segmenter)
+    question_formats: dict[str, int] | None = None
+
 
+def _build_analysis_prompt(test_id: int, db: Session) -> AnalysisPrompt:
+    """Extract the block's handout/note and past-test text and build the analysis prompt."""
     # Get all attachments linked to this test via the junction table
     link_rows = db.query(CourseAttachmentTest).filter(CourseAttachmentTest.test_id == test_id).all()
     att_ids = [r.attachment_id for r in link_rows]
@@ -174,19 +172,12 @@ def analyze_test_block(test_id: int, db: Session, api_key: str) -> CourseTestAna
                 extracted.append((att, _MISSING))
                 return _MISSING
             text = extract_text_from_file(att.file_path, att.file_type) or ""
-        if len(text) > _MAX_CHARS_PER_FILE:
-            text = text[:_MAX_CHARS_PER_FILE] + "\n\n*[truncated]*"
-        out = sanitize_text_for_gemini(text) or _NO_TEXT
+        out = text or _NO_TEXT  # extraction output is already sanitized
         extracted.append((att, out))
         return out
 
-    handout_section = ""
-    for att in handout_atts:
-        handout_section += f"### {att.file_name}\n{get_text(att)}\n\n"
-
-    test_section = ""
-    for att in past_test_atts:
-        test_section += f"### {att.file_name}\n{get_text(att)}\n\n"
+    handout_texts = [(att, get_text(att)) for att in handout_atts]
+    test_texts = [(att, get_text(att)) for att in past_test_atts]
 
     # Only fail if we have NO useful text from at least one side of the analysis
     def _has_text(text: str) -> bool:
@@ -209,49 +200,118 @@ def analyze_test_block(test_id: int, db: Session, api_key: str) -> CourseTestAna
             + (" | ".join(parts) if parts else "Check that files are text-based PDFs (not scanned).")
         )
 
-    # Sanitize section headers (file names) in case they contain problematic characters
-    handout_section = sanitize_text_for_gemini(handout_section)
-    test_section = sanitize_text_for_gemini(test_section)
+    # Parse the past tests into questions (stored per attachment). When every test parses,
+    # the prompt lists the questions once each (repeats across tests are dropped) and the
+    # format counts are exact, so they are not asked of the LLM
+    questions_by_att = {att.id: store_questions(att, t, db) for att, t in test_texts if _has_text(t)}
+    structured = all(questions_by_att.values())
+    first_seen: dict[str, tuple[str, str]] = {}  # content_hash -> (file name, question number)
+    distinct: list[PastTestQuestion] = []
+    for att, _ in test_texts:
+        for q in questions_by_att.get(att.id, []):
+            if q.content_hash not in first_seen:
+                first_seen[q.content_hash] = (att.file_name, q.number)
+                distinct.append(q)
+
+    # Align test questions to handout passages locally: when it works, only the aligned
+    # passages are sent and high_signal_handouts comes from the alignment
+    alignment = align_questions(
+        [q.text for q in distinct],
+        [(att.file_name, t) for att, t in handout_texts if _has_text(t)],
+    )
+    if alignment is not None and not alignment.aligned_question_count:
+        alignment = None
+
+    handout_section = ""
+    for att, text in handout_texts:
+        if alignment is not None and _has_text(text):
+            text = _aligned_excerpt(alignment.chunks_for(att.file_name))
+        handout_section += f"### {sanitize_text_for_gemini(att.file_name)}\n{_truncate(text)}\n\n"
+
+    test_section = ""
+    for att, text in test_texts:
+        if structured and att.id in questions_by_att:
+            text = _format_questions(att.file_name, questions_by_att[att.id], first_seen)
+        test_section += f"### {sanitize_text_for_gemini(att.file_name)}\n{_truncate(text)}\n\n"
+
     prompt = (
         "## Handout/Note Materials\n"
-        f"{handout_section}"
+        + ("*[Only the handout passages that match the test questions are shown]*\n\n" if alignment else "")
+        + f"{handout_section}"
         "## Test Questions\n"
         f"{test_section}"
-        "Analyze how the test draws from the handouts. Return JSON:\n"
-        "{\n"
-        '  "topic_frequency": {"topic_name": count_of_questions_on_that_topic},\n'
-        '  "conversion_patterns": {"verbatim": n, "conceptually_transformed": n, "applied_to_new_scenario": n},\n'
-        '  "question_formats": {"multiple_choice": n, "free_response": n, "problem_solving": n, "short_answer": n},\n'
-        '  "high_signal_handouts": [{"file_name": "str", "topic_coverage": "str", "question_count": n}],\n'
-        '  "summary": "2-3 sentence summary of how this professor converts handout content into exam questions"\n'
-        "}"
+        "Analyze how the test draws from the handouts:\n"
+        "- topic_frequency: each topic and the number of test questions on it\n"
+        "- conversion_patterns: how many questions reuse handout content verbatim, transform it "
+        "conceptually, or apply it to a new scenario\n"
+        + ("" if structured else "- question_formats: how many questions of each format\n")
+        + ("" if alignment else "- high_signal_handouts: the handout/note files the questions draw on most\n")
+        + "- summary: 2-3 sentences on how this professor converts handout content into exam questions"
+    )
+    return AnalysisPrompt(
+        text=prompt,
+        high_signal_handouts=alignment.high_signal_handouts() if alignment else None,
+        question_formats=format_counts([q.format for q in distinct]) if structured else None,
     )
 
-    try:
-        import google.generativeai as genai
-    except ImportError:
-        raise RuntimeError("google-generativeai package not installed")
-
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is not set")
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(
+def _format_questions(file_name: str, questions: list[PastTestQuestion], first_seen: dict[str, tuple[str, str]]) -> str:
+    """A past test as its parsed questions, one per paragraph; questions seen on an earlier test are referenced."""
+    lines = []
+    for q in questions:
+        seen_file, seen_number = first_seen[q.content_hash]
+        if (seen_file, seen_number) != (file_name, q.number):
+            where = f"Q{seen_number}" if seen_file == file_name else f"{sanitize_text_for_gemini(seen_file)} Q{seen_number}"
+            lines.append(f"Q{q.number}: *[Same question as {where}]*")
+            continue
+        label = q.format.replace("_", " ")
+        if q.points is not None:
+            label += f", {q.points:g} pts"
+        lines.append(f"Q{q.number} [{label}]: {q.text}")
+    return "\n\n".join(lines)
+
+
+def _truncate(text: str) -> str:
+    if len(text) > _MAX_CHARS_PER_FILE:
+        return text[:_MAX_CHARS_PER_FILE] + "\n\n*[truncated]*"
+    return text
+
+
+def _aligned_excerpt(chunks: list[HandoutChunk]) -> str:
+    """Aligned chunks of one handout in document order, with gap markers between non-adjacent ones."""
+    if not chunks:
+        return "*[No passage matched the test questions]*"
+    out: list[str] = []
+    prev = -1
+    for chunk in chunks:
+        if chunk.index != prev + 1:
+            out.append("[…]")
+        out.append(chunk.text)
+        prev = chunk.index
+    return "\n\n".join(out)
+
+
+def _request_analysis(prompt: AnalysisPrompt, api_key: str) -> dict:
+    """Run the analysis prompt through the LLM with the BlockAnalysisResult schema. Safe to call from worker threads."""
+    result, _ = llm_client.generate_structured(
         ANALYSIS_MODEL,
-        system_instruction="You are a professor exam analysis tool. Output valid JSON only.",
-        generation_config={
-            "response_mime_type": "application/json",
-            "max_output_tokens": 4096,
-        },
+        prompt.text,
+        BlockAnalysisResult,
+        system_instruction="You are a professor exam analysis tool.",
+        generation_config={"max_output_tokens": 4096},
+        api_key=api_key,
+        call_site=LLMCallSite.ANALYSIS,
     )
-    response = model.generate_content(prompt)
-
-    if not response or not response.text:
-        raise RuntimeError("No response from Gemini")
+    data = result.to_record()
+    if prompt.high_signal_handouts is not None:
+        data["high_signal_handouts"] = prompt.high_signal_handouts
+    if prompt.question_formats is not None:
+        data["question_formats"] = prompt.question_formats
+    return data
 
-    data = _parse_gemini_json(response.text)
 
-    # Create or replace the CourseTestAnalysis record
+def _store_analysis(test_id: int, data: dict, db: Session, fingerprint: str | None = None) -> CourseTestAnalysis:
+    """Create or replace the CourseTestAnalysis record for a block."""
     existing = db.query(CourseTestAnalysis).filter(CourseTestAnalysis.test_id == test_id).first()
     if existing:
         db.delete(existing)
@@ -264,67 +324,265 @@ def analyze_test_block(test_id: int, db: Session, api_key: str) -> CourseTestAna
         question_formats=data.get("question_formats"),
         high_signal_handouts=data.get("high_signal_handouts"),
         summary=data.get("summary"),
+        input_fingerprint=fingerprint,
+        is_stale=0,
     )
+    professor_id = (
+        db.query(Course.professor_id)
+        .join(CourseTest, CourseTest.course_id == Course.id)
+        .filter(CourseTest.id == test_id)
+        .scalar()
+    )
+    _set_count_rows(analysis, professor_id)
     db.add(analysis)
     db.commit()
     db.refresh(analysis)
+    return analysis
 
-    # Update the professor's aggregated profile
-    if test.course and test.course.professor_id:
-        _aggregate_professor_profile(test.course.professor_id, db)
 
-    return analysis
+def eligible_test_ids(course_id: int, db: Session) -> list[int]:
+    """IDs of the course's test blocks that have both a past test and a handout/note, in display order."""
+    rows = (
+        db.query(CourseAttachmentTest.test_id, CourseAttachment.attachment_kind)
+        .join(CourseAttachment, CourseAttachment.id == CourseAttachmentTest.attachment_id)
+        .join(CourseTest, CourseTest.id == CourseAttachmentTest.test_id)
+        .filter(CourseTest.course_id == course_id)
+        .all()
+    )
+    kinds_by_test: dict[int, set[str]] = {}
+    for test_id, kind in rows:
+        kinds_by_test.setdefault(test_id, set()).add(kind)
+
+    tests = (
+        db.query(CourseTest)
+        .filter(CourseTest.course_id == course_id)
+        .order_by(CourseTest.sort_order, CourseTest.id)
+        .all()
+    )
+    result = []
+    for t in tests:
+        kinds = kinds_by_test.get(t.id, set())
+        if CourseAttachmentType.PAST_TEST in kinds and kinds & {CourseAttachmentType.HANDOUT, CourseAttachmentType.NOTE}:
+            result.append(t.id)
+    return result
+
+
+@dataclass
+class CourseAnalysisResult:
+    analyses: list[CourseTestAnalysis] = field(default_factory=list)  # current analysis of every eligible block
+    analyzed_test_ids: list[int] = field(default_factory=list)        # analyzed by this run
+    reused_test_ids: list[int] = field(default_factory=list)          # already analyzed, left as is
+    failed: list[dict] = field(default_factory=list)                  # {"test_id", "error"}
+
+
+def analyze_course_blocks(
+    course_id: int,
+    db: Session,
+    api_key: str,
+    reanalyze: bool = False,
+) -> CourseAnalysisResult:
+    """
+    Analyze every eligible block of a course in one job. Blocks whose analysis still matches
+    their inputs (see block_fingerprint) are reused unless reanalyze is set. Prompts are built and results stored on
+    the calling thread (the session is not thread-safe); only the LLM calls run
+    concurrently, bounded by llm_client's concurrency limit. The professor profile is
+    aggregated once at the end instead of once per block.
+
+    Per-block failures are reported in the result. Raises LLMUnavailableError only when
+    every LLM call failed because the service was unavailable.
+    """
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if not course:
+        raise ValueError(f"Course {course_id} not found")
+
+    test_ids = eligible_test_ids(course_id, db)
+    existing = {
+        a.test_id: a
+        for a in db.query(CourseTestAnalysis).filter(CourseTestAnalysis.test_id.in_(test_ids)).all()
+    } if test_ids else {}
+
+    result = CourseAnalysisResult()
+    prompts: dict[int, AnalysisPrompt] = {}
+    fingerprints: dict[int, str] = {}
+    for test_id in test_ids:
+        fingerprints[test_id] = block_fingerprint(test_id, db)
+        analysis = existing.get(test_id)
+        if analysis and not reanalyze:
+            if analysis.input_fingerprint is None and not analysis.is_stale:
+                # Made before fingerprints existed; changes used to delete analyses, so it matches the current inputs
+                analysis.input_fingerprint = fingerprints[test_id]
+            if analysis.input_fingerprint == fingerprints[test_id]:
+                analysis.is_stale = 0
+                result.reused_test_ids.append(test_id)
+                continue
+        try:
+            prompts[test_id] = _build_analysis_prompt(test_id, db)
+        except ValueError as e:
+            result.failed.append({"test_id": test_id, "error": str(e)})
+
+    data_by_test: dict[int, dict] = {}
+    unavailable: list[LLMUnavailableError] = []
+    if prompts:
+        workers = min(len(prompts), max(1, settings.llm_max_concurrency))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {test_id: telemetry.submit_with_context(pool, _request_analysis, prompt, api_key) for test_id, prompt in prompts.items()}
+            for test_id, future in futures.items():
+                try:
+                    data_by_test[test_id] = future.result()
+                except LLMUnavailableError as e:
+                    unavailable.append(e)
+                    result.failed.append({"test_id": test_id, "error": str(e)})
+                except Exception as e:
+                    logger.warning("Batch analysis failed for test_id=%s: %s", test_id, e)
+                    result.failed.append({"test_id": test_id, "error": str(e)})
+        if unavailable and len(unavailable) == len(prompts):
+            raise unavailable[0]
+
+    db.commit()  # backfilled content hashes and fingerprints
+    for test_id, data in data_by_test.items():
+        existing[test_id] = _store_analysis(test_id, data, db, fingerprints[test_id])
+        result.analyzed_test_ids.append(test_id)
+
+    if result.analyzed_test_ids and course.professor_id:
+        aggregate_professor_profile(course.professor_id, db)
+
+    result.analyses = [existing[t] for t in test_ids if t in existing and not existing[t].is_stale]
+    return result
+
+
+def _set_count_rows(analysis: CourseTestAnalysis, professor_id: int | None) -> None:
+    """Mirror the analysis's topic_frequency and question_formats JSON into its count rows."""
+    analysis.topic_counts = [
+        AnalysisTopicCount(professor_id=professor_id, topic=str(topic)[:255], count=int(count or 0))
+        for topic, count in (analysis.topic_frequency or {}).items()
+    ]
+    analysis.format_counts = [
+        AnalysisFormatCount(professor_id=professor_id, format=str(fmt)[:64], count=int(count or 0))
+        for fmt, count in (analysis.question_formats or {}).items()
+    ]
 
 
-def _aggregate_professor_profile(professor_id: int, db: Session) -> None:
+def backfill_analysis_counts(db: Session) -> int:
     """
-    Merge all CourseTestAnalysis records for all courses taught by this professor
-    and write the result back to professor.analysis_profile.
+    Create count rows for analyses stored before the count tables existed. Analyses whose
+    JSON is empty have no rows either and are simply re-checked. Returns the number filled.
     """
-    courses = db.query(Course).filter(Course.professor_id == professor_id).all()
-    course_ids = [c.id for c in courses]
-    if not course_ids:
-        return
+    has_topics = db.query(AnalysisTopicCount.id).filter(AnalysisTopicCount.analysis_id == CourseTestAnalysis.id)
+    has_formats = db.query(AnalysisFormatCount.id).filter(AnalysisFormatCount.analysis_id == CourseTestAnalysis.id)
+    rows = (
+        db.query(CourseTestAnalysis, Course.professor_id)
+        .join(CourseTest, CourseTest.id == CourseTestAnalysis.test_id)
+        .join(Course, Course.id == CourseTest.course_id)
+        .filter(~has_topics.exists(), ~has_formats.exists())
+        .all()
+    )
+    filled = 0
+    for analysis, professor_id in rows:
+        if analysis.topic_frequency or analysis.question_formats:
+            _set_count_rows(analysis, professor_id)
+            filled += 1
+    if filled:
+        db.commit()
+    return filled
 
-    tests = db.query(CourseTest).filter(CourseTest.course_id.in_(course_ids)).all()
-    test_ids = [t.id for t in tests]
-    if not test_ids:
+
+def rebuild_topic_aliases(db: Session) -> int:
+    """
+    Re-aggregate the profile of every professor with topic aliases from an older
+    CLUSTERING_VERSION, which rebuilds the aliases first. Returns the number of professors.
+    """
+    professor_ids = [
+        professor_id for (professor_id,) in
+        db.query(TopicAlias.professor_id)
+        .filter(or_(TopicAlias.clustering_version.is_(None), TopicAlias.clustering_version != CLUSTERING_VERSION))
+        .distinct()
+        .all()
+    ]
+    for professor_id in professor_ids:
+        aggregate_professor_profile(professor_id, db)
+    return len(professor_ids)
+
+
+def reassign_course_professor(course_id: int, old_professor_id: int | None, db: Session) -> None:
+    """
+    After a course moved to another professor (or none): re-tag its analyses' count rows and
+    re-aggregate both professors' profiles. Commits.
+    """
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if not course or course.professor_id == old_professor_id:
         return
+    analysis_ids = (
+        db.query(CourseTestAnalysis.id)
+        .join(CourseTest, CourseTest.id == CourseTestAnalysis.test_id)
+        .filter(CourseTest.course_id == course_id)
+        .scalar_subquery()
+    )
+    for model in (AnalysisTopicCount, AnalysisFormatCount):
+        db.query(model).filter(model.analysis_id.in_(analysis_ids)).update(
+            {model.professor_id: course.professor_id}, synchronize_session=False
+        )
+    db.commit()
+    for professor_id in (old_professor_id, course.professor_id):
+        if professor_id:
+            aggregate_professor_profile(professor_id, db)
 
-    analyses = db.query(CourseTestAnalysis).filter(CourseTestAnalysis.test_id.in_(test_ids)).all()
-    if not analyses:
+
+def aggregate_professor_profile(professor_id: int, db: Session) -> None:
+    """
+    Recompute professor.analysis_profile from the fresh analyses of every course taught by
+    this professor: topic and format totals are summed in SQL over the count tables (grouped
+    by canonical topic, see topic_clusters, and by format), so the cost does not grow with
+    the number of analyses loaded.
+    Clears the profile when no fresh analysis is left. Commits.
+    """
+    professor = db.query(Professor).filter(Professor.id == professor_id).first()
+    if not professor:
         return
 
-    topic_counts: dict[str, int] = {}
-    format_counts: dict[str, int] = {}
+    n = (
+        db.query(func.count(CourseTestAnalysis.id))
+        .join(CourseTest, CourseTest.id == CourseTestAnalysis.test_id)
+        .join(Course, Course.id == CourseTest.course_id)
+        .filter(Course.professor_id == professor_id, CourseTestAnalysis.is_stale == 0)
+        .scalar()
+    ) or 0
+    if not n:
+        if professor.analysis_profile is not None:
+            professor.analysis_profile = None
+            db.commit()
+        return
 
-    for analysis in analyses:
-        if analysis.topic_frequency:
-            for topic, count in analysis.topic_frequency.items():
-                topic_counts[topic] = topic_counts.get(topic, 0) + int(count or 0)
-        if analysis.question_formats:
-            for fmt, count in analysis.question_formats.items():
-                format_counts[fmt] = format_counts.get(fmt, 0) + int(count or 0)
-
-    n = len(analyses)
-    confidence = n / (n + 2)  # Laplace smoothing
-
-    tested_topics = sorted(
-        [
-            {"topic": t, "frequency": c, "confidence": round(confidence, 3)}
-            for t, c in topic_counts.items()
-        ],
-        key=lambda x: x["frequency"],
-        reverse=True,
+    # Synonymous topic names from different analyses are summed under their canonical topic
+    assign_topic_aliases(professor_id, db)
+    topic = func.coalesce(TopicAlias.canonical, AnalysisTopicCount.topic)
+    topic_totals = func.sum(AnalysisTopicCount.count)
+    topic_rows = (
+        db.query(topic, topic_totals)
+        .join(CourseTestAnalysis, CourseTestAnalysis.id == AnalysisTopicCount.analysis_id)
+        .outerjoin(TopicAlias, and_(
+            TopicAlias.professor_id == AnalysisTopicCount.professor_id,
+            TopicAlias.topic == AnalysisTopicCount.topic,
+        ))
+        .filter(AnalysisTopicCount.professor_id == professor_id, CourseTestAnalysis.is_stale == 0)
+        .group_by(topic)
+        .order_by(topic_totals.desc(), topic)
+        .all()
+    )
+    format_rows = (
+        db.query(AnalysisFormatCount.format, func.sum(AnalysisFormatCount.count))
+        .join(CourseTestAnalysis, CourseTestAnalysis.id == AnalysisFormatCount.analysis_id)
+        .filter(AnalysisFormatCount.professor_id == professor_id, CourseTestAnalysis.is_stale == 0)
+        .group_by(AnalysisFormatCount.format)
+        .all()
     )
 
-    profile = {
-        "tested_topics": tested_topics,
-        "preferred_formats": format_counts,
+    confidence = round(n / (n + 2), 3)  # Laplace smoothing
+    professor.analysis_profile = {
+        "tested_topics": [
+            {"topic": topic, "frequency": int(total or 0), "confidence": confidence}
+            for topic, total in topic_rows
+        ],
+        "preferred_formats": {fmt: int(total or 0) for fmt, total in format_rows},
         "test_pairs_analyzed": n,
     }
-
-    professor = db.query(Professor).filter(Professor.id == professor_id).first()
-    if professor:
-        professor.analysis_profile = profile
-        db.commit()
+    db.commit()
@@ -0,0 +1,57 @@
+"""
+Persisted per-attachment digests (topic notes) reused across guides.
+
+llm_service generates a digest for each source piece it condenses; this cache stores
+them by content hash, material type and prompt version so the same handout is only
+summarized once, no matter how many guides include it.
+"""
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.course import AttachmentDigest
+
+
+class DigestCache:
+    """
+    Lookup/store interface used by llm_service. Not thread-safe: llm_service reads and
+    writes from the request thread and only runs the Gemini calls in worker threads.
+    """
+
+    def __init__(self, db: Session, model_used: str | None = None):
+        self.db = db
+        self.model_used = model_used
+
+    def get_many(self, keys: list[tuple[str, str, str]]) -> dict[tuple[str, str, str], str]:
+        """keys are (content_hash, material_type, prompt_version). Returns the cached subset."""
+        if not keys:
+            return {}
+        hashes = {k[0] for k in keys}
+        wanted = set(keys)
+        rows = self.db.query(AttachmentDigest).filter(AttachmentDigest.content_hash.in_(hashes)).all()
+        found: dict[tuple[str, str, str], str] = {}
+        for row in rows:
+            key = (row.content_hash, row.material_type, row.prompt_version)
+            if key in wanted:
+                found[key] = row.digest
+        return found
+
+    def put_many(self, digests: dict[tuple[str, str, str], str]) -> None:
+        """
+        Store new digests in one commit. Each row gets its own savepoint, so a concurrent
+        request storing the same key first only skips that row and never rolls back
+        anything else pending in the session.
+        """
+        for (h, mtype, version), digest in digests.items():
+            try:
+                with self.db.begin_nested():
+                    self.db.add(AttachmentDigest(
+                        content_hash=h,
+                        material_type=mtype,
+                        prompt_version=version,
+                        digest=digest,
+                        model_used=self.model_used,
+                    ))
+            except IntegrityError:
+                pass
+        self.db.commit()
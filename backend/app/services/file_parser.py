@@ -4,6 +4,8 @@ from io import BytesIO
 from pathlib import Path
 from pypdf import PdfReader
 
+from app.services.text_sanitizer import sanitize_text_for_gemini
+
 
 class _HTMLTextExtractor(HTMLParser):
     """Strip HTML tags and return plain text."""
@@ -181,11 +183,18 @@ def _resolve_file_path(file_path: str | Path) -> Path:
 
 
 def extract_text_from_file(file_path: str | Path, file_type: str) -> str:
-    """Extract text based on file type. PDF, txt, md, docx, rtf, odt, html supported for extraction."""
+    """
+    Extract text based on file type. PDF, txt, md, docx, rtf, odt, html supported for extraction.
+    The text is sanitized here (see text_sanitizer), so prompt builders can use it as is.
+    """
     path = _resolve_file_path(file_path)
     if not path.exists():
         return ""
     ext = (file_type or path.suffix or "").lower().lstrip(".")
+    return sanitize_text_for_gemini(_extract_text_by_type(path, ext))
+
+
+def _extract_text_by_type(path: Path, ext: str) -> str:
     if ext == "pdf":
         return extract_text_from_pdf(path)
     if ext in ("txt", "md"):
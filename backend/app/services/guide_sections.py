@@ -0,0 +1,227 @@
+"""
+Parse guide outputs into sections and splice regenerated sections back in.
+
+Guides follow llm_service's OUTPUT FORMAT: "## Overview", "## Topics" with one
+"### [Topic]" block per topic (each with **Priority:** and **Sources:** lines),
+"## High-Priority Topics at a Glance", "## Practice Questions", "## Coverage Gaps".
+Each topic records which guide sources it cites, so a refresh only regenerates the
+topics whose sources changed (see llm_service.refresh_study_guide_sections).
+"""
+
+import re
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from app.models.guide import GuideSection, GuideSectionKind, GuideStatus, StudyGuide, StudyGuideOutput
+
+_H2_RE = re.compile(r"^##\s+(.+?)\s*#*\s*$")
+_H3_RE = re.compile(r"^###\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_PRIORITY_RE = re.compile(r"\*\*Priority:?\*\*:?\s*\**\s*(HIGH|MEDIUM|LOW)", re.IGNORECASE)
+_SOURCES_RE = re.compile(r"\*\*Sources:?\*\*:?\s*(.+)", re.IGNORECASE)
+
+
+def _h2_kind(title: str) -> str:
+    t = title.lower()
+    if t.startswith("overview"):
+        return GuideSectionKind.OVERVIEW
+    if "at a glance" in t or t.startswith("high-priority") or t.startswith("high priority"):
+        return GuideSectionKind.AT_A_GLANCE
+    if t.startswith("topics"):
+        return GuideSectionKind.TOPICS
+    if t.startswith("practice"):
+        return GuideSectionKind.PRACTICE
+    if "coverage gap" in t:
+        return GuideSectionKind.GAPS
+    return GuideSectionKind.OTHER
+
+
+def _clean_title(title: str) -> str:
+    return title.strip().strip("[]*").strip()
+
+
+def topic_key(title: str) -> str:
+    """Case- and punctuation-insensitive key used to match topics across regenerations."""
+    return " ".join(re.findall(r"[a-z0-9]+", (title or "").lower()))
+
+
+def match_sources(sources_text: str, source_labels: list[str]) -> list[str]:
+    """Guide source labels (file names) mentioned in a topic's **Sources:** line, by full name or stem."""
+    text = (sources_text or "").lower()
+    if not text:
+        return []
+    matched = []
+    for label in source_labels:
+        name = (label or "").lower()
+        stem = Path(name).stem
+        if name and (name in text or (len(stem) >= 3 and stem in text)):
+            matched.append(label)
+    return matched
+
+
+def parse_guide_sections(markdown: str, source_labels: list[str] | None = None) -> list[dict]:
+    """
+    Split guide Markdown into ordered sections:
+      {"kind", "title", "priority", "sources", "content"}
+    Topics are the "###" blocks under "## Topics"; "###" headings elsewhere stay inside
+    their "##" section. Text before the first heading becomes an "other" section.
+    Joining the section contents with blank lines reproduces the document.
+    """
+    sections: list[dict] = []
+    current: dict | None = None
+    lines: list[str] = []
+    in_topics = False
+    in_fence = False
+
+    def flush():
+        if current is None and not "".join(lines).strip():
+            return
+        section = current or {"kind": GuideSectionKind.OTHER, "title": ""}
+        section["content"] = "\n".join(lines).strip("\n")
+        sections.append(section)
+
+    for line in (markdown or "").splitlines():
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        h2 = None if in_fence else _H2_RE.match(line)
+        h3 = None if in_fence or not in_topics else _H3_RE.match(line)
+        if h2:
+            flush()
+            title = _clean_title(h2.group(1))
+            kind = _h2_kind(title)
+            in_topics = kind == GuideSectionKind.TOPICS
+            current, lines = {"kind": kind, "title": title}, [line]
+        elif h3:
+            flush()
+            current, lines = {"kind": GuideSectionKind.TOPIC, "title": _clean_title(h3.group(1))}, [line]
+        else:
+            lines.append(line)
+    flush()
+
+    for section in sections:
+        section.setdefault("priority", None)
+        section.setdefault("sources", None)
+        if section["kind"] != GuideSectionKind.TOPIC:
+            continue
+        priority = _PRIORITY_RE.search(section["content"])
+        section["priority"] = priority.group(1).upper() if priority else None
+        sources = _SOURCES_RE.search(section["content"])
+        section["sources"] = match_sources(sources.group(1) if sources else "", source_labels or [])
+    return sections
+
+
+def render_sections(sections: list[dict]) -> str:
+    return "\n\n".join(s["content"].strip("\n") for s in sections if s["content"].strip()) + "\n"
+
+
+def store_guide_sections(guide_id: int, sections: list[dict], db: Session) -> None:
+    """Replace the guide's stored sections. The caller commits."""
+    db.query(GuideSection).filter(GuideSection.guide_id == guide_id).delete(synchronize_session=False)
+    for position, section in enumerate(sections):
+        db.add(GuideSection(
+            guide_id=guide_id,
+            position=position,
+            kind=section["kind"],
+            title=(section.get("title") or "")[:255],
+            priority=section.get("priority"),
+            sources=section.get("sources"),
+            content=section["content"],
+        ))
+
+
+def backfill_guide_sections(db: Session) -> int:
+    """Store the sections of completed guides saved before sections were. Returns the number of guides."""
+    stored = db.query(GuideSection.id).filter(GuideSection.guide_id == StudyGuide.id)
+    guides = (
+        db.query(StudyGuide)
+        .join(StudyGuideOutput, StudyGuideOutput.guide_id == StudyGuide.id)
+        .filter(StudyGuide.status == GuideStatus.completed.value, ~stored.exists())
+        .all()
+    )
+    for guide in guides:
+        labels = [src.file_name for src in guide.sources]
+        store_guide_sections(guide.id, parse_guide_sections(guide.output.content, labels), db)
+    if guides:
+        db.commit()
+    return len(guides)
+
+
+def load_guide_sections(guide_id: int, db: Session) -> list[dict]:
+    rows = (
+        db.query(GuideSection)
+        .filter(GuideSection.guide_id == guide_id)
+        .order_by(GuideSection.position)
+        .all()
+    )
+    return [
+        {"kind": r.kind, "title": r.title, "priority": r.priority, "sources": r.sources, "content": r.content}
+        for r in rows
+    ]
+
+
+def affected_topics(sections: list[dict], changed_labels: set[str]) -> list[dict]:
+    """
+    Topics to regenerate when the given sources changed or were removed: every topic that
+    cites one of them, plus topics whose sources could not be attributed to any file.
+    """
+    return [
+        s for s in sections
+        if s["kind"] == GuideSectionKind.TOPIC
+        and (not s.get("sources") or changed_labels.intersection(s["sources"]))
+    ]
+
+
+def splice_sections(old: list[dict], new: list[dict], replaced_titles: list[str]) -> list[dict]:
+    """
+    Splice regenerated sections into an existing guide:
+      - Overview and at-a-glance sections from `new` replace the old ones.
+      - Topics in `replaced_titles` are replaced in place by the new topic with the same
+        title, or dropped if the regeneration no longer includes them.
+      - New topics with titles not in the guide are appended after the last topic.
+    Practice questions, coverage gaps and all other sections are kept as they are.
+    """
+    replaced = {topic_key(t) for t in replaced_titles}
+    new_topics = {topic_key(s["title"]): s for s in new if s["kind"] == GuideSectionKind.TOPIC}
+    new_by_kind = {s["kind"]: s for s in new if s["kind"] in (GuideSectionKind.OVERVIEW, GuideSectionKind.AT_A_GLANCE)}
+    old_topic_keys = {topic_key(s["title"]) for s in old if s["kind"] == GuideSectionKind.TOPIC}
+
+    result: list[dict] = []
+    used: set[str] = set()
+    last_topic_index = None
+    for section in old:
+        kind = section["kind"]
+        if kind in new_by_kind:
+            result.append(new_by_kind.pop(kind))
+            continue
+        if kind == GuideSectionKind.TOPIC:
+            key = topic_key(section["title"])
+            if key in replaced:
+                if key in new_topics:
+                    result.append(new_topics[key])
+                    used.add(key)
+                else:
+                    continue
+            else:
+                result.append(section)
+            last_topic_index = len(result) - 1
+            continue
+        if kind == GuideSectionKind.TOPICS:
+            last_topic_index = len(result)
+        result.append(section)
+
+    added = [
+        s for key, s in new_topics.items()
+        if key not in used and key not in old_topic_keys
+    ]
+    if added:
+        insert_at = last_topic_index + 1 if last_topic_index is not None else len(result)
+        result[insert_at:insert_at] = added
+    # An overview / at-a-glance the old guide did not have goes first / after the topics
+    if GuideSectionKind.OVERVIEW in new_by_kind:
+        result.insert(0, new_by_kind.pop(GuideSectionKind.OVERVIEW))
+    if GuideSectionKind.AT_A_GLANCE in new_by_kind:
+        topic_positions = [i for i, s in enumerate(result) if s["kind"] in (GuideSectionKind.TOPIC, GuideSectionKind.TOPICS)]
+        at = topic_positions[-1] + 1 if topic_positions else len(result)
+        result.insert(at, new_by_kind.pop(GuideSectionKind.AT_A_GLANCE))
+    return result
@@ -0,0 +1,209 @@
+"""
+Version history of guide outputs.
+
+StudyGuideOutput holds the latest text of a guide. Each time a guide is generated or
+refreshed, record_output_version adds a GuideOutputVersion row for the new text and turns
+the previous latest row into a reverse delta: the line edits that rebuild the previous
+text from the new one, as zlib-compressed JSON. A refresh that rewrites three topics
+therefore stores about three topics' worth of text, however many versions the guide has.
+
+Every _SNAPSHOT_EVERY-th version is stored as a compressed full snapshot instead, so
+rebuilding an old version applies at most that many deltas. Rebuilt text is checked
+against the SHA-256 recorded when the version was current.
+"""
+
+import difflib
+import hashlib
+import json
+import zlib
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.guide import GuideOutputVersion, GuideVersionStorage, StudyGuide, StudyGuideOutput
+
+# Bound on the deltas applied to rebuild one version
+_SNAPSHOT_EVERY = 20
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_delta(new: str, old: str) -> list:
+    """
+    Ops that rebuild `old` from the lines of `new`: [start, end] copies new lines [start:end),
+    a string inserts literal text.
+    """
+    new_lines = new.splitlines(keepends=True)
+    old_lines = old.splitlines(keepends=True)
+    ops: list = []
+    matcher = difflib.SequenceMatcher(None, new_lines, old_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:  # replace / insert: the old text has lines the new one does not
+            text = "".join(old_lines[j1:j2])
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += text
+            else:
+                ops.append(text)
+    return ops
+
+
+def apply_delta(new: str, ops: list) -> str:
+    new_lines = new.splitlines(keepends=True)
+    return "".join(
+        op if isinstance(op, str) else "".join(new_lines[op[0]:op[1]])
+        for op in ops
+    )
+
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _unpack(data: bytes):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def _initial_version(guide: StudyGuide) -> GuideOutputVersion:
+    """Version 1 for the guide's current output."""
+    version = GuideOutputVersion(
+        guide_id=guide.id,
+        version=1,
+        storage=GuideVersionStorage.LATEST,
+        chars=len(guide.output.content),
+        content_sha256=_sha256(guide.output.content),
+        model_used=guide.output.model_used,
+    )
+    if guide.output.created_at is not None:
+        version.created_at = guide.output.created_at
+    return version
+
+
+def _ensure_initial_version(guide: StudyGuide, db: Session) -> GuideOutputVersion | None:
+    """The guide's latest version row, creating version 1 for a first generation."""
+    latest = (
+        db.query(GuideOutputVersion)
+        .filter(GuideOutputVersion.guide_id == guide.id, GuideOutputVersion.storage == GuideVersionStorage.LATEST)
+        .first()
+    )
+    if latest is None and guide.output is not None:
+        latest = _initial_version(guide)
+        db.add(latest)
+        db.flush()
+    return latest
+
+
+def backfill_initial_versions(db: Session) -> int:
+    """Give guides whose output was stored before versioning their version 1. Returns the number of guides."""
+    versioned = db.query(GuideOutputVersion.id).filter(GuideOutputVersion.guide_id == StudyGuide.id)
+    guides = (
+        db.query(StudyGuide)
+        .join(StudyGuideOutput, StudyGuideOutput.guide_id == StudyGuide.id)
+        .filter(~versioned.exists())
+        .all()
+    )
+    for guide in guides:
+        db.add(_initial_version(guide))
+    if guides:
+        db.commit()
+    return len(guides)
+
+
+def record_output_version(guide: StudyGuide, content: str, model_used: str | None, db: Session) -> int:
+    """
+    Record `content` as the guide's newest output version. Call before writing it to
+    guide.output (for a first generation, after setting guide.output, which makes version 1).
+    Returns the version number; unchanged text keeps the current version. The caller commits.
+    """
+    previous = _ensure_initial_version(guide, db)
+    if previous is None:
+        raise ValueError("Guide has no output to version")
+    if previous.content_sha256 == _sha256(content):
+        return previous.version
+
+    old_text = guide.output.content
+    if previous.version % _SNAPSHOT_EVERY == 0:
+        previous.storage = GuideVersionStorage.SNAPSHOT
+        previous.data = zlib.compress(old_text.encode("utf-8"), 9)
+    else:
+        previous.storage = GuideVersionStorage.DELTA
+        previous.data = _pack(make_delta(content, old_text))
+    latest = GuideOutputVersion(
+        guide_id=guide.id,
+        version=previous.version + 1,
+        storage=GuideVersionStorage.LATEST,
+        chars=len(content),
+        content_sha256=_sha256(content),
+        model_used=model_used,
+    )
+    db.add(latest)
+    db.flush()
+    return latest.version
+
+
+def list_versions(guide: StudyGuide, db: Session) -> list[dict]:
+    """Versions newest first: version, storage, chars, stored_bytes, model_used, created_at."""
+    rows = (
+        db.query(
+            GuideOutputVersion.version, GuideOutputVersion.storage, GuideOutputVersion.chars,
+            func.length(GuideOutputVersion.data).label("stored_bytes"),
+            GuideOutputVersion.model_used, GuideOutputVersion.created_at,
+        )
+        .filter(GuideOutputVersion.guide_id == guide.id)
+        .order_by(GuideOutputVersion.version.desc())
+        .all()
+    )
+    return [
+        {
+            "version": r.version,
+            "storage": r.storage,
+            "chars": r.chars,
+            "stored_bytes": r.stored_bytes if r.storage != GuideVersionStorage.LATEST else 0,
+            "model_used": r.model_used,
+            "created_at": r.created_at,
+        }
+        for r in rows
+    ]
+
+
+def reconstruct_version(guide: StudyGuide, version: int, db: Session) -> tuple[GuideOutputVersion, str]:
+    """
+    The text of one version of the guide's output. Raises LookupError for an unknown
+    version and ValueError if the rebuilt text does not match the recorded hash.
+    """
+    target = (
+        db.query(GuideOutputVersion)
+        .filter(GuideOutputVersion.guide_id == guide.id, GuideOutputVersion.version == version)
+        .first()
+    )
+    if target is None:
+        raise LookupError(f"Version {version} not found")
+    if target.storage == GuideVersionStorage.LATEST:
+        return target, guide.output.content
+
+    # Walk up from the target to the nearest full text (a snapshot or the latest version)
+    chain = (
+        db.query(GuideOutputVersion)
+        .filter(GuideOutputVersion.guide_id == guide.id, GuideOutputVersion.version >= version)
+        .order_by(GuideOutputVersion.version)
+        .limit(_SNAPSHOT_EVERY + 1)
+        .all()
+    )
+    base_index = next(
+        i for i, row in enumerate(chain)
+        if row.storage in (GuideVersionStorage.SNAPSHOT, GuideVersionStorage.LATEST)
+    )
+    base = chain[base_index]
+    if base.storage == GuideVersionStorage.LATEST:
+        text = guide.output.content
+    else:
+        text = zlib.decompress(base.data).decode("utf-8")
+    for row in reversed(chain[:base_index]):
+        text = apply_delta(text, _unpack(row.data))
+
+    if _sha256(text) != target.content_sha256:
+        raise ValueError(f"Version {version} of guide {guide.id} could not be rebuilt (hash mismatch)")
+    return target, text
@@ -0,0 +1,270 @@
+"""
+Tolerant JSON parsing for LLM responses.
+
+parse_llm_json reads the response in one linear pass and repairs what models commonly
+get wrong: Markdown code fences or prose around the JSON, trailing and missing commas,
+raw newlines/tabs inside strings, and output truncated mid-value (open strings, arrays
+and objects are closed; a dangling key or partial literal is dropped). It returns the
+parsed value together with the list of repairs it made, so callers can log them.
+"""
+
+import json
+import re
+from typing import Any
+
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z0-9_-]*[ \t]*\n?")
+_WS_RE = re.compile(r"[ \t\n\r]*")
+_STRING_CHUNK_RE = re.compile(r'[^"\\\x00-\x1f]+')
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_NUMBER_TAIL_RE = re.compile(r"[0-9.eE+-]*\Z")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_CONTROL_ESCAPES = {"\n": "\n", "\r": "\r", "\t": "\t"}
+_LITERALS = (("true", True), ("false", False), ("null", None))
+_MAX_DEPTH = 200
+
+
+class LLMJSONError(ValueError):
+    """The response contains no salvageable JSON value."""
+
+
+class _Missing:
+    """Marker for a value cut off by truncation before any of it could be kept."""
+
+
+_MISSING = _Missing()
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.s = text
+        self.n = len(text)
+        self.i = 0
+        self.repairs: list[str] = []
+        self.truncated = False
+
+    def note(self, repair: str) -> None:
+        if repair not in self.repairs:
+            self.repairs.append(repair)
+
+    def ws(self) -> None:
+        self.i = _WS_RE.match(self.s, self.i).end()
+
+    def at_end(self) -> bool:
+        if self.i >= self.n:
+            self.truncated = True
+            return True
+        return False
+
+    def error(self, message: str) -> LLMJSONError:
+        return LLMJSONError(f"{message} at position {self.i}")
+
+    def value(self, depth: int = 0) -> Any:
+        if depth > _MAX_DEPTH:
+            raise self.error("JSON nested too deeply")
+        self.ws()
+        if self.at_end():
+            return _MISSING
+        c = self.s[self.i]
+        if c == "{":
+            return self.obj(depth)
+        if c == "[":
+            return self.arr(depth)
+        if c == '"':
+            return self.string()
+        m = _NUMBER_RE.match(self.s, self.i)
+        if m:
+            self.i = m.end()
+            if _NUMBER_TAIL_RE.match(self.s, self.i):
+                # The number runs into the end of the response and may have been cut short
+                self.i = self.n
+                self.truncated = True
+            return json.loads(m.group())
+        for word, val in _LITERALS:
+            head = self.s[self.i:self.i + len(word)]
+            if head == word:
+                self.i += len(word)
+                return val
+            if self.i + len(head) >= self.n and word.startswith(head):
+                self.i = self.n
+                self.truncated = True
+                return _MISSING
+        if c == "-" and self.i + 1 >= self.n:
+            self.i = self.n
+            self.truncated = True
+            return _MISSING
+        raise self.error(f"Unexpected character {c!r}")
+
+    def string(self) -> str:
+        self.i += 1  # opening quote
+        parts: list[str] = []
+        s = self.s
+        while True:
+            m = _STRING_CHUNK_RE.match(s, self.i)
+            if m:
+                parts.append(m.group())
+                self.i = m.end()
+            if self.i >= self.n:
+                self.truncated = True
+                self.note("closed truncated string")
+                return "".join(parts)
+            c = s[self.i]
+            if c == '"':
+                self.i += 1
+                return "".join(parts)
+            if c == "\\":
+                if self.i + 1 >= self.n:
+                    self.i = self.n
+                    continue
+                e = s[self.i + 1]
+                if e == "u":
+                    hex_digits = s[self.i + 2:self.i + 6]
+                    if len(hex_digits) == 4 and all(h in "0123456789abcdefABCDEF" for h in hex_digits):
+                        parts.append(chr(int(hex_digits, 16)))
+                        self.i += 6
+                    elif self.i + 6 > self.n:
+                        self.i = self.n  # \u escape cut off by truncation
+                    else:
+                        parts.append(e)
+                        self.i += 2
+                        self.note("dropped invalid escape")
+                    continue
+                if e in _ESCAPES:
+                    parts.append(_ESCAPES[e])
+                else:
+                    parts.append(e)
+                    self.note("dropped invalid escape")
+                self.i += 2
+                continue
+            # Raw control character inside a string
+            parts.append(_CONTROL_ESCAPES.get(c, " "))
+            self.note("escaped raw newline/control character in string")
+            self.i += 1
+
+    def obj(self, depth: int) -> dict:
+        self.i += 1
+        out: dict = {}
+        expect_value = False  # True right after a comma
+        while True:
+            self.ws()
+            if self.at_end():
+                self.note("closed truncated object")
+                return out
+            c = self.s[self.i]
+            if c == "}":
+                if expect_value:
+                    self.note("removed trailing comma")
+                self.i += 1
+                return out
+            if c == ",":
+                self.note("removed extra comma")
+                self.i += 1
+                expect_value = True
+                continue
+            if c != '"':
+                raise self.error("Expected object key")
+            if out and not expect_value:
+                self.note("inserted missing comma")
+            key = self.string()
+            if self.truncated:
+                self.note("dropped truncated key")
+                return out
+            self.ws()
+            if self.at_end():
+                self.note("dropped key without value")
+                return out
+            if self.s[self.i] != ":":
+                raise self.error("Expected ':' after object key")
+            self.i += 1
+            val = self.value(depth + 1)
+            if val is _MISSING:
+                self.note("dropped key without value")
+                return out
+            out[key] = val
+            if self.truncated:
+                self.note("closed truncated object")
+                return out
+            self.ws()
+            expect_value = False
+            if self.i < self.n and self.s[self.i] == ",":
+                self.i += 1
+                expect_value = True
+
+    def arr(self, depth: int) -> list:
+        self.i += 1
+        out: list = []
+        expect_value = False
+        while True:
+            self.ws()
+            if self.at_end():
+                self.note("closed truncated array")
+                return out
+            c = self.s[self.i]
+            if c == "]":
+                if expect_value:
+                    self.note("removed trailing comma")
+                self.i += 1
+                return out
+            if c == ",":
+                self.note("removed extra comma")
+                self.i += 1
+                expect_value = True
+                continue
+            if out and not expect_value:
+                self.note("inserted missing comma")
+            val = self.value(depth + 1)
+            if val is _MISSING:
+                self.note("dropped truncated array item")
+                return out
+            out.append(val)
+            if self.truncated:
+                self.note("closed truncated array")
+                return out
+            self.ws()
+            expect_value = False
+            if self.i < self.n and self.s[self.i] == ",":
+                self.i += 1
+                expect_value = True
+
+
+def _strip_wrapping(raw: str, repairs: list[str]) -> str:
+    """Remove a Markdown code fence and any prose before the first '{' or '['."""
+    s = raw.strip()
+    m = _FENCE_RE.match(s)
+    if m:
+        s = s[m.end():]
+        end = s.rfind("```")
+        if end != -1:
+            s = s[:end]
+        repairs.append("stripped code fence")
+    starts = [p for p in (s.find("{"), s.find("[")) if p != -1]
+    if not starts:
+        return s.strip()
+    start = min(starts)
+    if s[:start].strip():
+        repairs.append("skipped text before JSON")
+    return s[start:]
+
+
+def parse_llm_json(raw: str) -> tuple[Any, list[str]]:
+    """
+    Parse a JSON object or array from an LLM response. Returns (value, repairs); repairs is
+    empty when the response was already valid JSON. Raises LLMJSONError when there is nothing
+    to salvage.
+    """
+    repairs: list[str] = []
+    s = _strip_wrapping(raw or "", repairs)
+    if not s:
+        raise LLMJSONError("Empty response")
+    try:
+        return json.loads(s), repairs
+    except json.JSONDecodeError:
+        pass
+
+    parser = _Parser(s)
+    value = parser.value()
+    if value is _MISSING:
+        raise LLMJSONError("Response ended before any JSON value")
+    parser.ws()
+    if parser.i < parser.n:
+        parser.note("ignored text after JSON")
+    return value, repairs + parser.repairs
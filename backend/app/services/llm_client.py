@@ -0,0 +1,346 @@
+"""
+Resilient call layer for the LLM provider (see llm_providers). Every LLM call site goes
+through generate / stream / count_tokens here so they share the same protections:
+
+  - Global concurrency limit (semaphore) so parallel map calls and concurrent requests
+    stay within the API quota.
+  - Per-attempt timeout and an overall deadline, so a hung call cannot hold a worker forever.
+  - Jittered exponential backoff on retryable errors (429, 500, 503, 504, timeouts).
+  - Circuit breaker: after repeated retryable failures, calls fail fast with
+    LLMUnavailableError until a cool-down passes, instead of piling up on an outage.
+
+generate_structured constrains the response to a pydantic model (sent to the provider as a
+response schema) and returns the validated instance.
+
+Every generate / stream call is recorded in llm_calls under its call_site (see telemetry).
+"""
+
+import logging
+import random
+import threading
+import time
+
+from typing import Iterator, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from app.config import get_settings
+from app.models.telemetry import LLMCallOutcome, LLMCallSite
+from app.services import telemetry
+from app.services.json_repair import LLMJSONError, parse_llm_json
+from app.services.llm_providers import LLMResponse, get_provider
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_RETRYABLE_HTTP_CODES = {408, 429, 500, 502, 503, 504}
+_BACKOFF_BASE_S = 1.0
+_BACKOFF_CAP_S = 20.0
+
+
+class LLMUnavailableError(RuntimeError):
+    """The LLM provider is rate-limited, overloaded or down; the request can be retried later."""
+
+    def __init__(self, message: str, retry_after_s: float | None = None):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class StructuredOutputError(RuntimeError):
+    """The response did not match the requested schema."""
+
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class CircuitBreaker:
+    """
+    Closed → open after `failure_threshold` consecutive retryable failures.
+    Open → half-open after `reset_timeout_s`: one trial call is let through; success closes
+    the breaker, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout_s: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Raise LLMUnavailableError if the breaker is open. Returns True when this call is the half-open trial."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout_s or self._trial_in_flight:
+                raise LLMUnavailableError(
+                    "The AI service is temporarily unavailable. Please try again shortly.",
+                    retry_after_s=max(1.0, self.reset_timeout_s - elapsed),
+                )
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self, is_trial: bool = False) -> None:
+        """is_trial: the before_call result of this call (only the trial clears the trial flag)."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            if is_trial:
+                self._trial_in_flight = False
+
+    def record_failure(self, is_trial: bool = False) -> None:
+        """is_trial: the before_call result of this call; a failed trial re-opens the breaker."""
+        with self._lock:
+            self._failures += 1
+            if is_trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("LLM circuit breaker opened after %d failure(s)", self._failures)
+                self._opened_at = time.monotonic()
+            if is_trial:
+                self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """
+        The trial call ended with a non-retryable error (or never ran): not an outage signal,
+        allow another trial. Only the call that before_call admitted as the trial may call this.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+_semaphore = threading.BoundedSemaphore(max(1, settings.llm_max_concurrency))
+breaker = CircuitBreaker(settings.llm_breaker_failure_threshold, settings.llm_breaker_reset_s)
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Rate limits, server errors and timeouts are retryable; bad requests and auth errors are not."""
+    try:
+        from google.api_core import exceptions as gexc
+        if isinstance(exc, (
+            gexc.TooManyRequests,
+            gexc.ResourceExhausted,
+            gexc.InternalServerError,
+            gexc.BadGateway,
+            gexc.ServiceUnavailable,
+            gexc.GatewayTimeout,
+            gexc.DeadlineExceeded,
+        )):
+            return True
+        if isinstance(exc, gexc.GoogleAPICallError):
+            return False
+    except ImportError:
+        pass
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code in _RETRYABLE_HTTP_CODES:
+        return True
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(_BACKOFF_CAP_S, _BACKOFF_BASE_S * (2 ** attempt)))
+
+
+def _record(
+    call_site: str,
+    model: str,
+    started: float,
+    attempts: int,
+    response: LLMResponse | None = None,
+    error: Exception | None = None,
+) -> None:
+    if error is None:
+        outcome = LLMCallOutcome.OK
+    elif isinstance(error, LLMUnavailableError):
+        outcome = LLMCallOutcome.UNAVAILABLE
+    else:
+        outcome = LLMCallOutcome.ERROR
+    telemetry.record_llm_call(
+        call_site,
+        model,
+        latency_ms=(time.monotonic() - started) * 1000,
+        attempts=attempts,
+        prompt_tokens=response.prompt_tokens if response else None,
+        output_tokens=response.output_tokens if response else None,
+        outcome=outcome,
+        error=f"{type(error).__name__}: {error}" if error else None,
+    )
+
+
+def generate(
+    model: str,
+    contents: str,
+    system_instruction: str | None = None,
+    generation_config: dict | None = None,
+    *,
+    api_key: str | None = None,
+    timeout_s: float | None = None,
+    deadline_s: float | None = None,
+    call_site: str = LLMCallSite.OTHER,
+) -> LLMResponse:
+    """
+    Generate a response with concurrency limit, per-attempt timeout, retries with jittered
+    backoff and the shared circuit breaker.
+
+    timeout_s: per-attempt timeout (default settings.llm_call_timeout_s).
+    deadline_s: overall budget across attempts and backoff (default settings.llm_deadline_s).
+    call_site: telemetry label (LLMCallSite); latency is recorded from the call to the
+    result, including waiting for a slot and backoff between attempts.
+    Raises LLMUnavailableError when retries are exhausted or the breaker is open; other
+    (non-retryable) errors propagate unchanged.
+    """
+    provider = get_provider(api_key)
+    started = time.monotonic()
+    timeout_s = timeout_s or settings.llm_call_timeout_s
+    deadline = started + (deadline_s or settings.llm_deadline_s)
+    max_attempts = max(1, settings.llm_max_attempts)
+    last_error: Exception | None = None
+    attempts = 0
+
+    try:
+        for attempt in range(max_attempts):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            is_trial = breaker.before_call()
+            if not _semaphore.acquire(timeout=remaining):
+                if is_trial:
+                    breaker.release_trial()
+                raise LLMUnavailableError("Timed out waiting for an AI request slot. Please try again.")
+            attempts += 1
+            try:
+                attempt_timeout = min(timeout_s, max(1.0, deadline - time.monotonic()))
+                response = provider.generate(
+                    model, contents, system_instruction, generation_config, timeout_s=attempt_timeout,
+                )
+            except Exception as e:
+                if not is_retryable(e):
+                    if is_trial:
+                        breaker.release_trial()
+                    raise
+                breaker.record_failure(is_trial)
+                last_error = e
+                logger.warning("LLM call failed (attempt %d/%d): %s", attempt + 1, max_attempts, e)
+            else:
+                breaker.record_success(is_trial)
+                _record(call_site, model, started, attempts, response=response)
+                return response
+            finally:
+                _semaphore.release()
+
+            if attempt + 1 < max_attempts:
+                delay = _backoff_delay(attempt)
+                if time.monotonic() + delay >= deadline:
+                    break
+                time.sleep(delay)
+
+        raise LLMUnavailableError(
+            f"The AI service is busy or unavailable ({last_error or 'deadline exceeded'}). Please try again shortly."
+        )
+    except Exception as e:
+        _record(call_site, model, started, attempts, error=e)
+        raise
+
+
+def generate_structured(
+    model: str,
+    contents: str,
+    output_model: type[T],
+    system_instruction: str | None = None,
+    generation_config: dict | None = None,
+    *,
+    api_key: str | None = None,
+    timeout_s: float | None = None,
+    deadline_s: float | None = None,
+    call_site: str = LLMCallSite.OTHER,
+) -> tuple[T, LLMResponse]:
+    """
+    generate() with the response constrained to output_model's schema. Returns the validated
+    instance and the raw response. A response cut off at max_output_tokens is closed by the
+    tolerant parser and validated as far as it goes; raises StructuredOutputError when the
+    result still does not fit the model.
+    """
+    config = dict(generation_config or {})
+    config["response_mime_type"] = "application/json"
+    config["response_schema"] = output_model
+    response = generate(
+        model, contents, system_instruction, config,
+        api_key=api_key, timeout_s=timeout_s, deadline_s=deadline_s, call_site=call_site,
+    )
+    if not response or not response.text:
+        raise StructuredOutputError(f"Empty {output_model.__name__} response")
+    try:
+        data, repairs = parse_llm_json(response.text)
+    except LLMJSONError as e:
+        raise StructuredOutputError(f"Unparseable {output_model.__name__} response: {e}") from e
+    if repairs:
+        logger.info("Repaired %s JSON: %s", output_model.__name__, "; ".join(repairs))
+    try:
+        return output_model.model_validate(data), response
+    except ValidationError as e:
+        raise StructuredOutputError(
+            f"{output_model.__name__} response does not match the schema ({e.error_count()} error(s))"
+        ) from e
+
+
+def stream(
+    model: str,
+    contents: str,
+    system_instruction: str | None = None,
+    generation_config: dict | None = None,
+    *,
+    api_key: str | None = None,
+    timeout_s: float | None = None,
+    call_site: str = LLMCallSite.OTHER,
+) -> Iterator[str]:
+    """
+    Stream response text chunks. Holds a concurrency slot for the whole stream and goes
+    through the breaker; no retries, since chunks may already have been consumed.
+    Recorded without token counts (the stream does not report usage).
+    """
+    provider = get_provider(api_key)
+    started = time.monotonic()
+    try:
+        is_trial = breaker.before_call()
+        if not _semaphore.acquire(timeout=timeout_s or settings.llm_call_timeout_s):
+            if is_trial:
+                breaker.release_trial()
+            raise LLMUnavailableError("Timed out waiting for an AI request slot. Please try again.")
+    except LLMUnavailableError as e:
+        _record(call_site, model, started, 0, error=e)
+        raise
+    settled = False  # the breaker has been told how this call ended
+    try:
+        for chunk in provider.stream(
+            model, contents, system_instruction, generation_config,
+            timeout_s=timeout_s or settings.llm_call_timeout_s,
+        ):
+            yield chunk
+    except Exception as e:
+        settled = True
+        if is_retryable(e):
+            breaker.record_failure(is_trial)
+            error = LLMUnavailableError(f"The AI service is busy or unavailable ({e}). Please try again shortly.")
+            _record(call_site, model, started, 1, error=error)
+            raise error
+        if is_trial:
+            breaker.release_trial()
+        _record(call_site, model, started, 1, error=e)
+        raise
+    else:
+        settled = True
+        breaker.record_success(is_trial)
+        _record(call_site, model, started, 1)
+    finally:
+        # A consumer that abandons the generator raises GeneratorExit here, which is not an
+        # Exception: without this the half-open trial would stay in flight and the breaker open
+        if not settled and is_trial:
+            breaker.release_trial()
+        _semaphore.release()
+
+
+def count_tokens(model: str, contents: str, system_instruction: str | None = None, *, api_key: str | None = None) -> int:
+    """Token count for a prompt, as the provider would bill it."""
+    return get_provider(api_key).count_tokens(model, contents, system_instruction)
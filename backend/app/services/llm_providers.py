@@ -0,0 +1,378 @@
+"""
+LLM provider abstraction: the generate / stream / count-tokens calls the rest of the app
+makes, independent of any vendor SDK.
+
+  GeminiProvider — google-generativeai (production).
+  FakeProvider   — deterministic, offline backend with configurable latency, token
+                   throughput and failure injection, for load tests, benchmarks and CI.
+
+Select with LLM_PROVIDER=gemini|fake (see config.Settings). Callers never use providers
+directly; they go through llm_client, which adds retries, deadlines and the breaker.
+
+generation_config may carry "response_schema" as a pydantic model class; each provider
+translates it to what its backend understands.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterator
+
+from app.config import get_settings
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    model: str
+    prompt_tokens: int | None = None
+    output_tokens: int | None = None
+
+
+class ProviderError(RuntimeError):
+    """Provider-level failure carrying an HTTP-like status code (used by llm_client.is_retryable)."""
+
+    def __init__(self, message: str, code: int | None = None):
+        super().__init__(message)
+        self.code = code
+
+
+class LLMProvider:
+    """Interface implemented by every backend."""
+
+    name = "base"
+
+    def generate(
+        self,
+        model: str,
+        contents: str,
+        system_instruction: str | None = None,
+        generation_config: dict | None = None,
+        timeout_s: float | None = None,
+    ) -> LLMResponse:
+        raise NotImplementedError
+
+    def stream(
+        self,
+        model: str,
+        contents: str,
+        system_instruction: str | None = None,
+        generation_config: dict | None = None,
+        timeout_s: float | None = None,
+    ) -> Iterator[str]:
+        raise NotImplementedError
+
+    def count_tokens(self, model: str, contents: str, system_instruction: str | None = None) -> int:
+        raise NotImplementedError
+
+
+def _resolve_ref(node: dict, defs: dict) -> dict:
+    ref = node.get("$ref")
+    return defs[ref.rsplit("/", 1)[-1]] if ref else node
+
+
+def gemini_schema(node: dict, defs: dict | None = None) -> dict:
+    """
+    Convert a pydantic JSON schema to the subset Gemini accepts: type, properties, required,
+    items, enum, nullable, description. $refs are inlined; every property is required so the
+    model always fills it (defaults only matter when validating a truncated reply).
+    """
+    defs = defs if defs is not None else node.get("$defs", {})
+    node = _resolve_ref(node, defs)
+    if "anyOf" in node:
+        options = [o for o in node["anyOf"] if o.get("type") != "null"]
+        out = gemini_schema(options[0], defs) if options else {"type": "string"}
+        if len(options) < len(node["anyOf"]):
+            out["nullable"] = True
+        return out
+    if "allOf" in node and len(node["allOf"]) == 1:
+        return gemini_schema(node["allOf"][0], defs)
+    type_ = node.get("type", "string")
+    out: dict = {"type": type_}
+    if node.get("description"):
+        out["description"] = node["description"]
+    if node.get("enum"):
+        out["enum"] = [str(v) for v in node["enum"]]
+    if type_ == "object":
+        properties = node.get("properties", {})
+        out["properties"] = {name: gemini_schema(prop, defs) for name, prop in properties.items()}
+        out["required"] = list(properties)
+    elif type_ == "array":
+        out["items"] = gemini_schema(node.get("items", {"type": "string"}), defs)
+    return out
+
+
+def _schema_dict(response_schema) -> dict:
+    """JSON schema for a pydantic model class (or an already-built JSON schema dict)."""
+    if isinstance(response_schema, dict):
+        return response_schema
+    return response_schema.model_json_schema()
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str):
+        try:
+            import google.generativeai as genai
+        except ImportError:
+            raise RuntimeError("google-generativeai package not installed")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is not set")
+        genai.configure(api_key=api_key)
+        self._genai = genai
+
+    def _model(self, model: str, system_instruction: str | None, generation_config: dict | None):
+        if generation_config and "response_schema" in generation_config:
+            generation_config = dict(generation_config)
+            generation_config["response_schema"] = gemini_schema(_schema_dict(generation_config["response_schema"]))
+        return self._genai.GenerativeModel(
+            model,
+            system_instruction=system_instruction,
+            generation_config=generation_config or None,
+        )
+
+    def generate(self, model, contents, system_instruction=None, generation_config=None, timeout_s=None):
+        request_options = {"timeout": timeout_s} if timeout_s else None
+        response = self._model(model, system_instruction, generation_config).generate_content(
+            contents, request_options=request_options,
+        )
+        usage = getattr(response, "usage_metadata", None)
+        try:
+            text = response.text if response else ""
+        except ValueError:
+            # .text raises when the candidate has no parts (e.g. blocked or empty)
+            text = ""
+        return LLMResponse(
+            text=text or "",
+            model=model,
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+        )
+
+    def stream(self, model, contents, system_instruction=None, generation_config=None, timeout_s=None):
+        request_options = {"timeout": timeout_s} if timeout_s else None
+        response = self._model(model, system_instruction, generation_config).generate_content(
+            contents, stream=True, request_options=request_options,
+        )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+    def count_tokens(self, model, contents, system_instruction=None):
+        result = self._model(model, system_instruction, None).count_tokens(contents)
+        return int(getattr(result, "total_tokens", 0) or 0)
+
+
+# ---------------------------------------------------------------------------
+# Fake provider
+# ---------------------------------------------------------------------------
+
+_FAKE_WORD_RE = re.compile(r"[A-Za-z][A-Za-z\-]{3,}")
+_FAKE_STOPWORDS = frozenset(
+    "this that with from have will what when which their there these those about would could should "
+    "into than then them they were been being each other such only also more most some many much "
+    "must source sources material materials topic topics question questions answer priority professor "
+    "past test tests handout handouts note notes study guide student course".split()
+)
+
+
+class FakeProvider(LLMProvider):
+    """
+    Deterministic offline provider. The same (model, system instruction, contents) always
+    yields the same text, shaped like what each call site expects:
+      - structured output (response_schema) → JSON instance of the schema
+      - guide synthesis (system mentions OUTPUT FORMAT) → Markdown in the guide format
+      - anything else → topic notes
+    Timing: latency_s before the first token, then output tokens at tokens_per_s.
+    failure_rate injects ProviderError(failure_code) from a seeded RNG.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_s: float = 0.0,
+        tokens_per_s: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_code: int = 503,
+        seed: int = 0,
+    ):
+        self.latency_s = latency_s
+        self.tokens_per_s = tokens_per_s
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self) -> None:
+        if self.failure_rate <= 0:
+            return
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.failure_rate:
+            raise ProviderError(f"Injected fake LLM failure ({self.failure_code})", code=self.failure_code)
+
+    @staticmethod
+    def _topics(contents: str, n: int) -> list[str]:
+        counts = Counter(
+            w.lower() for w in _FAKE_WORD_RE.findall(contents or "")
+            if w.lower() not in _FAKE_STOPWORDS
+        )
+        # Sort by count, then alphabetically, so ties are deterministic
+        ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [w.capitalize() for w, _ in ranked[:n]] or ["General Concepts"]
+
+    def _render(self, model: str, contents: str, system_instruction: str | None, generation_config: dict | None) -> str:
+        system = system_instruction or ""
+        config = generation_config or {}
+        digest = hashlib.sha256(f"{model}\n{system}\n{contents}".encode("utf-8", errors="replace")).hexdigest()
+        rng = random.Random(int(digest[:16], 16))
+        topics = self._topics(contents, 8)
+
+        if "response_schema" in config:
+            schema = _schema_dict(config["response_schema"])
+            return json.dumps(self._fake_instance(schema, schema.get("$defs", {}), rng, topics))
+        if "OUTPUT FORMAT" in system:
+            lines = [
+                "## Overview",
+                f"This guide focuses on {', '.join(topics[:3])}.",
+                "",
+                "## Topics",
+            ]
+            priorities = ["HIGH", "MEDIUM", "LOW"]
+            high = []
+            for t in topics:
+                p = priorities[rng.randint(0, 2)]
+                if p == "HIGH":
+                    high.append(t)
+                lines += ["", f"### {t}", f"**Priority:** {p}", "**Sources:** uploaded materials",
+                          f"- Key ideas about {t.lower()}"]
+            lines += ["", "## High-Priority Topics at a Glance"] + [f"- {t}" for t in high or topics[:1]]
+            lines += ["", "## Practice Questions"]
+            for t in topics[:8]:
+                lines += [f"**Q:** Explain {t.lower()}.", f"**A:** {t} is covered in the materials.", ""]
+            lines += ["## Coverage Gaps", "- None identified."]
+            return "\n".join(lines)
+        return "\n".join(f"### {t}\n- Notes on {t.lower()}" for t in topics)
+
+    def _fake_instance(self, node: dict, defs: dict, rng: random.Random, topics: list[str], name: str = ""):
+        """Deterministic value for a JSON schema node; strings are built from the prompt's topics."""
+        node = _resolve_ref(node, defs)
+        if "anyOf" in node:
+            options = [o for o in node["anyOf"] if o.get("type") != "null"]
+            return self._fake_instance(options[0], defs, rng, topics, name) if options else None
+        if node.get("enum"):
+            return node["enum"][rng.randrange(len(node["enum"]))]
+        type_ = node.get("type", "string")
+        if type_ == "object":
+            return {
+                key: self._fake_instance(prop, defs, rng, topics, key)
+                for key, prop in node.get("properties", {}).items()
+            }
+        if type_ == "array":
+            count = 5 if name == "questions" else 4 if name == "options" else min(len(topics), 6)
+            items = node.get("items", {"type": "string"})
+            values = []
+            for i in range(count):
+                value = self._fake_instance(items, defs, rng, topics[i % len(topics):] + topics[:i % len(topics)], name)
+                if isinstance(value, dict) and "id" in value:
+                    value["id"] = f"q{i + 1}"
+                values.append(value)
+            return values
+        if type_ == "integer":
+            return rng.randint(0, 5)
+        if type_ == "number":
+            return round(rng.uniform(0, 5), 2)
+        if type_ == "boolean":
+            return rng.random() < 0.5
+        topic = topics[0]
+        if "topic" in name or name == "options":
+            return topic if name != "options" else f"Mostly {topic.lower()}"
+        if name == "file_name":
+            return f"{topic.lower()}.pdf"
+        if name == "text":
+            return f"How does this professor approach {topic.lower()}?"
+        return f"Questions mostly test {', '.join(topics[:3])}."
+
+    def _token_delay(self, text: str) -> float:
+        return (len(text) / 4) / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+
+    def generate(self, model, contents, system_instruction=None, generation_config=None, timeout_s=None):
+        self._maybe_fail()
+        text = self._render(model, contents, system_instruction, generation_config)
+        max_tokens = (generation_config or {}).get("max_output_tokens")
+        if max_tokens:
+            text = text[: max_tokens * 4]
+        total = self.latency_s + self._token_delay(text)
+        if timeout_s and total > timeout_s:
+            time.sleep(timeout_s)
+            raise ProviderError("Fake LLM call timed out", code=504)
+        if total > 0:
+            time.sleep(total)
+        return LLMResponse(
+            text=text,
+            model=model,
+            prompt_tokens=self.count_tokens(model, contents, system_instruction),
+            output_tokens=max(1, len(text) // 4),
+        )
+
+    def stream(self, model, contents, system_instruction=None, generation_config=None, timeout_s=None):
+        self._maybe_fail()
+        text = self._render(model, contents, system_instruction, generation_config)
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+        for line in text.splitlines(keepends=True):
+            delay = self._token_delay(line)
+            if delay > 0:
+                time.sleep(delay)
+            yield line
+
+    def count_tokens(self, model, contents, system_instruction=None):
+        return max(1, (len(contents or "") + len(system_instruction or "")) // 4)
+
+
+_provider: LLMProvider | None = None
+_provider_lock = threading.Lock()
+
+
+def get_provider(api_key: str | None = None) -> LLMProvider:
+    """Return the process-wide provider configured by LLM_PROVIDER (created on first use)."""
+    global _provider
+    if _provider is not None:
+        return _provider
+    with _provider_lock:
+        if _provider is None:
+            settings = get_settings()
+            if (settings.llm_provider or "gemini").lower() == "fake":
+                _provider = FakeProvider(
+                    latency_s=settings.fake_llm_latency_s,
+                    tokens_per_s=settings.fake_llm_tokens_per_s,
+                    failure_rate=settings.fake_llm_failure_rate,
+                    seed=settings.fake_llm_seed,
+                )
+            else:
+                _provider = GeminiProvider(api_key if api_key is not None else settings.gemini_api_key)
+    return _provider
+
+
+def llm_configured() -> bool:
+    """True when LLM calls can be made (fake provider, or Gemini with an API key)."""
+    settings = get_settings()
+    return (settings.llm_provider or "gemini").lower() == "fake" or bool(settings.gemini_api_key)
+
+
+def set_provider(provider: LLMProvider | None) -> None:
+    """Override the provider (load tests, benchmarks). None resets to the configured one."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
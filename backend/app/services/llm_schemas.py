@@ -0,0 +1,71 @@
+"""
+Response schemas for structured LLM output.
+
+Each model is passed to llm_client.generate_structured, which sends it to the provider
+as a response schema and validates the reply into the model. Keep fields simple (no
+free-form maps, no length constraints): Gemini's schema support is a subset of JSON
+Schema, so counts and limits are enforced by the callers after validation.
+"""
+
+from pydantic import BaseModel
+
+
+class TopicCount(BaseModel):
+    topic: str
+    count: int
+
+
+class ConversionPatterns(BaseModel):
+    verbatim: int = 0
+    conceptually_transformed: int = 0
+    applied_to_new_scenario: int = 0
+
+
+class QuestionFormats(BaseModel):
+    multiple_choice: int = 0
+    free_response: int = 0
+    problem_solving: int = 0
+    short_answer: int = 0
+
+
+class HighSignalHandout(BaseModel):
+    file_name: str
+    topic_coverage: str = ""
+    question_count: int = 0
+
+
+class BlockAnalysisResult(BaseModel):
+    """How a past test draws from the block's handouts (see analysis_service)."""
+
+    topic_frequency: list[TopicCount] = []
+    conversion_patterns: ConversionPatterns = ConversionPatterns()
+    question_formats: QuestionFormats = QuestionFormats()
+    high_signal_handouts: list[HighSignalHandout] = []
+    summary: str = ""
+
+    def to_record(self) -> dict:
+        """Fields in the shape stored on CourseTestAnalysis (topic_frequency as {topic: count})."""
+        topic_frequency: dict[str, int] = {}
+        for item in self.topic_frequency:
+            topic = item.topic.strip()
+            if topic:
+                topic_frequency[topic] = topic_frequency.get(topic, 0) + max(0, item.count)
+        return {
+            "topic_frequency": topic_frequency,
+            "conversion_patterns": self.conversion_patterns.model_dump(),
+            "question_formats": self.question_formats.model_dump(),
+            "high_signal_handouts": [h.model_dump() for h in self.high_signal_handouts],
+            "summary": self.summary,
+        }
+
+
+class QuizQuestion(BaseModel):
+    id: str = ""
+    text: str = ""
+    options: list[str] = []
+
+
+class ProfessorQuiz(BaseModel):
+    """Multiple-choice questions about a professor (see llm_service.generate_professor_quiz_questions)."""
+
+    questions: list[QuizQuestion]
@@ -5,15 +5,28 @@ Prompt architecture:
   System instruction  → who Gemini is + professor profile + output format + source weighting
   User turn          → course context + per-material-type labeled sections + reflection checklist
 
+Materials larger than the context budget are condensed: sources are summarized into topic
+notes by parallel calls (cached per content hash, see digest_service), and the guide is
+synthesized from the notes, with past tests and high-signal handouts kept raw when they fit.
+
 Modular design: edit MATERIAL_INSTRUCTIONS[type] or the block constants below to tune
 how Gemini treats any individual material type without touching the rest of the prompt.
 """
 
-import json
-import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
+from app.models.telemetry import LLMCallSite
+from app.services import llm_client, telemetry
+from app.services.llm_schemas import ProfessorQuiz
+from app.services.llm_providers import get_provider
+from app.services.near_duplicates import SignatureCache, collapse_near_duplicates
+from app.services.prompt_compressor import CompressionStats, compress_sources
+from app.services.retrieval_index import BM25Index, select_relevant_text, split_into_chunks, text_hash
 from app.services.text_sanitizer import sanitize_text_for_gemini
 
+logger = logging.getLogger(__name__)
+
 GEMINI_MODEL = "gemini-2.5-flash"
 
 # Per-source character cap before truncation (~3 k tokens each)
@@ -21,6 +34,26 @@ _MAX_CHARS_PER_SOURCE = 12_000
 # Soft cap on total user-turn character length (~18 k tokens)
 _MAX_TOTAL_CHARS = 72_000
 
+# Map-reduce mode (materials larger than _MAX_TOTAL_CHARS): each source is split into
+# pieces of up to _MAP_CHUNK_CHARS, summarized into topic notes in parallel, then synthesized.
+_MAP_CHUNK_CHARS = 24_000
+_MAP_MAX_WORKERS = 6
+_MAP_MAX_OUTPUT_TOKENS = 1024
+# Reduce phase: the notes of all condensed sources must fit what the raw sources leave of
+# _MAX_TOTAL_CHARS (less _PROMPT_OVERHEAD_CHARS for headings and analyses). Note sets over
+# their even share of that budget are condensed again, for up to _REDUCE_MAX_ROUNDS rounds;
+# when a share would fall under _REDUCE_MIN_CHARS, neighbouring note sets of one material
+# type are merged first.
+_PROMPT_OVERHEAD_CHARS = 4_000
+_REDUCE_MIN_CHARS = 1_500
+_REDUCE_MAX_ROUNDS = 3
+# Room for the "[Source truncated ...]" marker _truncate_text appends
+_TRUNCATION_NOTE_CHARS = 64
+# Bump whenever _MAP_SYSTEM_INSTRUCTION or the digest prompt changes, so cached digests are regenerated
+DIGEST_PROMPT_VERSION = "v1"
+# Output cap when only some topics of an existing guide are regenerated
+_REFRESH_MAX_OUTPUT_TOKENS = 4096
+
 # ---------------------------------------------------------------------------
 # Modular per-material-type instructions
 # Edit any entry independently to change how Gemini uses that source type.
@@ -113,6 +146,60 @@ BEFORE WRITING THE FINAL OUTPUT — silently run this checklist:
 Fix any failures before producing the output.
 """
 
+_REFRESH_FORMAT_BLOCK = """\
+OUTPUT FORMAT — you are updating part of an existing study guide whose materials changed.
+Respond in Markdown with ONLY these sections, in this order:
+
+## Overview
+2–3 sentences covering what the whole guide focuses on and the highest-priority areas.
+
+## Topics
+One block for each topic under "Topics to rewrite" (keep their exact names), plus any new major
+topic the materials introduce that is not under "Topics already in the guide":
+
+### [Topic Name]
+**Priority:** HIGH | MEDIUM | LOW
+*(HIGH = appears on past tests or explicitly emphasized by the professor)*
+**Sources:** [which materials covered this]
+- Key concepts, definitions, and details to know
+
+Leave out a topic to rewrite only if the materials no longer cover it.
+Do not rewrite topics already in the guide.
+
+## High-Priority Topics at a Glance
+Bulleted list of every HIGH priority topic in the whole guide: the topics you wrote plus the HIGH
+topics already in the guide.
+
+Do not write Practice Questions or Coverage Gaps; the existing guide keeps those sections.
+"""
+
+_MAP_SYSTEM_INSTRUCTION = """\
+You are condensing one piece of course material into topic notes for a study guide writer.
+Another model will combine your notes with notes from other materials, so keep only what matters for exams:
+- One "### Topic" heading per topic covered, using the material's own terminology.
+- Under each topic: key definitions, formulas, frameworks, and one or two key examples, as terse bullets.
+- For past tests: list every question (paraphrased briefly) under the topic it tests, prefixed "Tested:".
+- Note anything the material explicitly emphasizes ("will be on the exam", repeated, boxed).
+No introduction or conclusion. Output Markdown only.
+"""
+
+_REDUCE_SYSTEM_INSTRUCTION = """\
+You are shortening topic notes for a study guide writer. Rewrite the notes below in at most the
+requested number of characters:
+- Keep the "### Topic" structure and the material's terminology; merge duplicate topics.
+- Keep every "Tested:" line (shorten its wording if needed) and anything marked as emphasized.
+- Drop examples and detail before dropping topics.
+No introduction or conclusion. Output Markdown only.
+"""
+
+_DIGEST_LABEL_SUFFIX = " (condensed notes)"
+
+_CONDENSED_NOTE = (
+    "\n---\n_Sources labeled \"(condensed notes)\" are topic notes generated from the full material "
+    "(the materials exceeded the context budget). Treat each note set as that source's content; "
+    "lines prefixed \"Tested:\" come from past tests._"
+)
+
 
 # ---------------------------------------------------------------------------
 # Public API
@@ -127,6 +214,14 @@ def build_system_instruction(
     The professor profile belongs here (not in the user turn) so it acts as
     a persistent lens over every decision Gemini makes.
     """
+    return (
+        _build_system_context(professor_profile, professor_analysis)
+        + _WEIGHTING_BLOCK + "\n" + _OUTPUT_FORMAT_BLOCK + "\n" + _REFLECTION_BLOCK
+    )
+
+
+def _build_system_context(professor_profile: dict | None, professor_analysis: dict | None) -> str:
+    """Role, professor profile, quiz answers and historical exam patterns (shared by full and refresh prompts)."""
     base = (
         "You are an expert, exam-focused study guide generator.\n"
         "Your goal is to help students succeed on their specific professor's exams.\n\n"
@@ -176,7 +271,7 @@ def build_system_instruction(
                 analysis_block += f"Based on {pairs_analyzed} analyzed test-handout pair(s).\n"
             base += analysis_block + "\n"
 
-    return base + _WEIGHTING_BLOCK + "\n" + _OUTPUT_FORMAT_BLOCK + "\n" + _REFLECTION_BLOCK
+    return base
 
 
 def build_user_prompt(
@@ -185,11 +280,22 @@ def build_user_prompt(
     user_specs: str | None,
     typed_sources: list[tuple[str, str, str]],  # (material_type, label, text)
     block_analyses: list | None = None,
+    relevance_query: dict[str, float] | None = None,
+    relevance_index: BM25Index | None = None,
+    duplicates: list[tuple[str, str, str]] | None = None,  # (material_type, label, kept label)
 ) -> str:
     """
     Build the user-turn prompt.
     Sources are grouped by material type, each group prefixed with its
     instructions so Gemini knows exactly how to use each one.
+
+    When relevance_query is given (see retrieval_index.build_relevance_query), sources
+    over the per-source cap keep their most relevant chunks instead of their first
+    N characters. Past tests are the query themselves, so they keep head truncation.
+    Sources dropped as near-duplicates (see near_duplicates.collapse_near_duplicates) are
+    listed under their type with a pointer to the copy that was kept.
+    Source texts must already be sanitized (file_parser output or digests); only labels
+    and other user-entered strings are sanitized here.
     """
     parts: list[str] = []
 
@@ -228,31 +334,67 @@ def build_user_prompt(
     grouped: dict[str, list[tuple[str, str]]] = {}
     for mtype, label, text in typed_sources:
         if text and text.strip():
-            grouped.setdefault(mtype, []).append((sanitize_text_for_gemini(label), sanitize_text_for_gemini(text)))
+            grouped.setdefault(mtype, []).append((sanitize_text_for_gemini(label), text))
+    duplicates_by_type: dict[str, list[tuple[str, str]]] = {}
+    for mtype, label, kept_label in duplicates or []:
+        duplicates_by_type.setdefault(mtype, []).append(
+            (sanitize_text_for_gemini(label), sanitize_text_for_gemini(kept_label))
+        )
 
     if not grouped:
         return "\n".join(parts) if parts else ""
 
     type_order = ["past_test", "handout", "note", "study_guide", "other"]
-    total_chars = sum(len(p) for p in parts)
+    # Condensed notes are sized to the budget by the reduce phase (see _reduce_notes), so
+    # their space is reserved up front and they are never capped or omitted here
+    total_chars = sum(len(p) for p in parts) + sum(
+        len(text) for sources in grouped.values() for label, text in sources if _is_digest_label(label)
+    )
 
     for mtype in type_order:
-        if mtype not in grouped:
+        if mtype not in grouped and mtype not in duplicates_by_type:
             continue
         heading = _TYPE_HEADING.get(mtype, mtype.upper())
         instruction = MATERIAL_INSTRUCTIONS.get(mtype, "")
         parts.append(f"\n---\n## {heading}\n_{instruction}_")
-        for label, text in grouped[mtype]:
+        for label, text in grouped.get(mtype, []):
+            if _is_digest_label(label):
+                parts.append(f"\n### {label}\n\n{text}\n")
+                continue
             if total_chars >= _MAX_TOTAL_CHARS:
                 parts.append(f"\n### {label}\n*[Omitted — total context limit reached]*\n")
                 continue
-            truncated = _truncate_text(text, _MAX_CHARS_PER_SOURCE)
+            budget = min(_MAX_CHARS_PER_SOURCE, _MAX_TOTAL_CHARS - total_chars)
+            if relevance_query and mtype != "past_test" and len(text) > budget:
+                truncated = select_relevant_text(text, relevance_query, budget, relevance_index)
+            else:
+                truncated = _truncate_text(text, _MAX_CHARS_PER_SOURCE)
             total_chars += len(truncated)
             parts.append(f"\n### {label}\n\n{truncated}\n")
+        for label, kept_label in duplicates_by_type.get(mtype, []):
+            parts.append(f"\n### {label}\n*[Omitted — near-duplicate of {kept_label}]*\n")
 
     return "\n".join(parts)
 
 
+def _compress(
+    typed_sources: list[tuple[str, str, str]],
+    compression_stats: list[CompressionStats] | None,
+) -> list[tuple[str, str, str]]:
+    """Strip boilerplate from every source and report the savings."""
+    typed_sources, stats = compress_sources(typed_sources)
+    before = sum(s.chars_before for s in stats)
+    if before:
+        logger.info(
+            "Prompt compression: %d → %d chars (%.0f%% saved, %d boilerplate lines) over %d source(s)",
+            before, sum(s.chars_after for s in stats), 100 * sum(s.saved_chars for s in stats) / before,
+            sum(s.lines_removed for s in stats), len(stats),
+        )
+    if compression_stats is not None:
+        compression_stats.extend(stats)
+    return typed_sources
+
+
 def generate_study_guide(
     course: str,
     professor_name: str,
@@ -262,20 +404,63 @@ def generate_study_guide(
     api_key: str,
     block_analyses: list | None = None,
     professor_analysis: dict | None = None,
+    relevance_query: dict[str, float] | None = None,
+    relevance_index: BM25Index | None = None,
+    mode: str = "auto",
+    digest_cache=None,
+    signature_cache: SignatureCache | None = None,
+    compression_stats: list[CompressionStats] | None = None,
 ) -> tuple[str, str]:
     """
     Call Gemini to generate a study guide.
     Returns (markdown_content, model_used).
-    """
-    try:
-        import google.generativeai as genai
-    except ImportError:
-        raise RuntimeError("google-generativeai package not installed")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is not set")
 
+    mode:
+      "single"     — (excerpted) raw sources in one prompt.
+      "digest"     — past tests and high-signal handouts stay raw; every other source is
+                     replaced by its topic-note digest.
+      "map_reduce" — every source is condensed into digests, then the guide is synthesized.
+    In both condensed modes, digests that together exceed the budget left by the raw sources
+    are condensed further (see _reduce_notes) rather than dropped from the prompt.
+      "auto"       — single when the materials fit _MAX_TOTAL_CHARS, else digest when the
+                     raw priority sources fit half the budget, else map_reduce.
+    digest_cache (see digest_service.DigestCache) persists digests by content hash so each
+    source is only condensed once across guides; without it digests are generated per call.
+    Near-duplicate sources are collapsed to one copy first; signature_cache (see
+    near_duplicates.SignatureCache) stores their signatures by content hash. Boilerplate is
+    then stripped from the rest (see prompt_compressor); pass a list as compression_stats
+    to receive the per-source savings.
+    """
+    get_provider(api_key)  # fail fast on a missing SDK or API key
     system_instruction = build_system_instruction(professor_profile, professor_analysis)
-    user_content = build_user_prompt(course, professor_name, user_specs, typed_sources, block_analyses)
+    typed_sources, duplicates = collapse_near_duplicates(typed_sources, signature_cache)
+    typed_sources = _compress(typed_sources, compression_stats)
+
+    priority = _priority_source_indices(typed_sources, block_analyses)
+    if mode == "auto":
+        if not needs_map_reduce(typed_sources):
+            mode = "single"
+        elif sum(min(len(typed_sources[i][2] or ""), _MAX_CHARS_PER_SOURCE) for i in priority) <= _MAX_TOTAL_CHARS // 2:
+            mode = "digest"
+        else:
+            mode = "map_reduce"
+    condensed = mode in ("digest", "map_reduce")
+    if condensed:
+        keep_raw = priority if mode == "digest" else set()
+        typed_sources = _map_sources_to_notes(
+            typed_sources, keep_raw=keep_raw, digest_cache=digest_cache, api_key=api_key,
+        )
+        raw_chars = sum(
+            min(len(text or ""), _MAX_CHARS_PER_SOURCE)
+            for _, label, text in typed_sources if not _is_digest_label(label)
+        )
+        notes_budget = max(_MAX_TOTAL_CHARS - _PROMPT_OVERHEAD_CHARS - raw_chars, _MAX_TOTAL_CHARS // 4)
+        typed_sources = _reduce_notes(typed_sources, notes_budget, digest_cache=digest_cache, api_key=api_key)
+
+    user_content = build_user_prompt(
+        course, professor_name, user_specs, typed_sources, block_analyses,
+        relevance_query=relevance_query, relevance_index=relevance_index, duplicates=duplicates,
+    )
 
     if not user_content.strip():
         return (
@@ -283,19 +468,83 @@ def generate_study_guide(
             "Please upload PDF, TXT, MD, DOC, DOCX, RTF, ODT, or HTML files with readable content.*",
             "none",
         )
+    if condensed:
+        user_content = _CONDENSED_NOTE + "\n" + user_content
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(
+    response = llm_client.generate(
         GEMINI_MODEL,
+        user_content,
         system_instruction=system_instruction,
         generation_config={"max_output_tokens": 8192},
+        api_key=api_key,
+        call_site=LLMCallSite.GUIDE,
     )
-    response = model.generate_content(user_content)
     if not response or not response.text:
         return ("*No response generated.*", GEMINI_MODEL)
     return response.text.strip(), GEMINI_MODEL
 
 
+def refresh_study_guide_sections(
+    course: str,
+    professor_name: str,
+    user_specs: str | None,
+    typed_sources: list[tuple[str, str, str]],  # (material_type, label, text)
+    professor_profile: dict | None,
+    api_key: str,
+    topics_to_rewrite: list[str],
+    kept_topics: list[tuple[str, str | None]],  # (title, priority) of topics left as they are
+    changed_sources: list[str] | None = None,
+    block_analyses: list | None = None,
+    professor_analysis: dict | None = None,
+    relevance_query: dict[str, float] | None = None,
+    relevance_index: BM25Index | None = None,
+    signature_cache: SignatureCache | None = None,
+    compression_stats: list[CompressionStats] | None = None,
+) -> tuple[str, str]:
+    """
+    Regenerate only part of an existing guide: the Overview, the given topics (plus any new
+    topics from changed materials) and the at-a-glance list. typed_sources should hold the
+    past tests and the sources behind the topics being rewritten, not the whole guide's inputs.
+    Returns (markdown, model_used); splice it into the guide with guide_sections.splice_sections.
+    """
+    get_provider(api_key)
+    system_instruction = (
+        _build_system_context(professor_profile, professor_analysis)
+        + _WEIGHTING_BLOCK + "\n" + _REFRESH_FORMAT_BLOCK
+    )
+    typed_sources, duplicates = collapse_near_duplicates(typed_sources, signature_cache)
+    typed_sources = _compress(typed_sources, compression_stats)
+    user_content = build_user_prompt(
+        course, professor_name, user_specs, typed_sources, block_analyses,
+        relevance_query=relevance_query, relevance_index=relevance_index, duplicates=duplicates,
+    )
+
+    update = ["\n---\n## Guide Being Updated"]
+    if changed_sources:
+        update.append("**Changed materials:** " + ", ".join(sanitize_text_for_gemini(s) for s in changed_sources))
+    update.append("**Topics to rewrite:**")
+    update += [f"- {sanitize_text_for_gemini(t)}" for t in topics_to_rewrite] or ["- (none — only add new topics)"]
+    if kept_topics:
+        update.append("**Topics already in the guide (kept as is):**")
+        update += [
+            f"- {sanitize_text_for_gemini(t)}" + (f" ({p})" if p else "")
+            for t, p in kept_topics
+        ]
+    user_content += "\n".join(update)
+
+    response = llm_client.generate(
+        GEMINI_MODEL,
+        user_content,
+        system_instruction=system_instruction,
+        generation_config={"max_output_tokens": _REFRESH_MAX_OUTPUT_TOKENS},
+        api_key=api_key,
+        call_site=LLMCallSite.GUIDE_REFRESH,
+    )
+    if not response or not response.text:
+        raise RuntimeError("No response generated for the guide refresh")
+    return response.text.strip(), GEMINI_MODEL
+
+
 def generate_professor_quiz_questions(
     professor_name: str,
     specialties: str | None,
@@ -304,24 +553,18 @@ def generate_professor_quiz_questions(
 ) -> list[dict]:
     """
     Call Gemini to generate exactly 5 multiple-choice questions that help tailor a study guide
-    for this professor. Returns list of {"id": "q1", "text": "...", "options": ["A", "B", "C", "D"]}.
+    for this professor. Returns list of {"id": "q1", "text": "...", "options": ["A", "B", "C", "D"]}
+    (fewer than 5 only if the model's reply was cut short). Raises llm_client.StructuredOutputError
+    when the model's replies never match the schema.
     """
-    try:
-        import google.generativeai as genai
-    except ImportError:
-        raise RuntimeError("google-generativeai package not installed")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is not set")
+    get_provider(api_key)  # fail fast on a missing SDK or API key
 
     system = (
         "You are a helpful assistant that creates multiple-choice survey questions for students "
-        "about their professor. Your output will be parsed as JSON. "
-        "Respond with ONLY a valid JSON array of exactly 5 objects. "
-        "Each object must have exactly three keys: "
-        "\"id\" (string: \"q1\", \"q2\", \"q3\", \"q4\", \"q5\"), "
-        "\"text\" (string: the question, one short sentence), and "
-        "\"options\" (array of exactly 4 strings: the multiple-choice options, e.g. [\"Mostly short answer\", \"Mix of MC and short answer\", \"Mostly multiple choice\", \"Essays and long form\"]). "
-        "No markdown, no code fences, no explanation — only the JSON array."
+        "about their professor. Write exactly 5 questions with ids \"q1\" to \"q5\". "
+        "Each question is one short sentence with exactly 4 short, distinct options "
+        "(e.g. \"Mostly short answer\", \"Mix of MC and short answer\", \"Mostly multiple choice\", "
+        "\"Essays and long form\")."
     )
     parts = [f"Professor name: {sanitize_text_for_gemini(professor_name or 'Unknown')}."]
     if specialties and specialties.strip():
@@ -335,78 +578,242 @@ def generate_professor_quiz_questions(
     )
     user_content = " ".join(parts)
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(
+    quiz, _ = llm_client.generate_structured(
         GEMINI_MODEL,
+        user_content,
+        ProfessorQuiz,
         system_instruction=system,
         generation_config={"max_output_tokens": 2048},
+        api_key=api_key,
+        call_site=LLMCallSite.QUIZ,
     )
-    response = model.generate_content(user_content)
-    if not response or not response.text:
-        raise ValueError("No response generated for quiz questions")
-
-    raw = response.text.strip()
-    if "```" in raw:
-        raw = re.sub(r"^```(?:json)?\s*", "", raw)
-        raw = re.sub(r"\s*```\s*$", "", raw)
-    try:
-        data = json.loads(raw)
-    except json.JSONDecodeError as e:
-        # Response may be truncated (unterminated string) or malformed; try to repair and reparse
-        data = _repair_quiz_json(raw, is_unterminated_string="Unterminated string" in str(e) or " Unterminated" in str(e))
-    if not isinstance(data, list):
-        data = [data]
+
     result = []
-    for i, item in enumerate(data[:5]):
-        if isinstance(item, dict):
-            qid = item.get("id") or f"q{i + 1}"
-            if not str(qid).startswith("q"):
-                qid = f"q{i + 1}"
-            text = item.get("text") or str(item.get("question", "")) or f"Question {i + 1}"
-            opts = item.get("options")
-            if not isinstance(opts, list) or len(opts) < 2:
-                opts = ["Option A", "Option B", "Option C", "Option D"][: max(2, len(opts) if isinstance(opts, list) else 4)]
-            options = [str(o).strip()[:200] for o in opts if o][:4]
-            while len(options) < 2:
-                options.append(f"Option {len(options) + 1}")
-        else:
-            qid = f"q{i + 1}"
-            text = f"Question {i + 1}."
-            options = ["Option A", "Option B", "Option C", "Option D"]
-        result.append({"id": qid, "text": text[:500], "options": options})
-    while len(result) < 5:
-        result.append({
-            "id": f"q{len(result) + 1}",
-            "text": f"Question {len(result) + 1}.",
-            "options": ["Option A", "Option B", "Option C", "Option D"],
-        })
-    return result[:5]
+    for q in quiz.questions:
+        text = q.text.strip()
+        options = [o.strip()[:200] for o in q.options if o and o.strip()][:4]
+        # A reply cut off mid-question validates with partial fields; skip what is unusable
+        if not text or len(options) < 2:
+            continue
+        result.append({"id": f"q{len(result) + 1}", "text": text[:500], "options": options})
+        if len(result) == 5:
+            break
+    if not result:
+        raise ValueError("No usable quiz questions were generated. Please try again.")
+    return result
+
+
+def needs_map_reduce(typed_sources: list[tuple[str, str, str]]) -> bool:
+    """True when the raw materials cannot fit the single-prompt budget."""
+    return sum(len(text or "") for _, _, text in typed_sources) > _MAX_TOTAL_CHARS
 
 
 # ---------------------------------------------------------------------------
 # Internal helpers
 # ---------------------------------------------------------------------------
 
-def _repair_quiz_json(raw: str, is_unterminated_string: bool = True) -> list:
-    """Attempt to repair truncated or malformed JSON from the LLM. Returns a list of question dicts."""
-    repaired = raw.rstrip()
-    if repaired.endswith("\\"):
-        repaired = repaired[:-1]
-    # Only close an open string when the parse error indicated unterminated string
-    if is_unterminated_string and repaired and not repaired.endswith('"') and not repaired.endswith("}"):
-        repaired += '"'
-    # Balance brackets: add } and ] as needed
-    open_braces = repaired.count("{") - repaired.count("}")
-    open_brackets = repaired.count("[") - repaired.count("]")
-    repaired = repaired.rstrip()
-    while repaired.endswith(","):
-        repaired = repaired[:-1].rstrip()
-    repaired += "}" * max(0, open_braces) + "]" * max(0, open_brackets)
-    try:
-        out = json.loads(repaired)
-        return out if isinstance(out, list) else [out]
-    except json.JSONDecodeError:
-        return []
+def _priority_source_indices(
+    typed_sources: list[tuple[str, str, str]],
+    block_analyses: list | None,
+) -> set[int]:
+    """Indices of sources worth sending raw: past tests and handouts analyses flagged as high-signal."""
+    high_signal = {
+        (hs.get("file_name") or "").strip()
+        for ba in (block_analyses or [])
+        for hs in (ba.get("high_signal_handouts") or [])
+        if isinstance(hs, dict)
+    }
+    return {
+        i for i, (mtype, label, _) in enumerate(typed_sources)
+        if mtype == "past_test" or (label or "").strip() in high_signal
+    }
+
+
+def _map_sources_to_notes(
+    typed_sources: list[tuple[str, str, str]],
+    keep_raw: set[int] | None = None,
+    digest_cache=None,
+    api_key: str | None = None,
+) -> list[tuple[str, str, str]]:
+    """
+    Map phase: split each source into pieces and summarize every piece into topic notes
+    with parallel Gemini calls. Returns typed_sources with notes in place of raw text
+    (sources in keep_raw are passed through unchanged).
+
+    Digests are looked up in / stored to digest_cache by (piece hash, material type,
+    DIGEST_PROMPT_VERSION). A failed piece falls back to a head excerpt (never cached) so one
+    bad call does not lose the whole source; if every call fails the first error is raised.
+    """
+    keep_raw = keep_raw or set()
+    # (source index, piece index, material_type, label, text, cache key)
+    jobs: list[tuple[int, int, str, str, str, tuple[str, str, str]]] = []
+    for si, (mtype, label, text) in enumerate(typed_sources):
+        if si in keep_raw or not text or not text.strip():
+            continue
+        pieces = split_into_chunks(text, _MAP_CHUNK_CHARS) or [text]
+        for pi, piece in enumerate(pieces):
+            part = f" (part {pi + 1} of {len(pieces)})" if len(pieces) > 1 else ""
+            key = (text_hash(piece), mtype, DIGEST_PROMPT_VERSION)
+            jobs.append((si, pi, mtype, f"{label}{part}", piece, key))
+
+    cached = digest_cache.get_many([j[5] for j in jobs]) if digest_cache is not None else {}
+    notes: dict[tuple[int, int], str] = {}
+    pending = []
+    for job in jobs:
+        if job[5] in cached:
+            notes[(job[0], job[1])] = cached[job[5]]
+        else:
+            pending.append(job)
+    telemetry.record_cache_hits(LLMCallSite.DIGEST, GEMINI_MODEL, len(jobs) - len(pending))
+
+    def summarize(job) -> str:
+        _, _, mtype, label, piece, _ = job
+        prompt = (
+            f"**Material type:** {_TYPE_HEADING.get(mtype, mtype)}\n"
+            f"**Source:** {sanitize_text_for_gemini(label)}\n\n"
+            f"{piece}"
+        )
+        response = llm_client.generate(
+            GEMINI_MODEL,
+            prompt,
+            system_instruction=_MAP_SYSTEM_INSTRUCTION,
+            generation_config={"max_output_tokens": _MAP_MAX_OUTPUT_TOKENS},
+            api_key=api_key,
+            call_site=LLMCallSite.DIGEST,
+        )
+        if not response or not response.text:
+            raise RuntimeError(f"No notes generated for {label}")
+        return sanitize_text_for_gemini(response.text).strip()
+
+    fresh: dict[tuple[str, str, str], str] = {}
+    errors: list[Exception] = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(_MAP_MAX_WORKERS, len(pending))) as pool:
+            futures = [(job, telemetry.submit_with_context(pool, summarize, job)) for job in pending]
+            for job, future in futures:
+                try:
+                    notes[(job[0], job[1])] = fresh[job[5]] = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    notes[(job[0], job[1])] = _truncate_text(job[4], _MAP_CHUNK_CHARS // 8)
+        if len(errors) == len(jobs):
+            raise errors[0]
+    if fresh and digest_cache is not None:
+        digest_cache.put_many(fresh)
+
+    mapped: list[tuple[str, str, str]] = []
+    for si, (mtype, label, text) in enumerate(typed_sources):
+        if si in keep_raw:
+            mapped.append((mtype, label, text))
+            continue
+        source_notes = [notes[k] for k in sorted(k for k in notes if k[0] == si)]
+        if source_notes:
+            mapped.append((mtype, f"{label}{_DIGEST_LABEL_SUFFIX}", "\n\n".join(source_notes)))
+    return mapped
+
+
+def _is_digest_label(label: str) -> bool:
+    return (label or "").endswith(_DIGEST_LABEL_SUFFIX)
+
+
+def _merge_note_sets(
+    typed_sources: list[tuple[str, str, str]],
+    group_size: int,
+) -> list[tuple[str, str, str]]:
+    """Merge runs of up to group_size consecutive digests of one material type into one note set each."""
+    merged: list[tuple[str, str, str]] = []
+    group: list[tuple[str, str, str]] = []
+
+    def flush():
+        if not group:
+            return
+        if len(group) == 1:
+            merged.append(group[0])
+        else:
+            names = [label[:-len(_DIGEST_LABEL_SUFFIX)] for _, label, _ in group]
+            shown = "; ".join(names[:3]) + (f" and {len(names) - 3} more" if len(names) > 3 else "")
+            text = "\n\n".join(f"#### {name}\n{notes}" for name, (_, _, notes) in zip(names, group))
+            merged.append((group[0][0], f"{shown}{_DIGEST_LABEL_SUFFIX}", text))
+        group.clear()
+
+    for source in typed_sources:
+        if not _is_digest_label(source[1]):
+            flush()
+            merged.append(source)
+            continue
+        if group and (group[0][0] != source[0] or len(group) >= group_size):
+            flush()
+        group.append(source)
+    flush()
+    return merged
+
+
+def _reduce_notes(
+    typed_sources: list[tuple[str, str, str]],
+    budget: int,
+    digest_cache=None,
+    api_key: str | None = None,
+) -> list[tuple[str, str, str]]:
+    """
+    Reduce phase: condense digest note sets until together they fit `budget` characters.
+    Each round, note sets longer than their even share of the budget are rewritten to that
+    share by parallel Gemini calls (cached like map digests, by notes hash and target size).
+    Whatever still exceeds its share after the last round, or whose call failed, is cut to
+    its share, so every source keeps a place in the prompt.
+    """
+    sources = list(typed_sources)
+    for _ in range(_REDUCE_MAX_ROUNDS):
+        digests = [i for i, (_, label, _) in enumerate(sources) if _is_digest_label(label)]
+        if not digests or sum(len(sources[i][2]) for i in digests) <= budget:
+            return sources
+        if budget // len(digests) < _REDUCE_MIN_CHARS:
+            group_size = -(-len(digests) * _REDUCE_MIN_CHARS // budget)  # ceil
+            sources = _merge_note_sets(sources, group_size)
+            digests = [i for i, (_, label, _) in enumerate(sources) if _is_digest_label(label)]
+        share = budget // len(digests)
+        over = [i for i in digests if len(sources[i][2]) > share]
+        version = f"{DIGEST_PROMPT_VERSION}-r{share}"
+        keys = {i: (text_hash(sources[i][2]), sources[i][0], version) for i in over}
+        cached = digest_cache.get_many(list(keys.values())) if digest_cache is not None else {}
+        pending = [i for i in over if keys[i] not in cached]
+        telemetry.record_cache_hits(LLMCallSite.DIGEST, GEMINI_MODEL, len(over) - len(pending))
+
+        def condense(i: int) -> str:
+            mtype, label, notes = sources[i]
+            response = llm_client.generate(
+                GEMINI_MODEL,
+                f"**Source:** {sanitize_text_for_gemini(label)}\n**Maximum length:** {share} characters\n\n{notes}",
+                system_instruction=_REDUCE_SYSTEM_INSTRUCTION,
+                generation_config={"max_output_tokens": max(256, share // 3)},
+                api_key=api_key,
+                call_site=LLMCallSite.DIGEST,
+            )
+            if not response or not response.text:
+                raise RuntimeError(f"No reduced notes generated for {label}")
+            return sanitize_text_for_gemini(response.text).strip()
+
+        reduced = {i: cached[keys[i]] for i in over if keys[i] in cached}
+        fresh: dict[tuple[str, str, str], str] = {}
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(_MAP_MAX_WORKERS, len(pending))) as pool:
+                futures = [(i, telemetry.submit_with_context(pool, condense, i)) for i in pending]
+                for i, future in futures:
+                    try:
+                        reduced[i] = fresh[keys[i]] = future.result()
+                    except Exception as e:
+                        logger.warning("Reducing notes failed for %s: %s", sources[i][1], e)
+                        reduced[i] = _truncate_text(sources[i][2], share - _TRUNCATION_NOTE_CHARS)
+        if fresh and digest_cache is not None:
+            digest_cache.put_many(fresh)
+        for i, notes in reduced.items():
+            sources[i] = (sources[i][0], sources[i][1], notes)
+
+    digests = [i for i, (_, label, _) in enumerate(sources) if _is_digest_label(label)]
+    if digests and sum(len(sources[i][2]) for i in digests) > budget:
+        share = budget // len(digests)
+        for i in digests:
+            sources[i] = (sources[i][0], sources[i][1], _truncate_text(sources[i][2], share - _TRUNCATION_NOTE_CHARS))
+    return sources
 
 
 def _truncate_text(text: str, max_chars: int) -> str:
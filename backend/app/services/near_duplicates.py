@@ -0,0 +1,213 @@
+"""
+Near-duplicate source detection with MinHash signatures.
+
+Students often upload the same lecture twice (a PDF and its DOCX export, or a "Copy of"
+attachment). Each extracted text gets a bottom-k MinHash signature over word 5-gram
+shingles: the _SIGNATURE_SIZE smallest 64-bit shingle hashes. Two signatures estimate the
+Jaccard similarity of the shingle sets, so a re-exported file with different whitespace,
+headers or page numbers still matches while genuinely different handouts do not.
+
+Signatures are stored by text hash (SignatureCache) so each text is shingled once.
+llm_service collapses near-duplicates to one source before prompt assembly, and the upload
+route uses the same signatures to warn about files that duplicate existing attachments.
+"""
+
+import hashlib
+import heapq
+import logging
+import re
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.course import CourseAttachment, CourseTextChunk, TextSignature
+from app.services.retrieval_index import text_hash
+
+logger = logging.getLogger(__name__)
+
+# Bump when shingling or the signature size changes, so stored signatures are recomputed
+SIGNATURE_VERSION = "v2"  # v1 could hold signatures of retrieval chunks under the text hash
+# Signatures approximated from a text's retrieval chunks, which may split words apart: kept
+# apart from those of the exact text stored under the same text hash
+_CHUNK_SIGNATURE_VERSION = f"{SIGNATURE_VERSION}-chunks"
+_SHINGLE_WORDS = 5
+_SIGNATURE_SIZE = 128
+# Estimated Jaccard similarity at or above which two sources count as the same material
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# Texts with fewer shingles than this are too short to compare reliably (a one-line note)
+_MIN_SHINGLES = 20
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Material types in the order build_user_prompt presents them; of two duplicates the one
+# with the earlier type is kept (a past test uploaded again as a handout stays a past test)
+_TYPE_PRIORITY = {"past_test": 0, "handout": 1, "note": 2, "study_guide": 3}
+
+
+def minhash_signature(text: str) -> list[int]:
+    """Ascending list of the smallest 64-bit hashes of the text's word 5-gram shingles."""
+    words = _WORD_RE.findall((text or "").lower())
+    if len(words) < _SHINGLE_WORDS:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + _SHINGLE_WORDS]) for i in range(len(words) - _SHINGLE_WORDS + 1)}
+    hashes = (
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for s in shingles
+    )
+    return heapq.nsmallest(_SIGNATURE_SIZE, hashes)
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+    """
+    Estimated Jaccard similarity of the shingle sets behind two signatures (bottom-k
+    estimator: the share of the k smallest hashes of the union that both sets contain).
+    """
+    if len(a) < _MIN_SHINGLES or len(b) < _MIN_SHINGLES:
+        return 0.0
+    sa, sb = set(a), set(b)
+    k = min(_SIGNATURE_SIZE, len(sa | sb))
+    union_k = heapq.nsmallest(k, sa | sb)
+    return sum(1 for h in union_k if h in sa and h in sb) / k
+
+
+class SignatureCache:
+    """Signatures by text hash, persisted in text_signatures. Used from the request thread only."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_many(self, hashes: list[str], version: str = SIGNATURE_VERSION) -> dict[str, list[int]]:
+        if not hashes:
+            return {}
+        rows = (
+            self.db.query(TextSignature.text_hash, TextSignature.signature)
+            .filter(TextSignature.text_hash.in_(set(hashes)), TextSignature.version == version)
+            .all()
+        )
+        return {h: sig for h, sig in rows}
+
+    def put_many(self, signatures: dict[str, list[int]], version: str = SIGNATURE_VERSION) -> None:
+        """
+        Store new signatures in one commit, one savepoint per row: a concurrent request storing
+        the same text first only skips that row (see DigestCache.put_many).
+        """
+        for h, sig in signatures.items():
+            try:
+                with self.db.begin_nested():
+                    self.db.add(TextSignature(text_hash=h, version=version, signature=sig))
+            except IntegrityError:
+                pass
+        self.db.commit()
+
+    def signatures_for(self, texts: dict[str, str]) -> dict[str, list[int]]:
+        """texts maps text hash -> text. Returns a signature per hash, computing and storing the missing ones."""
+        found = self.get_many(list(texts))
+        fresh = {h: minhash_signature(t) for h, t in texts.items() if h not in found}
+        if fresh:
+            self.put_many(fresh)
+        return {**found, **fresh}
+
+
+def collapse_near_duplicates(
+    typed_sources: list[tuple[str, str, str]],
+    signature_cache: SignatureCache | None = None,
+) -> tuple[list[tuple[str, str, str]], list[tuple[str, str, str]]]:
+    """
+    Keep one source of each group of near-duplicates. Returns (kept typed_sources in their
+    original order, dropped sources as (material_type, label, label of the kept copy)).
+    The kept copy is the one with the highest-priority material type, then the longest text.
+    Without a cache the signatures are computed in memory for this call only.
+    """
+    if len(typed_sources) < 2:
+        return typed_sources, []
+    texts = {text_hash(text): text for _, _, text in typed_sources if text and text.strip()}
+    if signature_cache is not None:
+        signatures = signature_cache.signatures_for(texts)
+    else:
+        signatures = {h: minhash_signature(t) for h, t in texts.items()}
+    sigs = [signatures.get(text_hash(text)) or [] for _, _, text in typed_sources]
+
+    order = sorted(
+        range(len(typed_sources)),
+        key=lambda i: (
+            _TYPE_PRIORITY.get(typed_sources[i][0], len(_TYPE_PRIORITY)),
+            -len(typed_sources[i][2] or ""),
+            i,
+        ),
+    )
+    kept: list[int] = []
+    duplicate_of: dict[int, int] = {}
+    for i in order:
+        match = next((j for j in kept if similarity(sigs[i], sigs[j]) >= NEAR_DUPLICATE_THRESHOLD), None)
+        if match is None:
+            kept.append(i)
+        else:
+            duplicate_of[i] = match
+
+    if duplicate_of:
+        logger.info(
+            "Collapsed %d near-duplicate source(s): %s", len(duplicate_of),
+            ", ".join(f"{typed_sources[i][1]} ~ {typed_sources[j][1]}" for i, j in duplicate_of.items()),
+        )
+    return (
+        [src for i, src in enumerate(typed_sources) if i not in duplicate_of],
+        [(typed_sources[i][0], typed_sources[i][1], typed_sources[j][1]) for i, j in sorted(duplicate_of.items())],
+    )
+
+
+def find_attachment_duplicates(course_id: int, attachment_ids: list[int], db: Session) -> list[dict]:
+    """
+    For each of the given (indexed) course attachments, the most similar other attachment of
+    the course if it is a near-duplicate: [{"file_name", "duplicate_of", "similarity"}].
+    Texts come from the retrieval index chunks, so nothing is extracted again: a stored
+    signature of the exact text is used when there is one, otherwise one is computed from the
+    joined chunks and stored under its own version.
+    """
+    rows = (
+        db.query(CourseTextChunk.attachment_id, CourseTextChunk.text_hash, CourseTextChunk.content)
+        .filter(CourseTextChunk.course_id == course_id)
+        .order_by(CourseTextChunk.attachment_id, CourseTextChunk.chunk_index)
+        .all()
+    )
+    hash_by_att: dict[int, str] = {}
+    owner_by_hash: dict[str, int] = {}  # chunks of identical texts are only joined once
+    chunks_by_hash: dict[str, list[str]] = {}
+    for att_id, h, content in rows:
+        hash_by_att[att_id] = h
+        if owner_by_hash.setdefault(h, att_id) == att_id:
+            chunks_by_hash.setdefault(h, []).append(content)
+    cache = SignatureCache(db)
+    stored = cache.get_many(list(chunks_by_hash))
+    missing = [h for h in chunks_by_hash if h not in stored]
+    approximated = cache.get_many(missing, version=_CHUNK_SIGNATURE_VERSION)
+    # Hard splits inside long lines break a few words, so this is close to, not equal to,
+    # the exact text's signature
+    fresh = {h: minhash_signature("\n\n".join(chunks_by_hash[h])) for h in missing if h not in approximated}
+    if fresh:
+        cache.put_many(fresh, version=_CHUNK_SIGNATURE_VERSION)
+    signatures = {**stored, **approximated, **fresh}
+
+    names = dict(
+        db.query(CourseAttachment.id, CourseAttachment.file_name)
+        .filter(CourseAttachment.course_id == course_id)
+        .all()
+    )
+    warnings = []
+    for att_id in attachment_ids:
+        sig = signatures.get(hash_by_att.get(att_id))
+        if not sig:
+            continue
+        best, best_score = None, 0.0
+        for other_id, h in hash_by_att.items():
+            if other_id == att_id or other_id not in names:
+                continue
+            score = similarity(sig, signatures.get(h) or [])
+            if score > best_score:
+                best, best_score = other_id, score
+        if best is not None and best_score >= NEAR_DUPLICATE_THRESHOLD:
+            warnings.append({
+                "file_name": names.get(att_id, ""),
+                "duplicate_of": names[best],
+                "similarity": round(best_score, 2),
+            })
+    return warnings
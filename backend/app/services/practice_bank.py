@@ -0,0 +1,131 @@
+"""
+Practice-question bank built from generated guides.
+
+Every guide ends with a "## Practice Questions" section of **Q:** / **A:** pairs (see
+llm_service's OUTPUT FORMAT). When a guide's output is stored, the pairs are parsed into
+PracticeQuestion rows tagged with the guide's user, course and test block, so quiz sets
+are served from the database without regenerating anything. Questions repeated by a later
+guide for the same block share a content hash and are served once.
+"""
+
+import hashlib
+import re
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.guide import GuideSectionKind, GuideStatus, PracticeQuestion, StudyGuide, StudyGuideOutput
+from app.services.guide_sections import parse_guide_sections
+
+# "**Q:** ...", "1. **Q:** ...", "**Q3.** ...", "- **Question:** ..." (and the same for A / Answer)
+_Q_RE = re.compile(r"^\s*(?:[-*]\s+)?(?:\d+[.)]\s*)?\*\*\s*Q(?:uestion)?\s*\d*\s*[:.]\s*(?:\*\*)?\s*(.*)$", re.IGNORECASE)
+_A_RE = re.compile(r"^\s*(?:[-*]\s+)?\*\*\s*A(?:nswer)?\s*[:.]\s*(?:\*\*)?\s*(.*)$", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _clean(lines: list[str]) -> str:
+    text = "\n".join(lines).strip()
+    # "**Q: whole question in bold**" leaves a closing marker behind
+    if text.endswith("**") and text.count("**") % 2 == 1:
+        text = text[:-2].rstrip()
+    return text
+
+
+def parse_practice_questions(markdown: str) -> list[tuple[str, str]]:
+    """(question, answer) pairs of a practice section, in order. A question without an answer gets ""."""
+    pairs: list[tuple[str, str]] = []
+    question: list[str] | None = None
+    answer: list[str] | None = None
+
+    def flush():
+        if question is not None and _clean(question):
+            pairs.append((_clean(question), _clean(answer or [])))
+
+    for line in (markdown or "").splitlines():
+        if line.startswith("#"):
+            continue
+        q = _Q_RE.match(line)
+        a = None if q else _A_RE.match(line)
+        if q:
+            flush()
+            question, answer = [q.group(1)], None
+        elif a and question is not None and answer is None:
+            answer = [a.group(1)]
+        elif answer is not None:
+            answer.append(line)
+        elif question is not None:
+            question.append(line)
+    flush()
+    return pairs
+
+
+def question_hash(question: str) -> str:
+    """Hash of the question's words, insensitive to case, punctuation and Markdown."""
+    return hashlib.sha256(" ".join(_WORD_RE.findall(question.lower())).encode("utf-8")).hexdigest()
+
+
+def store_practice_questions(guide: StudyGuide, sections: list[dict], db: Session) -> int:
+    """Replace the guide's bank entries with the pairs of its practice sections. The caller commits."""
+    db.query(PracticeQuestion).filter(PracticeQuestion.guide_id == guide.id).delete(synchronize_session=False)
+    pairs = [
+        pair
+        for section in sections if section["kind"] == GuideSectionKind.PRACTICE
+        for pair in parse_practice_questions(section["content"])
+    ]
+    for position, (question, answer) in enumerate(pairs):
+        db.add(PracticeQuestion(
+            guide_id=guide.id,
+            user_id=guide.user_id,
+            course_id=guide.course_id,
+            test_id=guide.test_id,
+            position=position,
+            question=question,
+            answer=answer,
+            content_hash=question_hash(question),
+        ))
+    return len(pairs)
+
+
+def backfill_practice_questions(db: Session) -> int:
+    """Index completed guides stored before the bank existed. Returns the number of guides indexed."""
+    indexed = db.query(PracticeQuestion.id).filter(PracticeQuestion.guide_id == StudyGuide.id)
+    guides = (
+        db.query(StudyGuide)
+        .join(StudyGuideOutput, StudyGuideOutput.guide_id == StudyGuide.id)
+        .filter(StudyGuide.status == GuideStatus.completed.value, ~indexed.exists())
+        .all()
+    )
+    count = 0
+    for guide in guides:
+        if store_practice_questions(guide, parse_guide_sections(guide.output.content), db):
+            count += 1
+    if count:
+        db.commit()
+    return count
+
+
+def query_practice_questions(
+    db: Session,
+    user_id: int,
+    course_id: int | None = None,
+    test_id: int | None = None,
+    guide_id: int | None = None,
+    search: str | None = None,
+):
+    """The user's bank filtered by course, block, guide and question text, one row per distinct question."""
+    filters = [PracticeQuestion.user_id == user_id]
+    if course_id is not None:
+        filters.append(PracticeQuestion.course_id == course_id)
+    if test_id is not None:
+        filters.append(PracticeQuestion.test_id == test_id)
+    if guide_id is not None:
+        filters.append(PracticeQuestion.guide_id == guide_id)
+    if search:
+        filters.append(PracticeQuestion.question.ilike(f"%{search}%"))
+    # The newest copy of a question repeated across guides stands for all of them
+    latest = (
+        db.query(func.max(PracticeQuestion.id))
+        .filter(*filters)
+        .group_by(PracticeQuestion.content_hash)
+    )
+    return db.query(PracticeQuestion).filter(PracticeQuestion.id.in_(latest))
@@ -0,0 +1,129 @@
+"""
+Boilerplate stripping for extracted source text before prompt assembly.
+
+Slide decks and exported PDFs repeat the same headers, footers, page numbers, copyright
+lines and course codes on every page, which eats into the per-source character budget in
+llm_service.build_user_prompt. compress_sources removes:
+
+  - page-number lines ("Page 3 of 40", "12 / 40"; not bare numbers, which may be answers),
+    wherever they repeat in a source;
+  - later repeats of a short line that occurs _MIN_REPEATS+ times in one source, or twice
+    in a source when most sources of the prompt share it (course codes, copyright notices).
+    The first occurrence in each source is kept, so a line repeated for a reason, or a
+    topic heading several handouts have in common, is never lost entirely;
+
+and collapses runs of spaces and blank lines. Lines are compared case- and
+whitespace-insensitively; digits are only masked to recognise page numbers, since lines
+that differ by a number ("Trial 1 ...", "Trial 2 ...") are usually content. Enumerated
+lines ("a) True", "3. Define ...") are never treated as boilerplate: in a past test they
+are the content. Per-source savings are returned as CompressionStats for reporting.
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+# A line must occur this many times in one source to count as a page header/footer
+_MIN_REPEATS = 3
+# Shared-line detection needs enough sources to tell boilerplate from a common phrase
+_MIN_DOCS_FOR_SHARED = 3
+# Boilerplate lines are short; longer repeated lines are more likely real content
+_MAX_BOILERPLATE_CHARS = 120
+_MIN_BOILERPLATE_CHARS = 6
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACE_RUN_RE = re.compile(r"[ \t ]+")
+_INNER_SPACE_RUN_RE = re.compile(r"(?<=\S)[ \t ]{2,}")
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+_PAGE_NUMBER_RE = re.compile(
+    r"^[-–—(\[]?\s*(?:(?:page|slide|p\.)\s*#(?:\s*(?:of|/)\s*#)?|#\s*(?:of|/)\s*#)\s*[-–—)\]]?$"
+)
+_ENUMERATED_RE = re.compile(r"^\(?(?:[a-h]|\d+|[ivx]{1,4})[).:]\s")
+
+
+@dataclass
+class CompressionStats:
+    label: str
+    chars_before: int
+    chars_after: int
+    lines_removed: int
+
+    @property
+    def saved_chars(self) -> int:
+        return self.chars_before - self.chars_after
+
+
+def _normalize(line: str) -> str:
+    return _SPACE_RUN_RE.sub(" ", line.strip().lower())
+
+
+def _is_page_number(norm: str) -> bool:
+    return len(norm) <= 24 and bool(_PAGE_NUMBER_RE.match(_DIGITS_RE.sub("#", norm)))
+
+
+def _is_candidate(norm: str) -> bool:
+    """Short, multi-word, non-enumerated lines can be headers/footers."""
+    return (
+        _MIN_BOILERPLATE_CHARS <= len(norm) <= _MAX_BOILERPLATE_CHARS
+        and " " in norm
+        and not _ENUMERATED_RE.match(norm)
+    )
+
+
+def _collapse_whitespace(text: str) -> str:
+    lines = [_INNER_SPACE_RUN_RE.sub(" ", line).rstrip() for line in text.split("\n")]
+    return _BLANK_RUN_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def compress_text(text: str, shared: set[str] | frozenset[str] = frozenset()) -> tuple[str, int]:
+    """
+    Strip boilerplate from one source. `shared` holds normalized lines common to most
+    sources (see shared_boilerplate). Returns (text, number of lines removed).
+    """
+    if not text or not text.strip():
+        return text, 0
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    norms = [_normalize(line) for line in lines]
+    page_numbers = [_is_page_number(n) for n in norms]
+    counts = Counter(n for n in norms if _is_candidate(n))
+    repeated = {n for n, c in counts.items() if c >= _MIN_REPEATS or (c >= 2 and n in shared)}
+    strip_page_numbers = sum(page_numbers) >= _MIN_REPEATS
+
+    kept: list[str] = []
+    seen: set[str] = set()
+    removed = 0
+    for line, norm, is_page_number in zip(lines, norms, page_numbers):
+        if norm in seen or (is_page_number and strip_page_numbers):
+            removed += 1
+            continue
+        if norm in repeated:
+            seen.add(norm)
+        kept.append(line)
+    return _collapse_whitespace("\n".join(kept)), removed
+
+
+def shared_boilerplate(texts: list[str]) -> set[str]:
+    """Normalized short lines that appear in most of the given sources (at least _MIN_DOCS_FOR_SHARED)."""
+    docs = [t for t in texts if t and t.strip()]
+    if len(docs) < _MIN_DOCS_FOR_SHARED:
+        return set()
+    doc_freq: Counter = Counter()
+    for text in docs:
+        doc_freq.update({n for n in map(_normalize, text.split("\n")) if _is_candidate(n)})
+    min_docs = max(_MIN_DOCS_FOR_SHARED, math.ceil(len(docs) / 2))
+    return {n for n, df in doc_freq.items() if df >= min_docs}
+
+
+def compress_sources(
+    typed_sources: list[tuple[str, str, str]],
+) -> tuple[list[tuple[str, str, str]], list[CompressionStats]]:
+    """Compress each (material_type, label, text) source; returns the new sources and per-source stats."""
+    shared = shared_boilerplate([text for _, _, text in typed_sources])
+    out: list[tuple[str, str, str]] = []
+    stats: list[CompressionStats] = []
+    for mtype, label, text in typed_sources:
+        compressed, removed = compress_text(text, shared)
+        out.append((mtype, label, compressed))
+        stats.append(CompressionStats(label, len(text or ""), len(compressed or ""), removed))
+    return out, stats
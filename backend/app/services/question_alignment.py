@@ -0,0 +1,149 @@
+"""
+Local alignment of past-test questions to handout passages.
+
+The block analysis used to send the first _MAX_CHARS_PER_FILE characters of every handout
+to the LLM, partly so it could report which handouts the test drew from. Here the past
+tests' questions (parsed by question_segmenter) are matched to handout paragraph chunks
+(retrieval_index.split_into_chunks): every question is scored against every chunk by
+cosine similarity of TF-IDF vectors (sublinear term frequency, smoothed IDF over this
+block's questions and chunks) in one NumPy matrix product.
+
+The result is a draft alignment: for each question, the best-matching chunks above
+ALIGNMENT_MIN_SIMILARITY. analysis_service uses it to send only the aligned passages of
+each handout and to fill high_signal_handouts without asking the LLM.
+"""
+
+import math
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from app.services.retrieval_index import split_into_chunks, tokenize
+
+# Cosine similarity below which a question is not considered drawn from a chunk
+ALIGNMENT_MIN_SIMILARITY = 0.12
+# Chunks kept per question (a question often spans two adjacent passages)
+_CHUNKS_PER_QUESTION = 2
+# Shared terms reported as a handout's topic coverage
+_COVERAGE_TERMS = 5
+
+
+@dataclass
+class HandoutChunk:
+    file_name: str
+    index: int  # position of the chunk in its handout
+    text: str
+
+
+@dataclass
+class BlockAlignment:
+    questions: list[str]
+    chunks: list[HandoutChunk]
+    # question index -> [(chunk index into `chunks`, similarity)], best first
+    matches: dict[int, list[tuple[int, float]]] = field(default_factory=dict)
+    # handout file name -> top terms the aligned questions and passages share
+    coverage_terms: dict[str, list[str]] = field(default_factory=dict)
+
+    @property
+    def aligned_question_count(self) -> int:
+        return sum(1 for m in self.matches.values() if m)
+
+    def chunks_for(self, file_name: str) -> list[HandoutChunk]:
+        """The handout's chunks that some question aligned to, in document order."""
+        picked = {i for m in self.matches.values() for i, _ in m if self.chunks[i].file_name == file_name}
+        return sorted((self.chunks[i] for i in picked), key=lambda c: c.index)
+
+    def high_signal_handouts(self) -> list[dict]:
+        """Draft high_signal_handouts: handouts by number of questions whose best match is in them."""
+        counts: Counter = Counter()
+        for m in self.matches.values():
+            if m:
+                counts[self.chunks[m[0][0]].file_name] += 1
+        return [
+            {
+                "file_name": name,
+                "topic_coverage": ", ".join(self.coverage_terms.get(name, [])),
+                "question_count": count,
+            }
+            for name, count in counts.most_common()
+        ]
+
+
+def tfidf_vectors(docs: list[list[str]], vocab_docs: int | None = None) -> tuple[np.ndarray, list[str]]:
+    """
+    L2-normalized TF-IDF rows (sublinear tf, smoothed idf) for tokenized docs, and the vocabulary.
+    Columns cover the terms of the first vocab_docs docs (default: all). A term that only
+    later docs contain adds nothing to their dot products with those first docs, so it gets
+    no column, though it still counts towards document frequencies and row norms.
+    """
+    counts = [Counter(tokens) for tokens in docs]
+    df = Counter(term for doc in counts for term in doc)
+    vocab: dict[str, int] = {}
+    for doc in counts[:vocab_docs]:
+        for term in doc:
+            vocab.setdefault(term, len(vocab))
+    rows: list[int] = []
+    cols: list[int] = []
+    vals: list[float] = []
+    norms = np.ones(len(docs), dtype=np.float32)
+    for row, doc in enumerate(counts):
+        squares = 0.0
+        for term, tf in doc.items():
+            weight = (1.0 + math.log(tf)) * (math.log((1 + len(docs)) / (1 + df[term])) + 1.0)
+            squares += weight * weight
+            col = vocab.get(term)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+                vals.append(weight)
+        if squares:
+            norms[row] = math.sqrt(squares)
+    matrix = np.zeros((len(docs), max(1, len(vocab))), dtype=np.float32)
+    if vals:
+        matrix[np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)] = vals
+    matrix /= norms[:, None]
+    return matrix, list(vocab)
+
+
+def align_questions(questions: list[str], handouts: list[tuple[str, str]]) -> BlockAlignment | None:
+    """
+    Align past-test questions to chunks of the (file_name, text) handouts.
+    None when there are no questions or the handouts have no text.
+    """
+    chunks = [
+        HandoutChunk(name, i, chunk)
+        for name, text in handouts
+        for i, chunk in enumerate(split_into_chunks(text))
+    ]
+    if not questions or not chunks:
+        return None
+
+    tokenized = [tokenize(q) for q in questions] + [tokenize(c.text) for c in chunks]
+    # Columns only for question terms: the matrix stays questions' vocabulary wide however
+    # large the handouts are
+    vectors, vocab = tfidf_vectors(tokenized, vocab_docs=len(questions))
+    q_vecs, c_vecs = vectors[:len(questions)], vectors[len(questions):]
+    sims = q_vecs @ c_vecs.T  # questions x chunks
+
+    alignment = BlockAlignment(questions=questions, chunks=chunks)
+    top = np.argsort(-sims, axis=1)[:, :_CHUNKS_PER_QUESTION]
+    for qi in range(len(questions)):
+        alignment.matches[qi] = [
+            (int(ci), round(float(sims[qi, ci]), 3))
+            for ci in top[qi]
+            if sims[qi, ci] >= ALIGNMENT_MIN_SIMILARITY
+        ]
+
+    # Coverage terms per handout: weight each term by how strongly it is shared between the
+    # aligned questions and their matched chunks (element-wise product of the vectors)
+    shared: dict[str, np.ndarray] = {}
+    for qi, m in alignment.matches.items():
+        for ci, _ in m:
+            name = chunks[ci].file_name
+            contribution = q_vecs[qi] * c_vecs[ci]
+            shared[name] = shared[name] + contribution if name in shared else contribution
+    for name, weights in shared.items():
+        best = np.argsort(-weights)[:_COVERAGE_TERMS]
+        alignment.coverage_terms[name] = [vocab[i] for i in best if weights[i] > 0]
+    return alignment
@@ -0,0 +1,232 @@
+"""
+Deterministic parsing of extracted past-test text into questions.
+
+Past tests number their questions ("1.", "2)", "Q3", "Question 4:"); a question runs from
+its number to the next one, so lettered answer options and sub-parts stay with it. Text
+before the first question (instructions, the header) is dropped.
+
+parse_questions goes further and reads each question's structure:
+
+  - lettered items ("a) ...", "(B) ...", several on one line or one per line) are a
+    multiple-choice option group when they are short answers, or sub-parts ("a) Explain
+    why ... (4 pts)") when they are questions themselves;
+  - point values ("(5 pts)", "[2 points]", "10 marks");
+  - answer space: underscore lines or runs of empty lines (free response) and inline
+    blanks ("The ____ is ...", fill-in-the-blank);
+
+and classifies it into the QuestionFormats buckets of the block analysis
+(multiple_choice, free_response, problem_solving, short_answer). Each question also gets
+a content hash of its normalized wording, so the same question on two past tests is
+recognised as one. Parsed questions are stored as PastTestQuestion rows per attachment.
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import Session
+
+from app.models.course import CourseAttachment, PastTestQuestion
+from app.services.retrieval_index import text_hash
+
+# Bump when parsing or classification changes, so stored questions are re-parsed
+QUESTION_PARSER_VERSION = "1"
+
+QUESTION_FORMATS = ("multiple_choice", "free_response", "problem_solving", "short_answer")
+
+# A question starts at a line beginning with its number: "1.", "2)", "Q3.", "Question 4:"
+_QUESTION_START_RE = re.compile(
+    r"^[ \t]*(?:(?:Q|Question)[ \t]*(\d{1,3})[.):]?|(\d{1,3})[.)])(?=\s)",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Fewer numbered lines than this is more likely a numbered list inside a prose document
+_MIN_QUESTIONS = 2
+
+# Lettered item marker at a line start or after whitespace: "a)", "(b)", "C.", "d:"
+_LETTER_RE = re.compile(r"(?:^|(?<=\s))\(?([a-hA-H])[).:](?=\s)", re.MULTILINE)
+_POINTS_RE = re.compile(r"[(\[]?\s*(\d+(?:\.\d+)?)\s*(?:pts?|points?|marks?)\b\.?\s*[)\]]?", re.IGNORECASE)
+_TRUE_FALSE_RE = re.compile(r"\b(?:true\s+or\s+false|t\s*/\s*f|true\s*/\s*false)\b", re.IGNORECASE)
+_BLANK_LINE_RE = re.compile(r"^[ \t]*_{5,}[ \t_]*$", re.MULTILINE)
+_INLINE_BLANK_RE = re.compile(r"\S[ \t]*_{3,}|_{3,}[ \t]*\S")
+_EMPTY_RUN_RE = re.compile(r"\n(?:[ \t]*\n){3,}")
+_SPACE_AROUND_NEWLINE_RE = re.compile(r"[ \t]*\n[ \t\n]*")
+_PROBLEM_RE = re.compile(
+    r"\b(?:calculate|compute|solve|derive|determine the (?:value|amount|number)|how (?:many|much)|"
+    r"show (?:all )?(?:your )?work|what is the (?:value|concentration|rate|probability|mass|ph))\b"
+    r"|\d\s*[×x*/^=]\s*\d|\d\s*(?:mol|mm|cm|kg|mg|ml|g|l|m|s|j|kj|°c|k|%)\b",
+    re.IGNORECASE,
+)
+_ESSAY_RE = re.compile(
+    r"\b(?:explain|describe|discuss|compare|contrast|justify|evaluate|argue|essay|why|"
+    r"in your own words|support your answer)\b",
+    re.IGNORECASE,
+)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Option texts are short answers; longer lettered items are sub-questions
+_MAX_OPTION_CHARS = 160
+# Questions worth this many points or more expect a written answer
+_FREE_RESPONSE_POINTS = 5
+
+
+@dataclass
+class ParsedQuestion:
+    number: str
+    text: str  # the question without its number, options included
+    stem: str  # text before the options / sub-parts
+    options: list[str] = field(default_factory=list)
+    parts: list[str] = field(default_factory=list)
+    points: float | None = None
+    answer_lines: int = 0  # underscore lines and runs of empty lines left for the answer
+    has_inline_blank: bool = False
+    format: str = "short_answer"
+    content_hash: str = ""
+
+
+def _numbered_questions(text: str) -> list[tuple[int, str]]:
+    """
+    (number, raw text) of each question, in order. After the first, numbers must increase by
+    at most 5 (a "3." inside question 12 is a sub-step, not a question). Returns [] when the
+    text does not look like a numbered test.
+    """
+    if not text:
+        return []
+    starts: list[tuple[int, int]] = []  # (number, offset)
+    last_number = 0
+    for match in _QUESTION_START_RE.finditer(text):
+        number = int(match.group(1) or match.group(2))
+        if starts and (number <= last_number or number > last_number + 5):
+            continue
+        starts.append((number, match.start()))
+        last_number = number
+    if len(starts) < _MIN_QUESTIONS:
+        return []
+    bounds = [offset for _, offset in starts] + [len(text)]
+    questions = [(number, text[offset:bounds[i + 1]].strip()) for i, (number, offset) in enumerate(starts)]
+    return [(number, raw) for number, raw in questions if raw]
+
+
+def _lettered_items(body: str) -> tuple[str, list[str]]:
+    """Split body at its first run of consecutive letter markers (a, b, c, ...). Returns (stem, items)."""
+    markers: list[re.Match] = []
+    for match in _LETTER_RE.finditer(body):
+        if match.group(1).lower() == chr(ord("a") + len(markers)):
+            markers.append(match)
+    if len(markers) < 2 or not body[:markers[0].start()].strip():
+        return body.strip(), []
+    bounds = [m.start() for m in markers] + [len(body)]
+    items = [body[m.end():bounds[i + 1]].strip() for i, m in enumerate(markers)]
+    return body[:markers[0].start()].strip(), items
+
+
+def _is_option_group(items: list[str]) -> bool:
+    return all(
+        item
+        and len(item) <= _MAX_OPTION_CHARS
+        and not item.endswith("?")
+        and not _POINTS_RE.search(item)
+        and not _BLANK_LINE_RE.search(item)
+        for item in items
+    )
+
+
+def classify_question(q: ParsedQuestion) -> str:
+    """One of QUESTION_FORMATS for a parsed question."""
+    if len(q.options) >= 2 or _TRUE_FALSE_RE.search(q.stem):
+        return "multiple_choice"
+    wording = " ".join([q.stem, *q.parts])
+    if _PROBLEM_RE.search(wording):
+        return "problem_solving"
+    if (
+        q.parts
+        or _ESSAY_RE.search(wording)
+        or q.answer_lines >= 2
+        or (q.points is not None and q.points >= _FREE_RESPONSE_POINTS)
+    ):
+        return "free_response"
+    return "short_answer"
+
+
+def question_hash(stem: str, options: list[str]) -> str:
+    """Hash of a question's wording, insensitive to case, punctuation, spacing, option order and points."""
+    words = _WORD_RE.findall(_POINTS_RE.sub(" ", " ".join([stem, *sorted(options)])).lower())
+    return hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest()
+
+
+def parse_questions(text: str) -> list[ParsedQuestion]:
+    """Parse a past test's extracted text into questions; [] when it is not a numbered test."""
+    parsed: list[ParsedQuestion] = []
+    for number, raw in _numbered_questions(text):
+        match = _QUESTION_START_RE.match(raw)
+        body = raw[match.end():] if match else raw
+        answer_lines = len(_BLANK_LINE_RE.findall(body)) + len(_EMPTY_RUN_RE.findall(body))
+        content = _BLANK_LINE_RE.sub("", body)
+        stem, items = _lettered_items(content)
+        options, parts = (items, []) if items and _is_option_group(items) else ([], items)
+        points_match = _POINTS_RE.search(raw)
+        q = ParsedQuestion(
+            number=str(number),
+            text=_collapse(content),
+            stem=_collapse(stem),
+            options=[_collapse(o) for o in options],
+            parts=[_collapse(p) for p in parts],
+            points=float(points_match.group(1)) if points_match else None,
+            answer_lines=answer_lines,
+            has_inline_blank=bool(_INLINE_BLANK_RE.search(stem)),
+        )
+        q.format = classify_question(q)
+        q.content_hash = question_hash(q.stem, q.options)
+        parsed.append(q)
+    return parsed
+
+
+def format_counts(formats: list[str]) -> dict[str, int]:
+    """Questions per format, with every QUESTION_FORMATS key present (the shape of question_formats)."""
+    counts = dict.fromkeys(QUESTION_FORMATS, 0)
+    for fmt in formats:
+        counts[fmt] = counts.get(fmt, 0) + 1
+    return counts
+
+
+def _collapse(text: str) -> str:
+    return _SPACE_AROUND_NEWLINE_RE.sub("\n", text).strip()
+
+
+# ---------------------------------------------------------------------------
+# Persisted per-attachment questions
+# ---------------------------------------------------------------------------
+
+def store_questions(att: CourseAttachment, text: str, db: Session) -> list[PastTestQuestion]:
+    """
+    Parsed questions of a past-test attachment, re-parsing only when its text or the parser
+    changed since the stored rows were made. Nothing is flushed (the analysis prompt is built
+    before a long LLM call, which must not hold a write lock); the caller commits.
+    """
+    source_hash = text_hash(text)
+    rows = (
+        db.query(PastTestQuestion)
+        .filter(PastTestQuestion.attachment_id == att.id)
+        .order_by(PastTestQuestion.position)
+        .all()
+    )
+    if rows and all(r.source_hash == source_hash and r.parser_version == QUESTION_PARSER_VERSION for r in rows):
+        return rows
+    for row in rows:
+        db.delete(row)
+    rows = [
+        PastTestQuestion(
+            attachment_id=att.id,
+            course_id=att.course_id,
+            position=i,
+            number=q.number,
+            text=q.text,
+            options=q.options or None,
+            points=q.points,
+            format=q.format,
+            content_hash=q.content_hash,
+            source_hash=source_hash,
+            parser_version=QUESTION_PARSER_VERSION,
+        )
+        for i, q in enumerate(parse_questions(text))
+    ]
+    db.add_all(rows)
+    return rows
@@ -0,0 +1,286 @@
+"""
+Local lexical retrieval over course materials (BM25 over paragraph chunks).
+
+Each course attachment's extracted text is split into paragraph-sized chunks and
+stored as CourseTextChunk rows with per-chunk term counts. The index is synced
+incrementally: only attachments without chunk rows (new uploads) are extracted
+and indexed; chunks of deleted attachments go away with the attachment.
+
+Prompt assembly uses the index to pick the chunks of a long source that are most
+relevant to the past-test questions and the student's instructions, instead of
+keeping only the first N characters of the file.
+"""
+
+import hashlib
+import math
+import re
+from collections import Counter
+
+from sqlalchemy.orm import Session
+
+from app.models.course import CourseAttachment, CourseTextChunk
+from app.services.file_parser import extract_text_from_bytes, extract_text_from_file
+
+# Target chunk size in characters; paragraphs are merged up to this size
+_CHUNK_TARGET_CHARS = 1_200
+# BM25 parameters (standard defaults)
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+_STOPWORDS = frozenset(
+    "a about above after again all also am an and any are as at be because been before being "
+    "below between both but by can could did do does doing down during each few for from further "
+    "had has have having he her here hers him his how i if in into is it its itself just me more "
+    "most my no nor not now of off on once only or other our ours out over own same she should so "
+    "some such than that the their theirs them then there these they this those through to too "
+    "under until up very was we were what when where which while who whom why will with would you "
+    "your yours".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens with stopwords and single characters removed."""
+    if not text:
+        return []
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def text_hash(text: str) -> str:
+    """Stable hash of extracted text; used to detect when an attachment needs re-indexing."""
+    return hashlib.sha256((text or "").encode("utf-8", errors="replace")).hexdigest()
+
+
+def split_into_chunks(text: str, target_chars: int = _CHUNK_TARGET_CHARS) -> list[str]:
+    """
+    Split text into paragraph chunks of roughly target_chars.
+    Short paragraphs are merged; long ones are split on line boundaries (hard split as last resort).
+    """
+    if not text or not text.strip():
+        return []
+    pieces: list[str] = []
+    for para in _PARAGRAPH_RE.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) <= target_chars:
+            pieces.append(para)
+            continue
+        current = ""
+        for line in para.split("\n"):
+            while len(line) > target_chars:
+                if current:
+                    pieces.append(current)
+                    current = ""
+                pieces.append(line[:target_chars])
+                line = line[target_chars:]
+            if current and len(current) + len(line) + 1 > target_chars:
+                pieces.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        if current.strip():
+            pieces.append(current)
+
+    chunks: list[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > target_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class BM25Index:
+    """
+    In-memory BM25 statistics over a set of chunks.
+    Chunks are (doc_key, term_counts, length) where doc_key identifies the source text.
+    """
+
+    def __init__(self, chunks: list[tuple[str, dict[str, int], int]]):
+        self.chunks = chunks
+        self.n_chunks = len(chunks)
+        total_len = sum(length for _, _, length in chunks)
+        self.avg_len = (total_len / self.n_chunks) if self.n_chunks else 0.0
+        df: Counter = Counter()
+        for _, counts, _ in chunks:
+            df.update(counts.keys())
+        self.doc_freq = dict(df)
+
+    @classmethod
+    def from_texts(cls, texts: list[str]) -> "BM25Index":
+        """Build an ad-hoc index (e.g. for uploaded files not stored as course attachments)."""
+        chunks: list[tuple[str, dict[str, int], int]] = []
+        for text in texts:
+            key = text_hash(text)
+            for chunk in split_into_chunks(text):
+                tokens = tokenize(chunk)
+                chunks.append((key, dict(Counter(tokens)), len(tokens)))
+        return cls(chunks)
+
+    def idf(self, term: str) -> float:
+        df = self.doc_freq.get(term, 0)
+        return math.log(1 + (self.n_chunks - df + 0.5) / (df + 0.5))
+
+    def score(self, query: dict[str, float], term_counts: dict[str, int], length: int) -> float:
+        """BM25 score of one chunk for a weighted query (term -> weight)."""
+        if not length or not query:
+            return 0.0
+        avg_len = self.avg_len or float(length)
+        norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * length / avg_len)
+        total = 0.0
+        for term, weight in query.items():
+            tf = term_counts.get(term)
+            if tf:
+                total += weight * self.idf(term) * tf * (_BM25_K1 + 1) / (tf + norm)
+        return total
+
+
+def build_relevance_query(past_test_texts: list[str], user_specs: str | None = None) -> dict[str, float]:
+    """
+    Weighted query terms from past-test questions and the student's instructions.
+    Repeated terms get log-scaled weight; user_specs terms are boosted so explicit requests win ties.
+    """
+    counts: Counter = Counter()
+    for text in past_test_texts:
+        counts.update(tokenize(text))
+    query = {term: 1.0 + math.log(c) for term, c in counts.items()}
+    for term in set(tokenize(user_specs or "")):
+        query[term] = query.get(term, 0.0) + 2.0
+    return query
+
+
+def select_relevant_text(
+    text: str,
+    query: dict[str, float],
+    max_chars: int,
+    index: BM25Index | None = None,
+) -> str:
+    """
+    Return at most ~max_chars of text made of the chunks most relevant to the query,
+    kept in document order with gap markers. Falls back to head order when nothing scores.
+    """
+    if len(text) <= max_chars:
+        return text
+    chunks = split_into_chunks(text)
+    if not chunks:
+        return text[:max_chars]
+    tokenized = [tokenize(c) for c in chunks]
+    if index is None or not index.n_chunks:
+        index = BM25Index.from_texts([text])
+
+    scored = []
+    for i, tokens in enumerate(tokenized):
+        s = index.score(query, Counter(tokens), len(tokens)) if query else 0.0
+        scored.append((s, i))
+    # Highest score first; ties (including "no query") keep document order
+    scored.sort(key=lambda x: (-x[0], x[1]))
+
+    selected: set[int] = set()
+    used = 0
+    for _, i in scored:
+        size = len(chunks[i]) + 8  # separator / gap marker allowance
+        if used + size > max_chars:
+            continue
+        selected.add(i)
+        used += size
+    if not selected:
+        return text[:max_chars]
+
+    out: list[str] = []
+    prev = -1
+    for i in sorted(selected):
+        if i != prev + 1:
+            out.append("[…]")
+        out.append(chunks[i])
+        prev = i
+    if prev != len(chunks) - 1:
+        out.append("[…]")
+    omitted = sum(len(c) for i, c in enumerate(chunks) if i not in selected)
+    out.append(
+        f"*[Relevant excerpts — {len(selected)} of {len(chunks)} sections shown, "
+        f"{omitted:,} characters omitted]*"
+    )
+    return "\n\n".join(out)
+
+
+# ---------------------------------------------------------------------------
+# Persisted per-course index
+# ---------------------------------------------------------------------------
+
+def _attachment_text(att: CourseAttachment) -> str:
+    content = getattr(att, "file_content", None)
+    if content is not None:
+        return extract_text_from_bytes(content, att.file_type or "") or ""
+    return extract_text_from_file(att.file_path, att.file_type or "") or ""
+
+
+def index_attachment(att: CourseAttachment, db: Session, text: str | None = None) -> None:
+    """(Re)build chunk rows for one attachment. Pass text when it has already been extracted."""
+    if text is None:
+        text = _attachment_text(att)
+    db.query(CourseTextChunk).filter(CourseTextChunk.attachment_id == att.id).delete(synchronize_session=False)
+    h = text_hash(text)
+    chunks = split_into_chunks(text)
+    if not chunks:
+        # Marker row so attachments without extractable text are not re-extracted on every sync
+        db.add(CourseTextChunk(
+            course_id=att.course_id, attachment_id=att.id, text_hash=h,
+            chunk_index=0, content="", term_counts={}, token_count=0,
+        ))
+        return
+    for i, chunk in enumerate(chunks):
+        tokens = tokenize(chunk)
+        db.add(CourseTextChunk(
+            course_id=att.course_id,
+            attachment_id=att.id,
+            text_hash=h,
+            chunk_index=i,
+            content=chunk,
+            term_counts=dict(Counter(tokens)),
+            token_count=len(tokens),
+        ))
+
+
+def sync_course_index(course_id: int, db: Session, texts: dict[int, str] | None = None) -> BM25Index:
+    """
+    Index any course attachments that have no chunks yet and return the course's BM25 index.
+    texts maps attachment_id -> already-extracted text, to avoid extracting the same file twice.
+    """
+    texts = texts or {}
+    attachments = db.query(CourseAttachment).filter(CourseAttachment.course_id == course_id).all()
+    indexed_ids = {
+        row[0] for row in
+        db.query(CourseTextChunk.attachment_id).filter(CourseTextChunk.course_id == course_id).distinct().all()
+    }
+    changed = False
+    for att in attachments:
+        text = texts.get(att.id)
+        if att.id in indexed_ids:
+            # Re-index only when the caller's freshly extracted text differs from what was indexed
+            if text is None:
+                continue
+            stored = db.query(CourseTextChunk.text_hash).filter(CourseTextChunk.attachment_id == att.id).first()
+            if stored and stored[0] == text_hash(text):
+                continue
+        index_attachment(att, db, text=text)
+        changed = True
+    if changed:
+        db.commit()
+    return load_course_index(course_id, db)
+
+
+def load_course_index(course_id: int, db: Session) -> BM25Index:
+    """Load the persisted chunk statistics for a course into an in-memory BM25 index."""
+    rows = (
+        db.query(CourseTextChunk.text_hash, CourseTextChunk.term_counts, CourseTextChunk.token_count)
+        .filter(CourseTextChunk.course_id == course_id, CourseTextChunk.token_count > 0)
+        .all()
+    )
+    return BM25Index([(h, counts or {}, n or 0) for h, counts, n in rows])
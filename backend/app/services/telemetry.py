@@ -0,0 +1,189 @@
+"""
+LLM call telemetry: one llm_calls row per provider call (written by llm_client) and per
+digest cache hit, with call site, user, model, token counts, latency, attempts and outcome.
+
+The user is bound per request with bind_user (the API layer knows it; the services do not).
+It lives in a context variable, so worker threads only see it when the task is submitted
+through submit_with_context. Rows are written in their own session so a failed or rolled
+back request still leaves its calls on record, and a telemetry failure never fails a call.
+"""
+
+import contextvars
+import logging
+from collections import defaultdict
+from concurrent.futures import Executor, Future
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.db import SessionLocal
+from app.models.telemetry import LLMCall, LLMCallOutcome
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_user_id: contextvars.ContextVar[int | None] = contextvars.ContextVar("llm_telemetry_user_id", default=None)
+
+GROUP_BY = ("day", "user", "call_site")
+PERCENTILES = (50, 95, 99)
+
+
+def bind_user(user_id: int | None) -> None:
+    """Attribute LLM calls made by the current request (and tasks it submits) to this user."""
+    _user_id.set(user_id)
+
+
+def submit_with_context(pool: Executor, fn, *args, **kwargs) -> Future:
+    """pool.submit that runs fn in a copy of the caller's context (keeps the bound user)."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def record_llm_call(
+    call_site: str,
+    model: str,
+    *,
+    latency_ms: float = 0.0,
+    attempts: int = 1,
+    prompt_tokens: int | None = None,
+    output_tokens: int | None = None,
+    cache_hit: bool = False,
+    outcome: str = LLMCallOutcome.OK,
+    error: str | None = None,
+) -> None:
+    if not settings.llm_telemetry_enabled:
+        return
+    db = SessionLocal()
+    try:
+        db.add(LLMCall(
+            call_site=call_site,
+            user_id=_user_id.get(),
+            model=model,
+            prompt_tokens=prompt_tokens,
+            output_tokens=output_tokens,
+            latency_ms=round(latency_ms, 1),
+            attempts=attempts,
+            cache_hit=1 if cache_hit else 0,
+            outcome=outcome,
+            error=error[:255] if error else None,
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("Could not record LLM call telemetry: %s", e)
+    finally:
+        db.close()
+
+
+def record_cache_hits(call_site: str, model: str, count: int) -> None:
+    """Record `count` calls that were served from a cache instead of the provider."""
+    if not settings.llm_telemetry_enabled or count <= 0:
+        return
+    db = SessionLocal()
+    try:
+        user_id = _user_id.get()
+        db.add_all([
+            LLMCall(
+                call_site=call_site, user_id=user_id, model=model, latency_ms=0.0, attempts=0,
+                cache_hit=1, outcome=LLMCallOutcome.CACHE_HIT,
+            )
+            for _ in range(count)
+        ])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("Could not record LLM cache hit telemetry: %s", e)
+    finally:
+        db.close()
+
+
+def estimated_cost_usd(prompt_tokens: int, output_tokens: int) -> float:
+    return (
+        prompt_tokens * settings.llm_price_input_per_mtok
+        + output_tokens * settings.llm_price_output_per_mtok
+    ) / 1_000_000
+
+
+def percentile(sorted_values: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile of an ascending list (None when empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))  # ceil(n * pct / 100)
+    return sorted_values[int(rank) - 1]
+
+
+def _day(created_at: datetime | None) -> str:
+    if created_at is None:
+        return "unknown"
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date().isoformat()
+
+
+def usage_summary(db: Session, days: int, group_by: str, limit: int | None = None) -> list[dict]:
+    """
+    Aggregate the last `days` days of llm_calls by "day", "user" or "call_site". Each group:
+      key, label, calls, provider_calls, cache_hits, errors, unavailable, retries,
+      prompt_tokens, output_tokens, estimated_cost_usd, latency_ms_p50/p95/p99/max
+    Latency percentiles cover provider calls only (cache hits have no latency). Groups are
+    ordered by day (newest first) or by total tokens (heaviest first); `limit` caps the list.
+    """
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of: {', '.join(GROUP_BY)}")
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    rows = (
+        db.query(
+            LLMCall.created_at, LLMCall.user_id, LLMCall.call_site, LLMCall.prompt_tokens,
+            LLMCall.output_tokens, LLMCall.latency_ms, LLMCall.attempts, LLMCall.cache_hit, LLMCall.outcome,
+        )
+        .filter(LLMCall.created_at >= since)
+        .all()
+    )
+
+    groups: dict = defaultdict(lambda: {
+        "calls": 0, "provider_calls": 0, "cache_hits": 0, "errors": 0, "unavailable": 0,
+        "retries": 0, "prompt_tokens": 0, "output_tokens": 0, "latencies": [],
+    })
+    for r in rows:
+        key = _day(r.created_at) if group_by == "day" else (r.user_id if group_by == "user" else r.call_site)
+        g = groups[key]
+        g["calls"] += 1
+        if r.cache_hit:
+            g["cache_hits"] += 1
+            continue
+        g["provider_calls"] += 1
+        g["retries"] += max(0, (r.attempts or 1) - 1)
+        g["prompt_tokens"] += r.prompt_tokens or 0
+        g["output_tokens"] += r.output_tokens or 0
+        g["latencies"].append(r.latency_ms or 0.0)
+        if r.outcome == LLMCallOutcome.ERROR:
+            g["errors"] += 1
+        elif r.outcome == LLMCallOutcome.UNAVAILABLE:
+            g["unavailable"] += 1
+
+    labels: dict = {}
+    if group_by == "user":
+        user_ids = [k for k in groups if k is not None]
+        if user_ids:
+            labels = dict(db.query(User.id, User.username).filter(User.id.in_(user_ids)).all())
+
+    result = []
+    for key, g in groups.items():
+        latencies = sorted(g.pop("latencies"))
+        item = {
+            "key": "none" if key is None else str(key),
+            "label": labels.get(key, "(no user)" if key is None else str(key)) if group_by == "user" else str(key),
+            **g,
+            "estimated_cost_usd": round(estimated_cost_usd(g["prompt_tokens"], g["output_tokens"]), 6),
+            "latency_ms_max": latencies[-1] if latencies else None,
+        }
+        for pct in PERCENTILES:
+            item[f"latency_ms_p{pct}"] = percentile(latencies, pct)
+        result.append(item)
+
+    if group_by == "day":
+        result.sort(key=lambda item: item["key"], reverse=True)
+    else:
+        result.sort(key=lambda item: item["prompt_tokens"] + item["output_tokens"], reverse=True)
+    return result[:limit] if limit else result
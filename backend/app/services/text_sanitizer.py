@@ -1,25 +1,52 @@
 """
 Sanitize text before sending to Gemini (or other LLM) APIs.
 Removes or replaces characters that can cause 400/invalid request or encoding issues.
+
+Extracted file text is sanitized once, in file_parser.extract_text_from_file, so prompt
+builders only need to sanitize short user-entered strings (labels, course names, specs).
+Stored copies of extracted text carry TEXT_NORMALIZATION_VERSION; a row with an older
+marker (or none) predates the current rules and is re-sanitized with ensure_normalized.
 """
 
 import re
 
+# Bump whenever sanitize_text_for_gemini changes what it produces
+TEXT_NORMALIZATION_VERSION = "1"
+
+# Null bytes are removed; other control characters (0x01-0x08, 0x0B, 0x0C, 0x0E-0x1F, 0x7F)
+# become spaces; tab, newline and carriage return are kept. Lone surrogates (invalid in
+# UTF-8) become "?", as an encode(errors="replace") round trip would produce.
+_CONTROL_CODES = (*range(0x01, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F)
+_ASCII_TABLE = {0x00: None, **{c: " " for c in _CONTROL_CODES}}
+_REPLACEMENTS = {"\x00": "", **{chr(c): " " for c in _CONTROL_CODES}}
+_UNSAFE_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ud800-\udfff]")
+
+
+def _replace(match: re.Match) -> str:
+    return _REPLACEMENTS.get(match.group(), "?")
+
 
 def sanitize_text_for_gemini(text: str) -> str:
     """
     Make text safe for Gemini API: valid UTF-8, no null/control characters.
     Keeps tab, newline, carriage return; replaces other control chars and invalid Unicode.
+
+    One pass over the text: ASCII text goes through str.translate (a C fast path for
+    ASCII tables); other text is scanned once and only rewritten if something is unsafe.
     """
     if not text:
         return text
-    # Ensure we have a string and normalize invalid UTF-8 / surrogates
     if isinstance(text, bytes):
         text = text.decode("utf-8", errors="replace")
-    # Replace surrogate code points (invalid in UTF-8 when not part of a pair)
-    text = text.encode("utf-8", errors="replace").decode("utf-8")
-    # Remove null bytes (Gemini can reject these)
-    text = text.replace("\x00", "")
-    # Replace control characters (0x01-0x08, 0x0B, 0x0C, 0x0E-0x1F, 0x7F) with space. Keep \t \n \r.
-    text = re.sub(r"[\x01-\x08\x0b\x0c\x0e-\x1f\x7f]", " ", text)
-    return text
+    if text.isascii():
+        return text.translate(_ASCII_TABLE)
+    if _UNSAFE_RE.search(text) is None:
+        return text
+    return _UNSAFE_RE.sub(_replace, text)
+
+
+def ensure_normalized(text: str | None, version: str | None) -> str:
+    """Stored extracted text as the current rules would produce it (sanitized unless already current)."""
+    if version == TEXT_NORMALIZATION_VERSION:
+        return text or ""
+    return sanitize_text_for_gemini(text or "")
@@ -0,0 +1,188 @@
+"""
+Topic-name clustering for professor profiles.
+
+Each analysis names topics in its own words ("Krebs cycle", "The Krebs Cycle (TCA)",
+"krebs-cycle"), so summing topic_frequency by exact string splits one topic into several
+rows and bloats the "Topics this professor consistently tests" list. Every topic string a
+professor's analyses use is mapped to a canonical topic in topic_aliases:
+
+  - strings that normalize to the same key (case, punctuation, leading articles) merge;
+  - otherwise the string joins the most similar canonical topic when the cosine similarity
+    of their character 3-gram TF-IDF vectors reaches TOPIC_MERGE_THRESHOLD and neither name
+    has a distinguishing token the other lacks (a number, a roman numeral or a short token
+    such as an acronym: "DNA replication" / "RNA replication", "World War I" / "World War II");
+  - otherwise it becomes a canonical topic of its own.
+
+Assignment is incremental: only strings without an alias are clustered, against the
+professor's existing canonical topics, so a mapping never changes once stored. Aliases
+record the CLUSTERING_VERSION they were made under; when the rules change, bump it and a
+professor's aliases are rebuilt from scratch at their next assignment. Character n-grams
+catch spelling, word-order and formatting variants; true synonyms with no shared spelling
+("Krebs cycle" / "citric acid cycle") stay separate.
+"""
+
+import re
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.course import AnalysisTopicCount, TopicAlias
+
+# Bump when the clustering rules change, so stored aliases are rebuilt
+CLUSTERING_VERSION = "v2"
+# Cosine similarity of character 3-gram TF-IDF vectors at or above which two names merge
+TOPIC_MERGE_THRESHOLD = 0.7
+_NGRAM = 3
+# Tokens up to this length are distinguishing (acronyms, gene and vitamin names)
+_SHORT_TOKEN_CHARS = 3
+
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+_LEADING_ARTICLE_RE = re.compile(r"^(?:the|a|an) ")
+_ROMAN_RE = re.compile(r"^(?=[ivxlcdm])m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})$")
+_ROMAN_VALUES = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100, "d": 500, "m": 1000}
+_STOPWORDS = {"an", "and", "as", "at", "by", "for", "in", "its", "of", "on", "or", "the", "to", "via", "vs"}
+
+
+def topic_key(topic: str) -> str:
+    """Case-, punctuation- and article-insensitive form of a topic name."""
+    key = _NON_WORD_RE.sub(" ", (topic or "").lower()).strip()
+    return _LEADING_ARTICLE_RE.sub("", key)
+
+
+def _roman_value(token: str) -> int:
+    values = [_ROMAN_VALUES[ch] for ch in token]
+    return sum(-v if i + 1 < len(values) and v < values[i + 1] else v for i, v in enumerate(values))
+
+
+def distinguishing_tokens(key: str) -> set[str]:
+    """
+    Tokens of a topic key that name a specific variant: numbers and roman numerals (both as
+    their integer value, so "Type 1" and "Type I" agree) and other tokens of up to
+    _SHORT_TOKEN_CHARS characters.
+    """
+    tokens = set()
+    for token in key.split():
+        if token.isdigit():
+            tokens.add(str(int(token)))
+        elif _ROMAN_RE.match(token):
+            tokens.add(str(_roman_value(token)))
+        elif len(token) <= _SHORT_TOKEN_CHARS and token not in _STOPWORDS:
+            tokens.add(token)
+    return tokens
+
+
+def _compatible(a: set[str], b: set[str]) -> bool:
+    """False when each name has a distinguishing token the other lacks ("DNA ..." / "RNA ...")."""
+    return not (a - b and b - a)
+
+
+def _ngrams(key: str) -> list[str]:
+    padded = f" {key} "
+    return [padded[i:i + _NGRAM] for i in range(len(padded) - _NGRAM + 1)]
+
+
+def tfidf_matrix(keys: list[str]) -> np.ndarray:
+    """L2-normalized character 3-gram TF-IDF vectors (one row per key; IDF over these keys)."""
+    vocab: dict[str, int] = {}
+    rows: list[int] = []
+    cols: list[int] = []
+    for row, key in enumerate(keys):
+        for gram in _ngrams(key):
+            rows.append(row)
+            cols.append(vocab.setdefault(gram, len(vocab)))
+    tf = np.zeros((len(keys), max(1, len(vocab))), dtype=np.float32)
+    np.add.at(tf, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(keys)) / (1 + df)) + 1.0  # smoothed, as in scikit-learn
+    weighted = tf * idf
+    norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+    return weighted / np.where(norms == 0, 1.0, norms)
+
+
+def cluster_topics(new_topics: list[str], canonical: list[str]) -> dict[str, str]:
+    """
+    Map each new topic name to a canonical name: an existing one from `canonical`, or an
+    earlier new topic, or itself. New topics are taken in the given order, so the first
+    spelling of a cluster becomes its canonical name.
+    """
+    canon_names = list(dict.fromkeys(canonical))
+    canon_by_key = {topic_key(c): c for c in canon_names}
+    pending = [t for t in dict.fromkeys(new_topics) if topic_key(t)]
+    mapping: dict[str, str] = {t: t for t in new_topics if not topic_key(t)}
+    if not pending:
+        return mapping
+
+    keys = [topic_key(c) for c in canon_names] + [topic_key(t) for t in pending]
+    vectors = tfidf_matrix(keys)
+    sims = vectors[len(canon_names):] @ vectors.T  # new topics x (canonical + new)
+
+    tokens = [distinguishing_tokens(key) for key in keys]
+    canon_rows = list(range(len(canon_names)))  # rows of `keys` that are canonical so far
+    for i, topic in enumerate(pending):
+        row = len(canon_names) + i
+        key = keys[row]
+        if key in canon_by_key:
+            mapping[topic] = canon_by_key[key]
+            continue
+        row_sims = sims[i, canon_rows] if canon_rows else np.empty(0)
+        # Most similar canonical topic above the threshold that does not name another variant
+        match = None
+        for j in np.argsort(-row_sims, kind="stable"):
+            if row_sims[j] < TOPIC_MERGE_THRESHOLD:
+                break
+            if _compatible(tokens[row], tokens[canon_rows[j]]):
+                match = canon_rows[j]
+                break
+        if match is not None:
+            mapping[topic] = canon_by_key[keys[match]]
+        else:
+            mapping[topic] = topic
+            canon_by_key[key] = topic
+            canon_rows.append(row)
+    return mapping
+
+
+def assign_topic_aliases(professor_id: int, db: Session) -> int:
+    """
+    Give every topic name in the professor's analysis_topic_counts rows a canonical topic,
+    clustering only the names that have no alias yet, most frequent first (so a new cluster is
+    named after its most common spelling). Aliases made under another CLUSTERING_VERSION are
+    all dropped and rebuilt. Commits; returns the number of new aliases.
+    """
+    aliases = (
+        db.query(TopicAlias.topic, TopicAlias.canonical, TopicAlias.clustering_version)
+        .filter(TopicAlias.professor_id == professor_id)
+        .all()
+    )
+    rebuild = any(version != CLUSTERING_VERSION for _, _, version in aliases)
+    if rebuild:
+        db.query(TopicAlias).filter(TopicAlias.professor_id == professor_id).delete(synchronize_session=False)
+        aliases = []
+    known = {topic: canonical for topic, canonical, _ in aliases}
+    used = [
+        topic for (topic,) in
+        db.query(AnalysisTopicCount.topic)
+        .filter(AnalysisTopicCount.professor_id == professor_id)
+        .group_by(AnalysisTopicCount.topic)
+        .order_by(func.sum(AnalysisTopicCount.count).desc(), AnalysisTopicCount.topic)
+        .all()
+    ]
+    new_topics = [t for t in used if t not in known]
+    if not new_topics:
+        if rebuild:
+            db.commit()
+        return 0
+    mapping = cluster_topics(new_topics, sorted(set(known.values())))
+    for topic, canonical in mapping.items():
+        db.add(TopicAlias(
+            professor_id=professor_id, topic=topic, canonical=canonical, clustering_version=CLUSTERING_VERSION,
+        ))
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent aggregation stored aliases first; its mapping is as good as ours
+        db.rollback()
+        return 0
+    return len(mapping)
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for text sanitization (app/services/text_sanitizer.py).
+
+Compares the previous implementation (UTF-8 encode/decode round trip + null-byte replace +
+regex substitution, run on every source each time a prompt was built) with the current
+single-pass sanitize_text_for_gemini, on ASCII, non-ASCII and "dirty" (control characters
+and lone surrogates) inputs of several sizes. Both must produce identical output.
+
+The second table shows what prompt assembly saves: before, each prompt re-sanitized every
+source; now extraction sanitizes once and build_user_prompt uses the stored text as is.
+
+Usage (from backend/):
+    python scripts/bench_sanitize.py
+    python scripts/bench_sanitize.py --sizes 100000,1000000,10000000 --repeat 5
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.services.text_sanitizer import sanitize_text_for_gemini  # noqa: E402
+
+_LEGACY_CONTROL_RE = re.compile(r"[\x01-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+
+def legacy_sanitize(text: str) -> str:
+    """The implementation sanitize_text_for_gemini replaced."""
+    if not text:
+        return text
+    text = text.encode("utf-8", errors="replace").decode("utf-8")
+    text = text.replace("\x00", "")
+    return _LEGACY_CONTROL_RE.sub(" ", text)
+
+
+def make_text(kind: str, size: int, rng: random.Random) -> str:
+    words = ["enzyme", "kinetics", "substrate", "equilibrium", "osmosis", "gradient", "membrane"]
+    if kind != "ascii":
+        words += ["café", "naïve", "—", "“quoted”", "µmol", "Δ G", "→"]
+    parts: list[str] = []
+    total = 0
+    while total < size:
+        line = " ".join(rng.choice(words) for _ in range(12))
+        if kind == "dirty" and rng.random() < 0.05:
+            line += rng.choice(["\x00", "\x0b", "\x0c", "\x07", "\ud83d"])
+        parts.append(line)
+        total += len(line) + 1
+    return "\n".join(parts)[:size]
+
+
+def best_of(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", default="100000,1000000,10000000", help="comma-separated input sizes in characters")
+    p.add_argument("--repeat", type=int, default=5, help="runs per measurement (best is reported)")
+    p.add_argument("--sources", type=int, default=12, help="sources per prompt for the prompt-assembly table")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+    rng = random.Random(args.seed)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    print(f"{'input':<8} {'chars':>11} {'legacy Mchar/s':>15} {'current Mchar/s':>16} {'speedup':>8}")
+    for kind in ("ascii", "unicode", "dirty"):
+        for size in sizes:
+            text = make_text(kind, size, rng)
+            if legacy_sanitize(text) != sanitize_text_for_gemini(text):
+                sys.exit(f"Output mismatch for {kind} input of {size} chars")
+            legacy = best_of(legacy_sanitize, text, args.repeat)
+            current = best_of(sanitize_text_for_gemini, text, args.repeat)
+            print(
+                f"{kind:<8} {size:>11,} {size / legacy / 1e6:>15.0f} {size / current / 1e6:>16.0f} "
+                f"{legacy / current:>7.1f}x"
+            )
+
+    # Prompt assembly: N sources of 12k-120k characters re-sanitized per prompt (legacy) vs none
+    sources = [make_text("unicode", rng.randint(12_000, 120_000), rng) for _ in range(args.sources)]
+    total = sum(len(s) for s in sources)
+    legacy_per_prompt = best_of(lambda texts: [legacy_sanitize(s) for s in texts], sources, args.repeat)
+    print()
+    print(f"Prompt assembly, {args.sources} sources / {total:,} chars:")
+    print(f"  legacy (sanitize every source per prompt): {legacy_per_prompt * 1000:.1f} ms")
+    print("  current (sanitized once at extraction):    0.0 ms")
+
+
+if __name__ == "__main__":
+    main()
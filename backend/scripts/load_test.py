@@ -0,0 +1,404 @@
+"""
+End-to-end load test for the API against the fake LLM backend.
+
+Starts the FastAPI app in-process (uvicorn, one worker) on a throwaway SQLite database
+seeded with verified users, a professor and a course with test blocks, then drives a
+weighted mix of requests from concurrent client threads:
+
+    login      POST /api/auth/login
+    materials  GET  /api/courses/{id}/materials
+    upload     POST /api/courses/{id}/files           (multipart; cleaned up with DELETE)
+    guide      POST /api/guides/from-block
+
+Reports throughput and p50/p95/p99 latency per endpoint, plus event-loop lag measured
+inside the server's loop (blocking work in async endpoints shows up there).
+
+Usage (from backend/):
+    python scripts/load_test.py --concurrency 16 --duration 60
+    python scripts/load_test.py --mix login=1,materials=6,upload=2,guide=1 --llm-latency 2 --llm-tps 150
+    python scripts/load_test.py --database-url postgresql://... --json > result.json
+
+Options mirror the fake provider settings (see app/services/llm_providers.py).
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+PASSWORD = "load-test-password"
+LAG_INTERVAL_S = 0.05
+
+_HANDOUT_PARAGRAPH = (
+    "Topic {n}: {term} describes how {other} interacts with the system under study. "
+    "Key definition: {term} is the process by which inputs are transformed. "
+    "Example {n}: when {other} increases, {term} responds by adjusting its rate."
+)
+_TERMS = [
+    "glycolysis", "oxidation", "equilibrium", "elasticity", "inflation", "recursion",
+    "photosynthesis", "entropy", "momentum", "diffusion", "osmosis", "catalysis",
+]
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--concurrency", type=int, default=8, help="concurrent client threads")
+    p.add_argument("--duration", type=float, default=30.0, help="seconds to drive load (after warmup)")
+    p.add_argument("--warmup", type=float, default=3.0, help="seconds of load excluded from stats")
+    p.add_argument("--users", type=int, default=4, help="seeded users (clients are spread across them)")
+    p.add_argument("--tests-per-course", type=int, default=3, help="test blocks per seeded course")
+    p.add_argument("--handout-kb", type=int, default=40, help="size of each seeded handout")
+    p.add_argument("--mix", default="login=1,materials=6,upload=2,guide=1", help="endpoint weights")
+    p.add_argument("--llm-latency", type=float, default=1.0, help="fake LLM seconds to first token")
+    p.add_argument("--llm-tps", type=float, default=200.0, help="fake LLM output tokens/sec (0 = instant)")
+    p.add_argument("--llm-failure-rate", type=float, default=0.0, help="fake LLM injected 503 rate")
+    p.add_argument("--database-url", default="", help="default: temporary SQLite file")
+    p.add_argument("--port", type=int, default=0, help="default: a free port")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    return p.parse_args()
+
+
+def configure_env(args: argparse.Namespace) -> str:
+    """Settings are read at import time, so the environment must be set before importing app."""
+    db_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='loadtest_'), 'load.db')}"
+    os.environ["DATABASE_URL"] = db_url
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_S"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TOKENS_PER_S"] = str(args.llm_tps)
+    os.environ["FAKE_LLM_FAILURE_RATE"] = str(args.llm_failure_rate)
+    os.environ["FAKE_LLM_SEED"] = str(args.seed)
+    os.environ["SECURE_COOKIES"] = "false"
+    os.environ.setdefault("SECRET_KEY", "load-test-secret")
+    return db_url
+
+
+def synthetic_text(kb: int, rng: random.Random) -> str:
+    parts, size, n = [], 0, 0
+    while size < kb * 1024:
+        term, other = rng.sample(_TERMS, 2)
+        para = _HANDOUT_PARAGRAPH.format(n=n, term=term, other=other)
+        parts.append(para)
+        size += len(para) + 2
+        n += 1
+    return "\n\n".join(parts)
+
+
+def seed_database(args: argparse.Namespace) -> list[dict]:
+    """Create verified users, each with a professor and a course whose blocks have a past test and a handout."""
+    from app.db import SessionLocal
+    from app.models.course import (
+        Course, CourseAttachment, CourseAttachmentTest, CourseAttachmentType, CourseTest, Professor,
+    )
+    from app.models.user import User
+    from app.services.auth_service import hash_password
+
+    rng = random.Random(args.seed)
+    password_hash = hash_password(PASSWORD)
+    run_id = uuid.uuid4().hex[:8]
+    seeded = []
+    db = SessionLocal()
+    try:
+        for u in range(args.users):
+            user = User(
+                username=f"load_{run_id}_{u}",
+                email=f"load_{run_id}_{u}@example.com",
+                password_hash=password_hash,
+                email_verified=True,
+            )
+            db.add(user)
+            db.flush()
+            prof = Professor(user_id=user.id, name=f"Professor {u}", specialties="Biology")
+            db.add(prof)
+            db.flush()
+            course = Course(user_id=user.id, official_name=f"Load Course {u}", nickname=f"LOAD{u}", professor_id=prof.id)
+            upload_course = Course(user_id=user.id, official_name=f"Upload Course {u}", nickname=f"UP{u}")
+            db.add_all([course, upload_course])
+            db.flush()
+            test_ids = []
+            for t in range(args.tests_per_course):
+                test = CourseTest(course_id=course.id, name=f"Exam {t + 1}", sort_order=t)
+                db.add(test)
+                db.flush()
+                test_ids.append(test.id)
+                for kind, kb in ((CourseAttachmentType.PAST_TEST, 4), (CourseAttachmentType.HANDOUT, args.handout_kb)):
+                    att = CourseAttachment(
+                        course_id=course.id,
+                        test_id=test.id,
+                        file_name=f"{kind}_{t + 1}.txt",
+                        file_type="txt",
+                        file_path=f"{kind}_{t + 1}.txt",
+                        file_content=synthetic_text(kb, rng).encode("utf-8"),
+                        attachment_kind=kind,
+                        allow_multiple_blocks=0,
+                    )
+                    db.add(att)
+                    db.flush()
+                    db.add(CourseAttachmentTest(attachment_id=att.id, test_id=test.id))
+            seeded.append({
+                "email": user.email,
+                "course_id": course.id,
+                "upload_course_id": upload_course.id,
+                "test_ids": test_ids,
+            })
+        db.commit()
+    finally:
+        db.close()
+    return seeded
+
+
+class ServerThread(threading.Thread):
+    """Runs uvicorn in its own event loop and samples loop lag (sleep overshoot) in that loop."""
+
+    def __init__(self, port: int):
+        super().__init__(daemon=True)
+        self.port = port
+        self.lag_samples: list[tuple[float, float]] = []  # (timestamp, lag seconds)
+        self.server = None
+        self.started = threading.Event()
+
+    async def _monitor_lag(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL_S)
+            self.lag_samples.append((time.perf_counter(), max(0.0, time.perf_counter() - t0 - LAG_INTERVAL_S)))
+
+    async def _serve(self) -> None:
+        import uvicorn
+        from app.db import engine
+        from app.main import app, on_startup
+        from app.migrations import migrate
+
+        migrate(engine)
+        on_startup()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off")
+        self.server = uvicorn.Server(config)
+        monitor = asyncio.create_task(self._monitor_lag())
+        serve = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.05)
+        self.started.set()
+        await serve
+        monitor.cancel()
+
+    def run(self) -> None:
+        asyncio.run(self._serve())
+
+
+class Client:
+    """Minimal keep-alive HTTP client (stdlib only) for one worker thread."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        self.token = ""
+
+    def request(self, method: str, path: str, body: bytes | None = None, content_type: str | None = None) -> tuple[int, bytes]:
+        headers = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if content_type:
+            headers["Content-Type"] = content_type
+        for attempt in range(2):
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.HTTPException, ConnectionError, socket.timeout):
+                self.conn.close()
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+                if attempt:
+                    raise
+        return 0, b""
+
+    def login(self, email: str) -> int:
+        status, body = self.request(
+            "POST", "/api/auth/login",
+            json.dumps({"email": email, "password": PASSWORD}).encode(), "application/json",
+        )
+        if status == 200:
+            self.token = json.loads(body).get("access_token", "")
+        return status
+
+
+def multipart(files: list[tuple[str, str, bytes]]) -> tuple[bytes, str]:
+    """Encode (field, filename, content) parts as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    out = bytearray()
+    for field, filename, content in files:
+        out += f"--{boundary}\r\n".encode()
+        out += f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode()
+        out += b"Content-Type: text/plain\r\n\r\n" + content + b"\r\n"
+    out += f"--{boundary}--\r\n".encode()
+    return bytes(out), f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def run_load(args: argparse.Namespace, port: int, seeded: list[dict]) -> tuple[dict, float, float]:
+    weights = {}
+    for part in args.mix.split(","):
+        name, _, w = part.partition("=")
+        if name.strip():
+            weights[name.strip()] = float(w or 1)
+    unknown = set(weights) - {"login", "materials", "upload", "guide"}
+    if unknown:
+        sys.exit(f"Unknown endpoint(s) in --mix: {', '.join(sorted(unknown))}")
+    names, wts = list(weights), list(weights.values())
+
+    samples: dict[str, list[tuple[float, float, int]]] = defaultdict(list)  # name -> (end time, latency, status)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+    upload_locks = [threading.Lock() for _ in seeded]
+    upload_text = synthetic_text(8, random.Random(args.seed)).encode()
+
+    def record(name: str, t0: float, status: int) -> None:
+        t1 = time.perf_counter()
+        with lock:
+            samples[name].append((t1, t1 - t0, status))
+
+    def worker(i: int) -> None:
+        rng = random.Random(args.seed * 1000 + i)
+        account = seeded[i % len(seeded)]
+        client = Client(port)
+        client.login(account["email"])
+        uploads = 0
+        while time.perf_counter() < stop_at:
+            name = rng.choices(names, wts)[0]
+            t0 = time.perf_counter()
+            if name == "login":
+                status = client.login(account["email"])
+            elif name == "materials":
+                status, _ = client.request("GET", f"/api/courses/{account['course_id']}/materials")
+            elif name == "upload":
+                body, ctype = multipart([("handouts", f"upload_{i}_{uploads}.txt", upload_text)])
+                # Uploads share a per-user course capped at 10 files: serialize per account and clean up
+                with upload_locks[i % len(seeded)]:
+                    status, _ = client.request("POST", f"/api/courses/{account['upload_course_id']}/files", body, ctype)
+                    record("upload", t0, status)
+                    uploads += 1
+                    _, raw = client.request("GET", f"/api/courses/{account['upload_course_id']}/materials")
+                    for att in json.loads(raw or b"{}").get("attachments", []):
+                        t_del = time.perf_counter()
+                        del_status, _ = client.request(
+                            "DELETE", f"/api/courses/{account['upload_course_id']}/attachments/{att['id']}",
+                        )
+                        record("delete_attachment", t_del, del_status)
+                continue
+            else:
+                test_id = rng.choice(account["test_ids"])
+                status, _ = client.request(
+                    "POST", "/api/guides/from-block",
+                    json.dumps({"course_id": account["course_id"], "test_id": test_id, "title": "Load test"}).encode(),
+                    "application/json",
+                )
+            record(name, t0, status)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, measure_from, stop_at
+
+
+def build_report(args, samples, lag_samples, measure_from: float, stop_at: float) -> dict:
+    window = max(1e-9, stop_at - measure_from)
+    endpoints = {}
+    for name in sorted(samples):
+        measured = [(lat, st) for end, lat, st in samples[name] if measure_from <= end <= stop_at]
+        lats = [lat * 1000 for lat, _ in measured]
+        errors = sum(1 for _, st in measured if st >= 400 or st == 0)
+        endpoints[name] = {
+            "requests": len(measured),
+            "errors": errors,
+            "throughput_rps": round(len(measured) / window, 2),
+            "p50_ms": round(percentile(lats, 50), 1),
+            "p95_ms": round(percentile(lats, 95), 1),
+            "p99_ms": round(percentile(lats, 99), 1),
+            "max_ms": round(max(lats), 1) if lats else 0.0,
+        }
+    lags = [lag * 1000 for ts, lag in lag_samples if measure_from <= ts <= stop_at]
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "mix": args.mix,
+            "llm_latency_s": args.llm_latency,
+            "llm_tokens_per_s": args.llm_tps,
+            "llm_failure_rate": args.llm_failure_rate,
+        },
+        "total_throughput_rps": round(total / window, 2),
+        "endpoints": endpoints,
+        "event_loop_lag_ms": {
+            "p50": round(percentile(lags, 50), 1),
+            "p99": round(percentile(lags, 99), 1),
+            "max": round(max(lags), 1) if lags else 0.0,
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    cfg = report["config"]
+    print(f"\nConcurrency {cfg['concurrency']}, {cfg['duration_s']:.0f}s, mix {cfg['mix']}")
+    print(f"Fake LLM: {cfg['llm_latency_s']}s latency, {cfg['llm_tokens_per_s']} tok/s, {cfg['llm_failure_rate']:.0%} failures\n")
+    print(f"{'endpoint':<20}{'reqs':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, e in report["endpoints"].items():
+        print(
+            f"{name:<20}{e['requests']:>7}{e['errors']:>8}{e['throughput_rps']:>9}"
+            f"{e['p50_ms']:>10}{e['p95_ms']:>10}{e['p99_ms']:>10}{e['max_ms']:>10}"
+        )
+    lag = report["event_loop_lag_ms"]
+    print(f"\nTotal throughput: {report['total_throughput_rps']} req/s")
+    print(f"Event-loop lag: p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+
+
+def main() -> None:
+    args = parse_args()
+    db_url = configure_env(args)
+    port = args.port
+    if not port:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+    server = ServerThread(port)
+    server.start()
+    if not server.started.wait(timeout=60):
+        sys.exit("Server did not start")
+    seeded = seed_database(args)
+    if not args.json:
+        print(f"Server on :{port}, database {db_url}, {len(seeded)} seeded user(s)")
+
+    samples, measure_from, stop_at = run_load(args, port, seeded)
+    server.server.should_exit = True
+    report = build_report(args, samples, server.lag_samples, measure_from, stop_at)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
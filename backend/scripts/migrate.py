@@ -0,0 +1,48 @@
+"""
+Apply pending schema migrations (app/migrations.py) to DATABASE_URL.
+
+Run once per deploy before starting the app (the Procfile's release step does this); the
+app refuses to start on an out-of-date schema unless AUTO_MIGRATE is set.
+
+Usage (from backend/):
+    python scripts/migrate.py            # migrate to the latest version
+    python scripts/migrate.py --status   # print the current and latest versions
+    python scripts/migrate.py --to 2     # migrate up to version 2
+"""
+import argparse
+import logging
+import os
+import sys
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.db import engine  # noqa: E402
+from app.migrations import LATEST_VERSION, MIGRATIONS, current_version, migrate  # noqa: E402
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--status", action="store_true", help="show versions and exit")
+    p.add_argument("--to", type=int, default=None, help="target version (default: latest)")
+    args = p.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if args.status:
+        print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+        print(f"Schema version: {'none' if version is None else version} (latest {LATEST_VERSION})")
+        for number, name, _ in MIGRATIONS:
+            mark = "x" if version is not None and number <= version else " "
+            print(f"  [{mark}] {number:03d} {name}")
+        return
+
+    applied = migrate(engine, args.to)
+    with engine.connect() as conn:
+        print(f"Schema at version {current_version(conn)}; applied {len(applied)} migration(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,3 +7,13 @@ export function getAdminUsers() {
 export function deleteUser(userId) {
   return api.delete(`/admin/users/${userId}`).then((res) => res.data)
 }
+
+export function getLlmUsage({ days = 7, groupBy = 'day', limit } = {}) {
+  return api
+    .get('/admin/llm-usage', { params: { days, group_by: groupBy, limit } })
+    .then((res) => res.data)
+}
+
+export function getPromptCompression({ days = 30 } = {}) {
+  return api.get('/admin/prompt-compression', { params: { days } }).then((res) => res.data)
+}
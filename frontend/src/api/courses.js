@@ -88,6 +88,12 @@ export async function duplicateAttachment(courseId, attachmentId) {
   return data
 }
 
+/** Questions parsed from a past-test attachment: [{ number, text, options, points, format, content_hash }] */
+export async function getAttachmentQuestions(courseId, attachmentId) {
+  const { data } = await api.get(`/courses/${courseId}/attachments/${attachmentId}/questions`)
+  return data
+}
+
 export async function deleteSyllabus(courseId) {
   await api.delete(`/courses/${courseId}/syllabus`)
 }
@@ -141,6 +147,11 @@ export async function analyzeTest(courseId, testId) {
   return data
 }
 
+export async function analyzeCourse(courseId, { reanalyze = false } = {}) {
+  const { data } = await api.post(`/courses/${courseId}/analyze`, null, { params: { reanalyze } })
+  return data
+}
+
 export async function getTestAnalysis(courseId, testId) {
   const { data } = await api.get(`/courses/${courseId}/tests/${testId}/analysis`)
   return data
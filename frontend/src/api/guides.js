@@ -15,6 +15,35 @@ export async function getGuide(id) {
   return data
 }
 
+/** Section list without Markdown unless includeContent; `kind` filters (e.g. 'at_a_glance') */
+export async function getGuideSections(id, { kind, includeContent = false } = {}) {
+  const { data } = await api.get(`/guides/${id}/sections`, {
+    params: { kind, include_content: includeContent },
+  })
+  return data
+}
+
+export async function getGuideSection(id, position) {
+  const { data } = await api.get(`/guides/${id}/sections/${position}`)
+  return data
+}
+
+export async function getGuideVersions(id) {
+  const { data } = await api.get(`/guides/${id}/versions`)
+  return data
+}
+
+export async function getGuideVersion(id, version) {
+  const { data } = await api.get(`/guides/${id}/versions/${version}`)
+  return data
+}
+
+/** Unified diff of `version` against `against` (default: the previous version) */
+export async function getGuideVersionDiff(id, version, against) {
+  const { data } = await api.get(`/guides/${id}/versions/${version}/diff`, { params: { against } })
+  return data
+}
+
 export async function createGuide(formData) {
   const { data } = await api.post('/guides', formData)
   return data
@@ -31,3 +60,9 @@ export async function updateGuide(id, body) {
   const { data } = await api.patch(`/guides/${id}`, body)
   return data
 }
+
+/** Refresh a block guide: regenerate only the topics whose materials changed. */
+export async function refreshGuide(id) {
+  const { data } = await api.post(`/guides/${id}/refresh`)
+  return data
+}
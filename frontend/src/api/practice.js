@@ -0,0 +1,19 @@
+import { api } from './client'
+
+export function getPracticeQuestions({ courseId, testId, guideId, q, limit = 50, offset = 0 } = {}) {
+  return api
+    .get('/practice/questions', {
+      params: { course_id: courseId, test_id: testId, guide_id: guideId, q, limit, offset },
+    })
+    .then((res) => res.data)
+}
+
+/** Random quiz of distinct questions; `exclude` lists question ids already shown this session. */
+export function getPracticeQuiz({ courseId, testId, count = 10, exclude = [] } = {}) {
+  return api
+    .get('/practice/quiz', {
+      params: { course_id: courseId, test_id: testId, count, exclude },
+      paramsSerializer: { indexes: null },
+    })
+    .then((res) => res.data)
+}